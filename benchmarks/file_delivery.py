@@ -0,0 +1,114 @@
+'''Static file delivery benchmark
+
+Serves a large file from a `PyWebHost` running in a child process,with `WriteContentToRequest`
+(which uses `sendfile`) and with the `streamcopy` loop it used before.Throughput and the server's
+CPU time per GiB are reported for these workloads:
+
+- `full`  : The whole file
+- `range` : The second half of the file,with a `Range` request
+
+usage:	python benchmarks/file_delivery.py [size in MiB] [downloads] [clients]
+'''
+import os,sys,time,socket,tempfile,threading,multiprocessing
+from http import HTTPStatus
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+from pywebhost import PyWebHost
+from pywebhost.modules import BinaryMessageWrapper,WriteContentToRequest,streamcopy,filesize
+
+def serve(ready,path):
+    server = PyWebHost(('127.0.0.1',0))
+
+    @server.route('/sendfile')
+    def zero_copy(initator,request,content):
+        WriteContentToRequest(request,path,partial_acknowledge=True,mime_type='application/octet-stream')
+
+    @server.route('/copy')
+    def copy(initator,request,content):
+        # What `WriteContentToRequest` used to do
+        length,start = filesize(path),0
+        Range = request.headers.get('Range')
+        with open(path,'rb') as stream:
+            if Range:
+                start = int(Range[6:].split('-')[0])
+                request.send_response(HTTPStatus.PARTIAL_CONTENT)
+                request.send_header('Content-Range','bytes %s-%s/%s' % (start,length - 1,length))
+            else:
+                request.send_response(HTTPStatus.OK)
+            request.send_header('Content-Length',str(length - start))
+            request.end_headers()
+            stream.seek(start)
+            streamcopy(stream,request.wfile,length - start)
+
+    @server.route('/cpu')
+    @BinaryMessageWrapper(read=False)
+    def cpu(initator,request,content):
+        request.send_response(200)
+        return str(time.process_time())
+
+    ready.put(server.server_address)
+    server.serve_forever()
+
+def download(address,path,headers,count,received):
+    '''Downloads `path` `count` times on one connection,discarding the body'''
+    buffer = bytearray(1 << 20)
+    request = ('GET %s HTTP/1.1\r\nHost: bench\r\n%s\r\n' % (path,headers)).encode()
+    with socket.create_connection(address) as sock:
+        for _ in range(count):
+            sock.sendall(request)
+            head = b''
+            while not b'\r\n\r\n' in head:
+                chunk = sock.recv(4096)
+                if not chunk:raise ConnectionError('Connection closed')
+                head += chunk
+            head,body = head.split(b'\r\n\r\n',1)
+            length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+            remaining = length - len(body)
+            while remaining:
+                size = sock.recv_into(buffer,min(remaining,len(buffer)))
+                if not size:raise ConnectionError('Connection closed')
+                remaining -= size
+            received.append(length)
+
+def server_cpu(address) -> float:
+    '''CPU seconds the server process has used so far'''
+    with socket.create_connection(address) as sock:
+        sock.sendall(b'GET /cpu HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:break
+            response += chunk
+    return float(response.split(b'\r\n\r\n',1)[1])
+
+def bench(address,path,headers,downloads,clients) -> tuple:
+    '''
+    Returns:
+        tuple : MiB per second,server CPU seconds per GiB
+    '''
+    received = []
+    threads = [threading.Thread(target=download,args=(address,path,headers,downloads,received)) for _ in range(clients)]
+    cpu,start = server_cpu(address),time.perf_counter()
+    for thread in threads:thread.start()
+    for thread in threads:thread.join()
+    elapsed,cpu = time.perf_counter() - start,server_cpu(address) - cpu
+    total = sum(received)
+    return total / elapsed / (1 << 20),cpu / (total / (1 << 30))
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    downloads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    with tempfile.NamedTemporaryFile(suffix='.bin') as file:
+        block = os.urandom(1 << 20)
+        for _ in range(size):file.write(block)
+        file.flush()
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=serve,args=(ready,file.name),daemon=True)
+        server.start()
+        address = ready.get()
+        print('%d MiB file,%d clients x %d downloads' % (size,clients,downloads))
+        print('%-8s %-10s %12s %18s' % ('workload','path','MiB/s','server CPU (s/GiB)'))
+        for name,headers in (('full',''),('range','Range: bytes=%d-\r\n' % (size << 19))):
+            for path in ('/copy','/sendfile'):
+                print('%-8s %-10s %12.0f %18.3f' % ((name,path) + bench(address,path,headers,downloads,clients)))
+        server.terminate()
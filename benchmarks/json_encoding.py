@@ -0,0 +1,41 @@
+'''JSON response encoding benchmark
+
+Encodes a list of rows the way `JSONMessageWrapper` used to (`json.dumps`,then `any2bytes`) and
+by streaming it with `JSONCodec.iterencode`,the way it does now.Time and peak memory allocated are reported.
+
+usage:	python benchmarks/json_encoding.py [rows]
+'''
+import os,sys,json,time,tracemalloc
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+from pywebhost.modules import any2bytes
+from pywebhost.modules.serializers import JSONCodec,NDJSONCodec
+
+def whole(rows):
+    # What `JSONMessageWrapper` used to do
+    return len(any2bytes(json.dumps(rows)))
+
+def streamed(codec):
+    def encode(rows):
+        return sum(len(block.encode()) for block in codec.iterencode(rows))
+    return encode
+
+def measure(encode,rows) -> tuple:
+    start = time.perf_counter()
+    size = encode(rows)
+    elapsed = time.perf_counter() - start
+    # Tracing slows everything down,so memory is measured on another run
+    tracemalloc.start()
+    encode(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size,elapsed,peak
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = [{'id' : i,'name' : 'row %d' % i,'values' : [i * 1.5,None,True]} for i in range(count)]
+    print('%d rows' % count)
+    print('%-12s %12s %10s %14s' % ('encoder','bytes','seconds','peak (MiB)'))
+    for name,encode in (('dumps',whole),('json',streamed(JSONCodec())),('ndjson',streamed(NDJSONCodec()))):
+        encode(rows[:1000]) # Warm up
+        size,elapsed,peak = measure(encode,rows)
+        print('%-12s %12d %10.3f %14.1f' % (name,size,elapsed,peak / (1 << 20)))
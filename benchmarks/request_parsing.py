@@ -0,0 +1,129 @@
+'''Request head parsing benchmark and conformance check
+
+Compares the single buffer parser (`read_head` + `Headers.parse_block`) with the line by line one
+(`readline` + `Headers.parse`) it replaced:
+
+- A corpus of well-formed,malformed and limit-exceeding heads,plus randomly mutated ones,must
+  produce the same request line,headers,errors and leftover bytes with both parsers
+- Parsing throughput of typical heads
+
+usage:	python benchmarks/request_parsing.py [iterations]
+'''
+import os,sys,random,timeit
+from io import BufferedReader,BytesIO
+from http import client
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+from pywebhost.handler import Headers,read_head,_MAXLINE,_MAXHEADERS
+
+BROWSER = (
+    b'GET /static/js/app.js?v=42 HTTP/1.1\r\n'
+    b'Host: localhost:1234\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8\r\n'
+    b'Accept-Language: en-US,en;q=0.5\r\n'
+    b'Accept-Encoding: gzip, deflate, br\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Cookie: sess_=0123456789abcdef0123456789abcdef; theme=dark\r\n'
+    b'Upgrade-Insecure-Requests: 1\r\n'
+    b'Sec-Fetch-Dest: document\r\n'
+    b'Sec-Fetch-Mode: navigate\r\n'
+    b'Sec-Fetch-Site: none\r\n\r\n'
+)
+MINIMAL = b'GET / HTTP/1.1\r\nHost: a\r\n\r\n'
+
+CORPUS = [
+    MINIMAL,
+    BROWSER,
+    BROWSER + MINIMAL,                                          # Pipelined
+    MINIMAL + b'body',                                          # Body is left unread
+    b'GET / HTTP/1.0\r\n\r\n',                                  # No headers
+    b'GET / HTTP/1.1\nHost: a\nX: b\n\n',                       # Bare LF line breaks
+    b'GET / HTTP/1.1\r\nHost: a\n\r\nrest',                     # Mixed line breaks
+    b'GET / HTTP/1.1\r\nHost:   spaced   \r\nX:\r\n\r\n',       # Whitespace,empty value
+    b'GET / HTTP/1.1\r\nHost: a:b:c\r\n\r\n',                   # Colons in the value
+    b'GET / HTTP/1.1\r\nno colon here\r\nHost: a\r\n\r\n',      # Malformed line is skipped
+    b'GET / HTTP/1.1\r\nHOST: a\r\nhost: b\r\n\r\n',            # Duplicates,the last one wins
+    b'\r\nGET / HTTP/1.1\r\n\r\n',                              # Empty request line
+    b'\n',
+    b'',                                                        # Closed connection
+    b'GET / HTTP/1.1\r\nHost: a\r\n',                           # Closed mid-head
+    b'GET /' + b'a' * (_MAXLINE + 10) + b' HTTP/1.1\r\n\r\n',   # Request line too long
+    b'GET / HTTP/1.1\r\nX: ' + b'a' * (_MAXLINE + 10) + b'\r\n\r\n',     # Header line too long
+    b'GET / HTTP/1.1\r\n' + b''.join(b'X%d: %d\r\n' % (i,i) for i in range(_MAXHEADERS)) + b'\r\n',
+    b'GET / HTTP/1.1\r\n' + b''.join(b'X%d: %d\r\n' % (i,i) for i in range(_MAXHEADERS + 1)) + b'\r\n',
+    b'GET / HTTP/1.1\r\n' + b''.join(b'X%d: %d\r\n' % (i,i % 7) for i in range(1000)) + b'\r\n',
+]
+
+STRICTER = [
+    # `_MAXHEADERS` used to count distinct names,it counts lines now
+    b'GET / HTTP/1.1\r\n' + b'X: y\r\n' * 5000 + b'\r\n',
+]
+
+def legacy_parse(rfile):
+    '''What `handle_one_request` / `parse_request` used to do'''
+    requestline = rfile.readline(_MAXLINE + 1)
+    if len(requestline) > _MAXLINE or requestline.strip() == b'':return requestline[:_MAXLINE + 1],None
+    return requestline,Headers.parse(rfile)
+
+def buffered_parse(rfile):
+    requestline,block = read_head(rfile)
+    if len(requestline) > _MAXLINE or requestline.strip() == b'':return requestline[:_MAXLINE + 1],None
+    return requestline,Headers.parse_block(block)
+
+def outcome(parser,data : bytes,buffer_size : int):
+    rfile = BufferedReader(BytesIO(data),buffer_size)
+    try:
+        requestline,headers = parser(rfile)
+    except client.HTTPException as e:
+        # Where the reading stopped doesn't matter here,the connection is closed
+        return type(e).__name__,str(e)
+    if headers is None:
+        return requestline,None # Same here
+    return requestline,dict(headers.items()),rfile.read()
+
+def mutate(rng : random.Random,data : bytes) -> bytes:
+    data = bytearray(data)
+    for _ in range(rng.randint(1,4)):
+        position = rng.randrange(len(data) + 1)
+        action = rng.randrange(4)
+        if action == 0:data[position:position] = rng.choice([b'\r',b'\n',b'\r\n',b':',b' ',b'\t',b'\r\n\r\n'])
+        elif action == 1:del data[position:position + rng.randint(1,8)]
+        elif action == 2:data[position:position] = bytes(rng.randrange(32,127) for _ in range(rng.randint(1,16)))
+        else:data = data[:position]
+    return bytes(data)
+
+def conformance(fuzz_cases : int = 20000) -> int:
+    rng,failures = random.Random(1234),0
+    cases = [(data,size) for data in CORPUS for size in (8192,7,64)]
+    cases += [(mutate(rng,rng.choice(CORPUS[:11])),rng.choice((8192,16,3))) for _ in range(fuzz_cases)]
+    for data,size in cases:
+        expected,got = outcome(legacy_parse,data,size),outcome(buffered_parse,data,size)
+        if expected != got:
+            failures += 1
+            if failures <= 10:print('MISMATCH %r (buffer %d)\n  legacy  : %.200r\n  buffered: %.200r' % (data[:120],size,expected,got))
+    for data in STRICTER:
+        if outcome(buffered_parse,data,8192)[0] != 'HTTPException':
+            failures += 1
+            print('NOT REJECTED %r' % data[:120])
+    print('conformance: %d cases,%d mismatches' % (len(cases) + len(STRICTER),failures))
+    return failures
+
+def throughput(number : int):
+    print('%-10s %16s %16s' % ('head','legacy (us)','buffered (us)'))
+    for name,data in (('minimal',MINIMAL),('browser',BROWSER)):
+        results = []
+        for parser in (legacy_parse,buffered_parse):
+            # Like a connection's `rfile`,with the head buffered already
+            rfiles = [BufferedReader(BytesIO(data)) for _ in range(number)]
+            for rfile in rfiles:rfile.peek(1)
+            rfiles = iter(rfiles)
+            def parse():
+                requestline,headers = parser(next(rfiles))
+                headers.get('Connection')
+            results.append(timeit.timeit(parse,number=number) * 1e6 / number)
+        print('%-10s %16.2f %16.2f' % ((name,) + tuple(results)))
+
+if __name__ == '__main__':
+    failures = conformance()
+    throughput(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
+    sys.exit(1 if failures else 0)
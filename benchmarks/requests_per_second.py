@@ -0,0 +1,107 @@
+'''Requests per second benchmark
+
+Serves a small response from a `PyWebHost` running in a child process,then hammers it from
+client threads.The client threads compete for the CPU as well,so the server's own CPU time per
+request is reported next to the throughput.These workloads are measured:
+
+- `keep-alive` : Every client sends its requests on one persistent connection
+- `close`      : Every request opens a new connection,so connection setup dominates
+- `error page` : Every request is answered with `send_error`
+
+usage:	python benchmarks/requests_per_second.py [seconds] [clients]
+'''
+import os,sys,time,socket,threading,multiprocessing
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+from pywebhost import PyWebHost
+from pywebhost.modules import BinaryMessageWrapper
+
+def serve(ready):
+    server = PyWebHost(('127.0.0.1',0))
+    server.request_queue_size = 128
+
+    @server.route('/')
+    @BinaryMessageWrapper(read=False)
+    def index(initator,request,content):
+        request.send_response(200)
+        return 'hello'
+
+    @server.route('/error')
+    def error(initator,request,content):
+        request.send_error(404)
+
+    @server.route('/cpu')
+    @BinaryMessageWrapper(read=False)
+    def cpu(initator,request,content):
+        request.send_response(200)
+        return str(time.process_time())
+
+    ready.put(server.server_address)
+    server.serve_forever()
+
+def read_response(sock : socket.socket,buffer : bytes) -> bytes:
+    '''Reads one response with a `Content-Length`,returns what's left of the buffer'''
+    while True:
+        head_end = buffer.find(b'\r\n\r\n')
+        if head_end >= 0:
+            head = buffer[:head_end].lower()
+            start = head.find(b'content-length:') + 15
+            length = int(head[start:head.find(b'\r\n',start) if head.find(b'\r\n',start) > 0 else None])
+            end = head_end + 4 + length
+            if len(buffer) >= end:return buffer[end:]
+        chunk = sock.recv(65536)
+        if not chunk:raise ConnectionError('Connection closed')
+        buffer += chunk
+
+def client(address,path,keepalive,deadline,counts):
+    done,request = 0,('GET %s HTTP/1.1\r\nHost: bench\r\n%s\r\n' % (path,'' if keepalive else 'Connection: close\r\n')).encode()
+    sock = None
+    while time.monotonic() < deadline:
+        if sock is None:sock = socket.create_connection(address)
+        sock.sendall(request)
+        read_response(sock,b'')
+        done += 1
+        if not keepalive:
+            sock.close()
+            sock = None
+    if sock:sock.close()
+    counts.append(done)
+
+def server_cpu(address) -> float:
+    '''CPU seconds the server process has used so far'''
+    with socket.create_connection(address) as sock:
+        sock.sendall(b'GET /cpu HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:break
+            response += chunk
+    return float(response.split(b'\r\n\r\n',1)[1])
+
+def bench(address,path,keepalive,seconds,clients) -> tuple:
+    '''
+    Returns:
+        tuple : requests per second,server CPU microseconds per request
+    '''
+    counts,deadline = [],time.monotonic() + seconds
+    threads = [threading.Thread(target=client,args=(address,path,keepalive,deadline,counts)) for _ in range(clients)]
+    cpu = server_cpu(address)
+    for thread in threads:thread.start()
+    for thread in threads:thread.join()
+    cpu = server_cpu(address) - cpu
+    return sum(counts) / seconds,cpu * 1e6 / max(sum(counts),1)
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve,args=(ready,),daemon=True)
+    server.start()
+    address = ready.get()
+    print('%-24s %12s %16s' % ('workload','requests/s','server CPU (us)'))
+    for name,path,keepalive in (
+        ('200 keep-alive','/',True),
+        ('200 close','/',False),
+        ('404 error page','/error',False)
+    ):
+        print('%-24s %12.0f %16.1f' % ((name,) + bench(address,path,keepalive,seconds,clients)))
+    server.terminate()
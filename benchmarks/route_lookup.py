@@ -0,0 +1,40 @@
+'''Route lookup benchmark
+
+Compares the linear `re.fullmatch` scan `PathMaker` used to do with the route index,
+for a growing count of routes.The LRU cache is disabled so every lookup hits the index.
+
+usage:	python benchmarks/route_lookup.py
+'''
+import os,sys,re,timeit
+sys.path.insert(0,os.path.join(os.path.dirname(__file__),'..'))
+from pywebhost import PathMaker
+
+def make_routes(count):
+    '''Mix of literal,prefix and regex routes,like a typical app would have'''
+    pathmaker = PathMaker()
+    pathmaker.cache_size = 0
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:pathmaker['/api/v1/resource%d' % i] = i
+        elif kind == 1:pathmaker['/static%d/.*' % i] = i
+        else:pathmaker['/users%d/(\\d+)/posts/(\\w+)' % i] = i
+    return pathmaker
+
+def linear_scan(pathmaker,key):
+    for pattern in list(pathmaker.keys())[::-1]:
+        if re.fullmatch(pattern,key):return dict.__getitem__(pathmaker,pattern)
+
+def bench(count,number=2000):
+    pathmaker = make_routes(count)
+    keys = ['/api/v1/resource0','/static1/js/app.js','/users2/42/posts/hello','/not/found']
+    pathmaker.match(keys[0]) # builds the index
+    linear = timeit.timeit(lambda:[linear_scan(pathmaker,k) for k in keys],number=number)
+    indexed = timeit.timeit(lambda:[pathmaker.match(k) for k in keys],number=number)
+    per_lookup = 1e6 / (number * len(keys))
+    return linear * per_lookup,indexed * per_lookup
+
+if __name__ == '__main__':
+    print('%8s %16s %16s' % ('routes','linear (us)','indexed (us)'))
+    for count in (10,50,100,200,500,1000):
+        linear,indexed = bench(count,number=200 if count >= 500 else 2000)
+        print('%8d %16.2f %16.2f' % (count,linear,indexed))
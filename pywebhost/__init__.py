@@ -1,15 +1,67 @@
 from http.client import SERVICE_UNAVAILABLE
 from pywebhost.modules import BadRequestException
 import selectors,socketserver,sys
-from socket import socket
-from .handler import Request
+from socket import socket, SHUT_RD, SHUT_RDWR
+from .handler import Request, render_error
+from .workers import WorkerPool
+from .keepalive import KeepAlivePoller
+from .admission import AdmissionController
+from .metrics import ServerMetrics
+from .profiler import Profiler
+import threading,time
 from .modules import *
 # from .modules import *
-from re import fullmatch
+from functools import lru_cache
+from typing import Any, NamedTuple
 from http import HTTPStatus
+import re
 
 __version__ = '1.2.8.4'
 
+class RouteMatch(NamedTuple):
+    '''Result of a `PathMaker.match` lookup'''
+    pattern : str
+    '''The pattern string the path was routed with'''
+    handler : Any
+    '''The object stored under `pattern`'''
+    groups : tuple
+    '''Groups captured by `pattern`,empty for literal & prefix routes'''
+
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+_REGEX_BACKREFERENCE = re.compile(r'\\[1-9]')
+
+class _TrieNode(object):
+    '''Node of the `PathMaker` prefix trie'''
+    __slots__ = ('children','prefix','regexes','alternation','groupmap')
+    def __init__(self):
+        self.children,self.prefix,self.regexes,self.alternation,self.groupmap = dict(),None,list(),None,dict()
+
+    def walk(self):
+        yield self
+        for child in self.children.values():yield from child.walk()
+
+    def compile(self,fallbacks : list):
+        '''Compiles the regexes sharing this prefix into one alternation
+
+        Patterns that cannot be combined (e.g. duplicated group names) are moved to `fallbacks`
+
+        Returns:
+            list : Priorities of the routes stored in this node
+        '''
+        self.regexes.sort(reverse=True)
+        if self.regexes:
+            try:
+                self.alternation = re.compile('|'.join('(%s)' % pattern for _,pattern,_ in self.regexes))
+                offset = 1
+                for priority,pattern,groups in self.regexes:
+                    self.groupmap[offset] = (priority,pattern,groups)
+                    offset += groups + 1
+            except re.error:
+                fallbacks.extend((p,s,re.compile(s)) for p,s,_ in self.regexes)
+                fallbacks.sort(reverse=True)
+                self.regexes = list()
+        return [r[0] for r in self.regexes[:1]] + ([self.prefix[0]] if self.prefix else [])
+
 class PathMaker(dict):
     '''For storing and handling path mapping
     
@@ -24,27 +76,149 @@ class PathMaker(dict):
 
             pathmaker['/']()
 
+        Lookups are served by an index which is rebuilt lazily once a route is added:
+
+        - Literal patterns (e.g. `/api/v1`) are stored in a hash table
+        - Literal prefixes (e.g. `/static/.*`) are stored in a trie
+        - Everything else is grouped by its literal prefix in the same trie,each group
+          compiled into one regex alternation ordered by priority
+
+        The last one added still has a better piority of getting called,and the results of
+        recent lookups are kept in a bounded LRU cache of `cache_size` entries
     '''
+    cache_size = 1024
+    '''Max count of path -> `RouteMatch` results to be cached'''
+
     def __init__(self):
         super().__init__()
+        self._index = None
 
     def __setitem__(self, pattern, value):
         '''Sets an path to be routed'''
         if not isinstance(pattern,str):raise Exception('The keys & values must be regexes string')
         super().__setitem__(pattern,value)
+        self._index = None
+
+    def __delitem__(self, pattern):
+        super().__delitem__(pattern)
+        self._index = None
+
+    def pop(self, pattern, *default):
+        self._index = None
+        return super().pop(pattern, *default)
+
+    def clear(self):
+        super().clear()
+        self._index = None
+
+    def update(self, *a, **k):
+        for pattern,value in dict(*a,**k).items():self[pattern] = value
+
+    @staticmethod
+    def _is_literal(pattern):
+        return not any(c in _REGEX_METACHARS for c in pattern)
+
+    @staticmethod
+    def _literal_prefix(pattern):
+        '''The literal part every string matched by `pattern` must start with'''
+        depth,escaped,charset = 0,False,False
+        for c in pattern:
+            # top-level alternations (`/a|/b`) have no common prefix
+            if escaped:escaped = False
+            elif c == '\\':escaped = True
+            elif charset:charset = c != ']'
+            elif c == '[':charset = True
+            elif c == '(':depth += 1
+            elif c == ')':depth -= 1
+            elif c == '|' and depth == 0:return ''
+        prefix = []
+        for c in pattern:
+            if c in _REGEX_METACHARS:
+                if c in '*+?{' and prefix:prefix.pop() # the quantifier makes the last one optional
+                break
+            prefix.append(c)
+        return ''.join(prefix)
+
+    def _build_index(self):
+        '''Builds the lookup tables,returns the cached lookup function'''
+        literals,trie,fallbacks = dict(),_TrieNode(),list()
+        def node_of(prefix):
+            node = trie
+            for c in prefix:node = node.children.setdefault(c,_TrieNode())
+            return node
+        for priority,pattern in enumerate(self.keys()):
+            if self._is_literal(pattern):
+                literals[pattern] = priority
+            elif pattern.endswith('.*') and self._is_literal(pattern[:-2]):
+                node_of(pattern[:-2]).prefix = (priority,pattern)
+            else:
+                try:
+                    compiled = re.compile(pattern)
+                    if _REGEX_BACKREFERENCE.search(pattern):raise re.error('backreference')
+                    re.compile('(?:%s)' % pattern) # global flags etc. cannot be wrapped
+                    node_of(self._literal_prefix(pattern)).regexes.append((priority,pattern,compiled.groups))
+                except re.error:
+                    fallbacks.append((priority,pattern,re.compile(pattern)))
+        fallbacks.sort(reverse=True)
+        # LIFO,the later ones are tried first
+        priorities = [priority for node in trie.walk() for priority in node.compile(fallbacks)]
+        pattern_priority = max([-1] + priorities + [f[0] for f in fallbacks[:1]])
+
+        def lookup(key):
+            best = None # (priority,pattern,groups)
+            if key in literals:
+                best = (literals[key],key,())
+            if best and best[0] > pattern_priority:
+                # nothing else can beat a literal match
+                return best
+            node = trie
+            for index in range(len(key) + 1):
+                if node.prefix and '\n' not in key[index:]:
+                    # `.*` does not match newlines
+                    priority,pattern = node.prefix
+                    if not best or priority > best[0]:best = (priority,pattern,())
+                if node.alternation and (not best or node.regexes[0][0] > best[0]):
+                    match = node.alternation.fullmatch(key)
+                    if match:
+                        priority,pattern,groups = node.groupmap[match.lastindex]
+                        if not best or priority > best[0]:
+                            best = (priority,pattern,match.groups()[match.lastindex:match.lastindex + groups])
+                if index == len(key):break
+                node = node.children.get(key[index])
+                if node is None:break
+            for priority,pattern,compiled in fallbacks:
+                if best and best[0] > priority:break
+                match = compiled.fullmatch(key)
+                if match:
+                    best = (priority,pattern,match.groups())
+                    break
+            return best
+
+        self._index = lru_cache(maxsize=self.cache_size)(lookup)
+        return self._index
+
+    def match(self, key) -> RouteMatch:
+        '''Finds the route of `key` in one lookup
+
+        Returns:
+            RouteMatch : The matched route,or `None` if not found
+        '''
+        index = self._index or self._build_index()
+        found = index(key)
+        if not found:return None
+        _,pattern,groups = found
+        return RouteMatch(pattern,super().__getitem__(pattern),groups)
 
     def hasitem(self,key):
-        for pattern in list(self.keys())[::-1]: # LIFO
-            if fullmatch(pattern,key):return True
+        return self.match(key) is not None
 
     def __getitem__(self, key):
-        '''Iterates all keys to find matching one
+        '''Finds the object whose pattern matches `key`
 
         The last one added has a better piority of getting called
         '''
-        for pattern in list(self.keys())[::-1]: # LIFO
-            if fullmatch(pattern,key):
-                return super().__getitem__(pattern)
+        route = self.match(key)
+        if route:return route.handler
 
 class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
     '''
@@ -56,9 +230,239 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
             server.serve_forever()
 
         You can test by typing `http://localhost:1234` into your browser to retrive a glorious error page ((
+
+        By default every connection gets its own thread.To serve them with a bounded `WorkerPool`
+        instead,set `max_workers` before serving:
+
+            server.max_workers = 64
+            server.worker_overflow = WorkerPool.REJECT # answer with 503 when the queue is full
+
+        Idle keep-alive connections can be parked in a single `KeepAlivePoller` as well,so they
+        don't hold a thread between requests:
+
+            server.park_idle_connections = True
+
+        Under overload,an `AdmissionController` sheds requests with a fast 503 once they wait too
+        long for a worker:
+
+            server.admission = AdmissionController(target_delay=0.05)
     '''
     daemon_threads = True
     request_queue_size = 10
+    max_workers = 0
+    '''Max count of pooled worker threads,`0` spawns one thread per connection instead'''
+    min_workers = 4
+    '''Worker threads kept alive even when idle,set it to `max_workers` for a fixed size pool'''
+    worker_queue_size = 128
+    '''Max count of accepted connections waiting for a worker'''
+    worker_overflow = WorkerPool.BLOCK
+    '''What to do when the queue is full,see `WorkerPool`'''
+    worker_idle_timeout = 30
+    '''Seconds before an idle extra worker exits'''
+    pool : WorkerPool = None
+    '''The worker pool,created once the first connection is accepted when `max_workers` is set'''
+    park_idle_connections = False
+    '''Hand idle keep-alive connections to the `keepalive` poller instead of blocking a thread'''
+    keepalive_timeout = 60
+    '''Seconds an idle keep-alive connection is kept open'''
+    keepalive_max_requests = 0
+    '''Max count of requests per connection,`0` means unlimited'''
+    keepalive : KeepAlivePoller = None
+    '''The idle connection poller,created on `serve_forever` when `park_idle_connections` is set'''
+    pipeline_depth = 16
+    '''Max count of pipelined requests whose responses are batched together,`0` disables batching'''
+    pipeline_buffer_size = 65536
+    '''Batched responses are written once they exceed this size'''
+    body_drain_limit = 65536
+    '''Request bodies left unread by handlers are discarded up to this size,larger ones close the connection'''
+    max_body_size = 0
+    '''Request bodies larger than this are rejected with a 413,`0` means unlimited.See `BodySizeLimitWrapper` for per-route limits'''
+    spool_size = 1 << 20
+    '''Request bodies larger than this are spooled to a temporary file by `spoolstream`'''
+    spool_directory : str = None
+    '''Where spooled request bodies are written,defaults to the system's temporary directory'''
+    overflow_response = (
+        b'HTTP/1.1 503 Service Unavailable\r\n'
+        b'Content-Length: 0\r\n'
+        b'Connection: close\r\n\r\n'
+    )
+    '''Pre-serialized response sent when a connection is rejected by the pool'''
+    admission : AdmissionController = None
+    '''Optional admission controller,consulted before every request is routed'''
+    cache_error_messages = True
+    '''Reuse the rendered error pages,disable it if `format_error_message` depends on the request'''
+    error_cache_size = 256
+    '''Max count of cached error pages'''
+    stage_timing = False
+    '''Time the stages (wrappers and handler) of the routes added from now on,see `stage_timings`'''
+    metrics : ServerMetrics = None
+    '''Where requests,connections and websockets are recorded,see `metrics.ServerMetrics`'''
+    profiler : Profiler = None
+    '''Profiles some of the requests once enabled,see `profiler.Profiler`'''
+
+    def process_request(self, socket_ : socket, client_address : tuple):
+        '''Hands the connection to the worker pool,or starts a new thread for it'''
+        if not self.max_workers:
+            if self.admission is None:
+                return super().process_request(socket_,client_address)
+            # Measure how long the new thread takes to start
+            thread = threading.Thread(
+                target=self.process_request_thread,args=(socket_,client_address,time.monotonic()),
+                daemon=self.daemon_threads
+            )
+            return thread.start()
+        if self.pool is None:
+            self.pool = WorkerPool(
+                self.min_workers,self.max_workers,self.worker_queue_size,
+                self.worker_overflow,self.worker_idle_timeout
+            )
+            if self.admission is not None:self.pool.on_dequeue = self.admission.observe
+        if not self.pool.submit(self.process_request_thread,socket_,client_address):
+            self.reject_request(socket_)
+
+    def finish_request(self, socket_ : socket, client_address : tuple) -> Request:
+        '''Handles the connection,returns the finished (or parked) handler'''
+        return self.RequestHandlerClass(socket_, client_address, self)
+
+    def process_request_thread(self, socket_ : socket, client_address : tuple, accepted : float = None):
+        '''Handles the connection in a worker / its own thread'''
+        if accepted is not None:self.admission.observe(time.monotonic() - accepted)
+        self._track_active(1)
+        try:
+            handler = self.finish_request(socket_, client_address)
+            if handler.parked:return self.keepalive.park(handler)
+        except Exception:
+            self.handle_error(socket_, client_address)
+        finally:
+            self._track_active(-1)
+        self.shutdown_request(socket_)
+
+    def resume_request_thread(self, handler : Request):
+        '''Handles the next requests of a connection that was parked'''
+        self._track_active(1)
+        self.connections.add(handler)
+        try:
+            try:
+                handler.handle()
+            finally:
+                handler.finish()
+            if handler.parked:return self.keepalive.park(handler)
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+        finally:
+            self._track_active(-1)
+        self.shutdown_request(handler.request)
+
+    def _track_active(self, delta : int):
+        with self._active_changed:
+            self.active_connections += delta
+            if not self.active_connections:self._active_changed.notify_all()
+
+    def wait_idle(self, timeout : float = None) -> bool:
+        '''Blocks until no connection is being handled
+
+        Returns:
+            bool : `False` if `timeout` was reached first
+        '''
+        with self._active_changed:
+            return self._active_changed.wait_for(lambda:not self.active_connections,timeout)
+
+    @property
+    def draining(self) -> bool:
+        '''Whether the server is shutting down,connections are closed once they go idle'''
+        return self._BaseServer__shutdown_request
+
+    def drain(self, timeout : float = None) -> bool:
+        '''Closes the idle keep-alive connections,then waits for the in-flight requests to finish
+
+        Should be called once `serve_forever` has returned
+
+        Returns:
+            bool : `False` if `timeout` was reached first
+        '''
+        if self.keepalive is not None:
+            self.keepalive.close()
+            self.keepalive = None
+        for handler in list(self.connections):
+            if handler.idle:
+                try:
+                    handler.connection.shutdown(SHUT_RD) # Wakes up the blocking `readline`
+                except OSError:
+                    pass
+        return self.wait_idle(timeout)
+
+    def stop_serving(self, shared : bool = False):
+        '''Stops accepting new connections without waiting,safe to be called from signal handlers
+
+        `serve_forever` returns once the pending `accept` is interrupted
+
+        Args:
+            shared (bool, optional): The listener is shared with other processes,so it's closed
+                                     (which wakes up `accept` in a signal handler of the serving thread)
+                                     instead of being shut down for everyone. Defaults to False.
+        '''
+        self._BaseServer__shutdown_request = True
+        try:
+            if shared:self.socket.close()
+            else:self.socket.shutdown(SHUT_RDWR) # Wakes up the blocking `accept`
+        except OSError:
+            pass
+
+    def shutdown(self):
+        '''Stops `serve_forever` and waits until it returns'''
+        self.stop_serving()
+        self._BaseServer__is_shut_down.wait()
+
+    def resume_request(self, handler : Request):
+        '''Called by the `keepalive` poller once a parked connection becomes readable
+
+        It runs in the poller thread,so the connection is closed rather than waiting when the pool's queue is full
+        '''
+        if not self.max_workers:
+            thread = threading.Thread(target=self.resume_request_thread,args=(handler,),daemon=self.daemon_threads)
+            return thread.start()
+        if not self.pool.submit_nowait(self.resume_request_thread,handler):
+            handler.finish()
+            self.reject_request(handler.request)
+
+    def expire_request(self, handler : Request):
+        '''Called by the `keepalive` poller once a parked connection has been idle for too long'''
+        handler.parked = False
+        handler.log_debug('Connection closed (idle)')
+        handler.finish()
+        self.shutdown_request(handler.request)
+
+    def reject_request(self, socket_ : socket):
+        '''Drops a connection the pool couldn't take,with a 503 if `worker_overflow` says so'''
+        if self.worker_overflow == WorkerPool.REJECT:
+            try:
+                socket_.settimeout(1)
+                socket_.sendall(self.overflow_response)
+            except OSError:
+                pass
+        self.shutdown_request(socket_)
+
+    def server_close(self):
+        super().server_close()
+        if self.keepalive is not None:self.keepalive.close()
+        if self.pool:self.pool.shutdown(wait=not self.daemon_threads)
+
+    def stats(self) -> dict:
+        '''Serving statistics
+
+        Returns:
+            dict : with these keys
+                - `pool`   : `WorkerPool.stats()`,or `None` in thread-per-connection mode
+                - `active` : Count of connections being handled
+                - `parked` : Count of idle connections parked in the `keepalive` poller
+                - `admission` : `AdmissionController.stats()`,or `None` without admission control
+        '''
+        return {
+            'pool' : self.pool.stats() if self.pool else None,
+            'active' : self.active_connections,
+            'parked' : len(self.keepalive) if self.keepalive is not None else 0,
+            'admission' : self.admission.stats() if self.admission is not None else None
+        }
     def handle_error(self, socket_ : socket, client_address : tuple, error : Exception = ''):
         """Handle an error gracefully. """
         super().handle_error(socket_,client_address)
@@ -89,6 +493,8 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
             as only threading requests are considered            
             """
             self._BaseServer__is_shut_down.clear()
+            if self.park_idle_connections and self.keepalive is None:
+                self.keepalive = KeepAlivePoller(self.keepalive_timeout,self.resume_request,self.expire_request)
             try:                
                 while not self._BaseServer__shutdown_request:                                        
                     if self._BaseServer__shutdown_request:
@@ -101,11 +507,43 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
         '''
         Maps the request with the `PathMaker`
         
-        The `request` is provided to the router
+        The `request` is provided to the router,with `request.route` and `request.route_groups`
+        set to the matched pattern and its captured groups
+
+        With `admission` set,requests may be shed before they're routed.
+        With `metrics` set,the request is recorded once it's handled.
+        With `profiler` set,it may be profiled once it's routed
         '''
-        if self.paths.hasitem(request.path):
+        metrics = self.metrics
+        if metrics is None:return self.admit_request(request)
+        start = time.perf_counter()
+        try:
+            return self.admit_request(request)
+        finally:
+            metrics.request_handled(request,time.perf_counter() - start)
+
+    def admit_request(self, request : Request):
+        '''Routes the request,unless `admission` sheds it'''
+        admission = self.admission
+        if admission is None:
+            return self.route_request(request)
+        if not admission.admit(request):
+            return admission.shed(request)
+        try:
+            return self.route_request(request)
+        finally:
+            admission.release()
+
+    def route_request(self, request : Request):
+        '''Calls the handler of the route `request` matches,or answers with 404'''
+        route = self.paths.match(request.path)
+        if route:
+            request.route,request.route_groups = route.pattern,route.groups
+            profiler = self.profiler
             try:
-                return self.paths[request.path](self,request,None)
+                if profiler is not None and profiler.selects(request):
+                    return profiler.run(request,route.handler,self,request,None)
+                return route.handler(self,request,None)
                 # Succeed,end this handle call
             except BadRequestException as e:
                 # For Other server-side exceptions,let the client know
@@ -117,7 +555,7 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
         # Request's not handled:No URI matched
         return request.send_error(HTTPStatus.NOT_FOUND)
 
-    def route(self,pattern):
+    def route(self,pattern,timing : bool = None):
         '''
         Routes a HTTP Request
 
@@ -125,12 +563,26 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
 
             @server.route('/')
                 def index():lambda a:SendFile('index.html')
+
+        The wrappers of `method` are flattened into one pipeline (see `compile_pipeline`),
+        which times its stages if `timing` (or `stage_timing` of the server) is set
         '''
         def wrapper(method):
-            self.paths[pattern] = method
+            self.paths[pattern] = compile_pipeline(method,self.stage_timing if timing is None else timing)
             return method
         return wrapper
 
+    def stage_timings(self) -> dict:
+        '''Time spent in the stages of every timed route
+
+        Returns:
+            dict : Patterns of the routes -> dict of their stages -> `(calls,seconds)`
+        '''
+        return {
+            pattern : {stage : (timing.calls,timing.seconds) for stage,timing in handler.timings.items()}
+            for pattern,handler in list(self.paths.items()) if getattr(handler,'timings',None)
+        }
+
     def format_error_message(self,code:int,message:str,explain:str,request:Request):
         return f'''
         <head>        
@@ -144,8 +596,26 @@ class PyWebHost(socketserver.ThreadingMixIn, socketserver.TCPServer,):
         </body>
         '''
 
+    def render_error_message(self,code:int,message:str,explain:str,request:Request) -> bytes:
+        '''Renders the error page with `format_error_message`,cached per `code`,`message` and `explain`'''
+        if not self.cache_error_messages:
+            return render_error(self.format_error_message,code,message,explain,request)
+        key = (code,message,explain)
+        body = self.error_messages.get(key)
+        if body is None:
+            body = render_error(self.format_error_message,code,message,explain,request)
+            if len(self.error_messages) >= self.error_cache_size:self.error_messages.clear()
+            self.error_messages[key] = body
+        return body
+
     def __init__(self, server_address : tuple):
         self.paths = PathMaker()
+        self.error_messages = dict()
+        # Rendered error pages,see `render_error_message`
+        self.active_connections = 0
+        self._active_changed = threading.Condition()
+        self.connections = set()
+        # Handlers of the connections being served,parked ones excluded
         # A paths dictionary which has `lambda` objects as keys
         self.protocol_version = "HTTP/1.1"
         # What protocol version to use.        
@@ -0,0 +1,124 @@
+'''Queue-latency based admission control
+
+Under overload,accepting more work only makes every request slower.`AdmissionController` watches how
+long accepted connections wait before a worker picks them up,and sheds load with a cheap,pre-serialized
+503 once that delay stays above a target:
+
+    server = PyWebHost(('',1234))
+    server.max_workers = 32
+    server.admission = AdmissionController(target_delay=0.05,max_inflight=256)
+    server.admission.set_priority('/api/reports/.*',AdmissionController.LOW)
+    server.admission.set_priority('/health',AdmissionController.CRITICAL)
+'''
+import threading,time
+from http import HTTPStatus
+from .handler import Request
+
+class AdmissionController(object):
+    '''CoDel-like admission controller
+
+    The minimum queue wait of every `interval` is compared against `target_delay`:
+
+    - Above `target_delay`                     : `LOW` priority requests are shed
+    - Above `target_delay * severe_factor`,or
+      `max_inflight` requests being handled    : every request below `CRITICAL` is shed
+
+    `CRITICAL` requests are always admitted
+    '''
+    LOW = -1
+    NORMAL = 0
+    CRITICAL = 1
+
+    def __init__(self,target_delay : float = 0.05,interval : float = 0.1,max_inflight : int = 0,severe_factor : float = 4,retry_after : int = 1):
+        '''
+        Args:
+            target_delay (float, optional): Acceptable queue wait in seconds. Defaults to 0.05.
+            interval (float, optional): Seconds the wait must stay above target before shedding. Defaults to 0.1.
+            max_inflight (int, optional): Max count of requests being handled,`0` means unlimited. Defaults to 0.
+            severe_factor (float, optional): How far above target the wait is considered severe. Defaults to 4.
+            retry_after (int, optional): `Retry-After` seconds of the 503 response. Defaults to 1.
+        '''
+        from . import PathMaker
+        self.target_delay,self.interval,self.max_inflight = target_delay,interval,max_inflight
+        self.severe_factor = severe_factor
+        self.priorities = PathMaker()
+        '''Path patterns -> priorities,see `set_priority`'''
+        self.response = (
+            b'HTTP/1.1 503 Service Unavailable\r\n'
+            b'Retry-After: %d\r\n'
+            b'Content-Length: 0\r\n'
+            b'Connection: close\r\n\r\n' % retry_after
+        )
+        '''Pre-serialized response sent to the shed requests'''
+        self.delay = 0.0
+        '''Minimum queue wait of the last complete interval'''
+        self.inflight = self.admitted = self.shed_count = 0
+        self._lock = threading.Lock()
+        self._window_start,self._window_min = time.monotonic(),None
+
+    def set_priority(self,pattern : str,priority : int):
+        '''Sets the priority of the paths matching `pattern`,paths not set are `NORMAL`'''
+        self.priorities[pattern] = priority
+
+    def priority(self,request : Request) -> int:
+        route = self.priorities.match(request.path)
+        return route.handler if route else AdmissionController.NORMAL
+
+    def observe(self,wait : float):
+        '''Records the seconds an accepted connection waited for a worker'''
+        now = time.monotonic()
+        with self._lock:
+            if self._window_min is None or wait < self._window_min:self._window_min = wait
+            if now - self._window_start >= self.interval:
+                self.delay,self._window_min,self._window_start = self._window_min,None,now
+
+    def current_delay(self) -> float:
+        '''The queue delay to act upon,decays to 0 once no waits were observed for a while'''
+        if time.monotonic() - self._window_start > self.interval * 2:
+            with self._lock:
+                if self._window_min is None:self.delay = 0.0
+        return self.delay
+
+    def admit(self,request : Request) -> bool:
+        '''Decides whether `request` should be handled,call `release` once it's done
+
+        Returns:
+            bool : `False` if the request should be shed
+        '''
+        priority = self.priority(request) if self.priorities else AdmissionController.NORMAL
+        delay = self.current_delay()
+        with self._lock:
+            if priority < AdmissionController.CRITICAL:
+                severe = delay > self.target_delay * self.severe_factor or (
+                    self.max_inflight and self.inflight >= self.max_inflight)
+                if severe or (priority < AdmissionController.NORMAL and delay > self.target_delay):
+                    self.shed_count += 1
+                    return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def shed(self,request : Request):
+        '''Answers `request` with the pre-serialized 503,and closes the connection'''
+        request.clear_header()
+        request.close_connection = True
+        request.status = HTTPStatus.SERVICE_UNAVAILABLE
+        request.log_request(HTTPStatus.SERVICE_UNAVAILABLE)
+        request.wfile.write(self.response)
+        request.bytes_sent += len(self.response)
+
+    def stats(self) -> dict:
+        '''
+        Returns:
+            dict : `delay`,`inflight`,`admitted` and `shed` (count of shed requests)
+        '''
+        return {
+            'delay' : self.current_delay(),
+            'inflight' : self.inflight,
+            'admitted' : self.admitted,
+            'shed' : self.shed_count
+        }
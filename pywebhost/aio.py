@@ -0,0 +1,350 @@
+'''asyncio serving mode
+
+`AsyncPyWebHost` serves the same `PathMaker` routes on top of asyncio streams:
+
+    server = AsyncPyWebHost(('',1234))
+
+    @server.route('/async')
+    async def index(initator,request : AsyncRequest,content):
+        request.send_response(200)
+        request.send_header('Content-Length',5)
+        request.end_headers()
+        await request.awrite(b'hello')
+
+    @server.route('/sync')
+    @BinaryMessageWrapper(read=False)
+    def legacy(initator,request,content):
+        request.send_response(200)
+        return 'runs in the executor'
+
+    server.serve_forever()
+
+- Handlers (and `ModuleWrapper` chains) written as `async def` run directly on the loop
+- Everything else runs in a thread executor,where `request.rfile` / `request.wfile` block on the loop
+  like they would on a socket
+'''
+import asyncio,threading,time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.client import SERVICE_UNAVAILABLE
+from io import BytesIO
+from . import PathMaker,PyWebHost
+from .handler import Request,Headers,_MAXLINE,_MAXHEADERS,_MAXTIMEOUT
+from .modules import BadRequestException
+
+class _LoopWriter(object):
+    '''`wfile` of `AsyncRequest`
+
+    Writes from the loop thread are buffered by the transport,writes from other threads
+    block until the data is drained
+    '''
+    def __init__(self,request):
+        self.request = request
+
+    def write(self,data) -> int:
+        request = self.request
+        if threading.get_ident() == request.loop_thread:
+            request.writer.write(data)
+        else:
+            asyncio.run_coroutine_threadsafe(request.awrite(data),request.loop).result()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class _LoopReader(object):
+    '''`rfile` of `AsyncRequest` when the body was not prefetched
+
+    Reading blocks the calling thread,so it can only be used outside of the loop thread.
+    Coroutines should use `AsyncRequest.aread` / `AsyncRequest.areadline` instead
+    '''
+    def __init__(self,request):
+        self.request = request
+
+    def _call(self,coroutine):
+        request = self.request
+        if threading.get_ident() == request.loop_thread:
+            coroutine.close()
+            raise RuntimeError('Blocking read on the event loop,use `await request.aread()` instead')
+        return asyncio.run_coroutine_threadsafe(coroutine,request.loop).result()
+
+    def read(self,size=-1) -> bytes:
+        return self._call(self.request.aread(size))
+
+    def readline(self,size=-1) -> bytes:
+        return self._call(self.request.areadline())
+
+    def close(self):
+        pass
+
+class AsyncRequest(Request):
+    '''`Request` on top of asyncio streams
+
+    Parsing,headers and error pages behave exactly like `Request`.In addition,these coroutines
+    are available to `async def` handlers:
+
+    - `aread(size)`,`areadline()` : Reads the request body as sent,`body` decodes it in sync handlers
+    - `awrite(data)`              : Writes to the client and waits for the data to be drained
+    - `drain()`                   : Waits for the buffered data to be drained
+    '''
+    reader : asyncio.StreamReader
+    '''Stream the request is read from'''
+    writer : asyncio.StreamWriter
+    '''Stream the response is written to'''
+    prefetched : int = 0
+    '''Bytes of the request body read ahead by `prefetch_body`'''
+
+    def __init__(self,reader : asyncio.StreamReader,writer : asyncio.StreamWriter,server):
+        self.reader,self.writer,self.server = reader,writer,server
+        self.loop,self.loop_thread = asyncio.get_running_loop(),threading.get_ident()
+        self.protocol_version = server.protocol_version
+        self.format_error_message = server.format_error_message
+        self.headers = Headers()
+        self.headers_buffer = Headers()
+        self.head_buffer = bytearray()
+        self.raw_request = self.connection = writer.get_extra_info('socket')
+        self.client_address = writer.get_extra_info('peername')
+        self.keepalive = None
+        self.keepalive_timeout = server.keepalive_timeout
+        self.keepalive_max_requests = server.keepalive_max_requests
+        self.parked = False
+        self.requests_handled = 0
+        self.max_body_size = server.max_body_size
+        self.read_timeout = server.read_timeout
+        self.wfile = _LoopWriter(self)
+        self.rfile = _LoopReader(self)
+
+    async def aread(self,size=-1) -> bytes:
+        '''Reads `size` bytes (or until EOF if `size` is negative) of the request
+
+        Raises:
+            asyncio.TimeoutError: If the client sends nothing for `read_timeout` seconds
+        '''
+        if isinstance(self.rfile,BytesIO):return self.rfile.read(size)
+        try:
+            return await self._read(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    async def _read(self,size=-1) -> bytes:
+        '''Reads like `StreamReader.readexactly` (or until EOF),with `read_timeout` applied to every chunk
+        rather than to the whole body,so slow but steady uploads aren't cut off'''
+        chunks,remaining = [],size
+        while remaining:
+            chunk = await asyncio.wait_for(self.reader.read(65536 if remaining < 0 else min(remaining,65536)),self.read_timeout)
+            if not chunk:
+                if size < 0:break
+                raise asyncio.IncompleteReadError(b''.join(chunks),size)
+            chunks.append(chunk)
+            if size > 0:remaining -= len(chunk)
+        return b''.join(chunks)
+
+    async def areadline(self) -> bytes:
+        '''Reads a line of the request,see `aread`'''
+        if isinstance(self.rfile,BytesIO):return self.rfile.readline()
+        return await asyncio.wait_for(self.reader.readline(),self.read_timeout)
+
+    async def awrite(self,data) -> int:
+        '''Writes `data`,then waits for it to be drained'''
+        self.writer.write(data)
+        await self.writer.drain()
+        return len(data)
+
+    async def drain(self):
+        '''Waits until the buffered response is drained'''
+        await self.writer.drain()
+
+    async def read_head(self,timeout) -> bool:
+        '''Reads the request line and headers,then parses them with `parse_request`
+
+        The whole head must be received within `timeout` seconds
+
+        Returns:
+            bool : `False` if the request was malformed or the connection is closed
+        '''
+        self.rfile = _LoopReader(self)
+        if not await asyncio.wait_for(self._read_head_lines(),timeout):return False
+        return self.parse_request()
+
+    async def _read_head_lines(self) -> bool:
+        lines = []
+        try:
+            self.raw_requestline = await self.reader.readline()
+            if self.requests_handled:self.reset()
+            self.prefetched = 0
+        except ValueError:
+            # Exceeded `_MAXLINE`
+            self.requestline,self.request_version,self.command = '','',''
+            self.send_error(HTTPStatus.REQUEST_URI_TOO_LONG)
+            return False
+        if not self.raw_requestline:
+            self.close_connection = True
+            return False
+        while len(lines) <= _MAXHEADERS:
+            try:
+                line = await self.reader.readline()
+            except ValueError:
+                line = b'_' * (_MAXLINE + 1) # Let `Headers.parse_block` report it
+            lines.append(line)
+            if line in (b'\r\n', b'\n', b''):break
+        self.raw_headers = b''.join(lines)
+        return True
+
+    async def prefetch_body(self,limit : int):
+        '''Reads the request body ahead,if its `Content-Length` is at most `limit`
+
+        With the body prefetched,`rfile` can be read from the loop thread as well
+        '''
+        if self.body_length and self.body_length <= limit and not (self.max_body_size and self.body_length > self.max_body_size):
+            self.rfile = BytesIO(await self._read(self.body_length))
+            self.prefetched = self.body_length
+
+    async def handle_one_request_async(self,timeout):
+        '''Handles a single request,see `Request.handle_one_request`'''
+        try:
+            if not await self.read_head(timeout):return
+            self.requests_handled += 1
+            if self.close_connection or (self.keepalive_max_requests and self.requests_handled >= self.keepalive_max_requests):
+                self.send_header('Connection','close')
+            else:
+                self.send_header('Connection','keep-alive')
+            await self.server.handle(request=self)
+            if self.body_length != 0 and not isinstance(self.rfile,BytesIO) and not (self._body is not None and self._body.done):
+                # The body may be left partially read,which can't be told apart from the next request
+                self.close_connection = True
+            await self.writer.drain()
+        except (asyncio.TimeoutError,asyncio.IncompleteReadError,ConnectionError):
+            self.close_connection = True
+
+    async def handle_async(self):
+        '''Handles multiple requests if necessary'''
+        self.log_debug('-- -- Created new HTTP connection')
+        self.close_connection = True
+        await self.handle_one_request_async(_MAXTIMEOUT)
+        while not self.close_connection:
+            await self.handle_one_request_async(self.keepalive_timeout)
+        self.log_debug('Connection closed')
+
+class AsyncPyWebHost(object):
+    '''
+        # AsyncPyWebHost
+
+        asyncio flavour of `PyWebHost`,routing is done with the same `PathMaker`
+
+        To start a server:
+
+            server = AsyncPyWebHost(('',1234))
+            server.serve_forever()
+
+        Or,inside a running loop:
+
+            await server.serve()
+    '''
+    request_queue_size = 128
+    keepalive_timeout = 60
+    '''Seconds an idle keep-alive connection is kept open'''
+    keepalive_max_requests = 0
+    '''Max count of requests per connection,`0` means unlimited'''
+    max_body_size = PyWebHost.max_body_size
+    '''Request bodies larger than this are rejected with a 413,`0` means unlimited'''
+    spool_size = PyWebHost.spool_size
+    spool_directory = PyWebHost.spool_directory
+    read_timeout = _MAXTIMEOUT
+    '''Seconds a read of the request body may wait for the client,the whole head must be received within
+    `keepalive_timeout` (or this,for the first request of a connection)'''
+    prefetch_size = 65536
+    '''Request bodies up to this size are read before calling `async def` handlers,
+    so that sync wrappers in their chain can read them from `rfile`'''
+    RequestHandlerClass = AsyncRequest
+
+    cache_error_messages = PyWebHost.cache_error_messages
+    error_cache_size = PyWebHost.error_cache_size
+
+    stage_timing = PyWebHost.stage_timing
+    metrics = PyWebHost.metrics
+    '''Where requests are recorded,see `metrics.ServerMetrics`'''
+    route = PyWebHost.route
+    stage_timings = PyWebHost.stage_timings
+    format_error_message = PyWebHost.format_error_message
+    render_error_message = PyWebHost.render_error_message
+
+    def __init__(self, server_address : tuple, executor : ThreadPoolExecutor = None):
+        self.paths = PathMaker()
+        # A paths dictionary which has `lambda` objects as keys
+        self.error_messages = dict()
+        # Rendered error pages,see `render_error_message`
+        self.protocol_version = "HTTP/1.1"
+        self.server_address = server_address
+        self.executor = executor or ThreadPoolExecutor(thread_name_prefix='PyWebHostExecutor')
+        # Where sync handlers are run
+        self.listener = None
+        # The `asyncio.Server`,once serving
+
+    async def handle(self, request : AsyncRequest):
+        '''
+        Maps the request with the `PathMaker`,then awaits the handler if it's a coroutine function,
+        or runs it in the `executor` otherwise
+        '''
+        metrics = self.metrics
+        if metrics is None:return await self.route_request(request)
+        start = time.perf_counter()
+        try:
+            return await self.route_request(request)
+        finally:
+            metrics.request_handled(request,time.perf_counter() - start)
+
+    async def route_request(self, request : AsyncRequest):
+        '''Calls the handler of the route `request` matches,or answers with 404'''
+        route = self.paths.match(request.path)
+        if route:
+            request.route,request.route_groups = route.pattern,route.groups
+            try:
+                if asyncio.iscoroutinefunction(route.handler):
+                    await request.prefetch_body(self.prefetch_size)
+                    return await route.handler(self,request,None)
+                return await request.loop.run_in_executor(self.executor,route.handler,self,request,None)
+            except BadRequestException as e:
+                return request.send_error(e.code,e.explain)
+            except ConnectionError as e:
+                return request.log_error('Connection Aborted: %s',e)
+            except asyncio.TimeoutError:
+                # The body was left partially read,discard this connection
+                request.close_connection = True
+                return request.log_error('Request timed out')
+            except Exception as e:
+                return request.send_error(SERVICE_UNAVAILABLE,explain='There was an error processing your request:%s'%e)
+        return request.send_error(HTTPStatus.NOT_FOUND)
+
+    async def handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        request = self.RequestHandlerClass(reader,writer,self)
+        try:
+            await request.handle_async()
+        except Exception as e:
+            request.log_error('Connection failed: %s',e)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError,OSError):
+                pass
+
+    async def serve(self):
+        '''Starts serving,and blocks until the server is closed'''
+        host,port = self.server_address
+        self.listener = await asyncio.start_server(
+            self.handle_connection,host or None,port,
+            limit=_MAXLINE + 1,backlog=self.request_queue_size
+        )
+        self.server_address = self.listener.sockets[0].getsockname()[:2]
+        async with self.listener:
+            await self.listener.serve_forever()
+
+    def serve_forever(self):
+        '''Runs `serve` in a new event loop'''
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
@@ -1,9 +1,10 @@
 from http.client import OK, ResponseNotReady
 from http.cookies import Morsel, SimpleCookie
-import logging,socket
+import logging,socket,re,os,stat,itertools
 from datetime import datetime
-from socketserver import StreamRequestHandler
+from socketserver import StreamRequestHandler, _SocketWriter
 from http import HTTPStatus,client,cookies
+from http.cookies import _unquote as unquote_cookie
 from html import escape
 from urllib.parse import urlparse,parse_qs,unquote
 from io import BufferedIOBase, IOBase
@@ -24,22 +25,156 @@ _MAXHEADERS = 100
 _MAXTIMEOUT = 60
 '''Try not to set this value to 0 -- this would cause issuses on some Windows machines'''
 
+_SENDMSG = hasattr(socket.socket,'sendmsg')
+_MAXBUFFERS = 64
+'''Max count of buffers sent with one `sendmsg` call,more are joined'''
+_JOIN_LIMIT = 65536
+'''Buffers up to this size are joined instead of being written one by one,when `sendmsg` can't be used'''
+
+_SENDFILE_MIN = 65536
+'''Files smaller than this are read and written along with the headers instead of using `sendfile`'''
+_PREAD = hasattr(os,'pread')
+
+_HEAD_END = re.compile(b'\n\r?\n')
+'''The blank line ending a request head'''
+
+_RESPONSES = {
+    v: (v.phrase, v.description)
+    for v in HTTPStatus.__members__.values()
+}
+'''Status codes -> (short message,long message),shared by every `Request`'''
+_LOGGER = logging.getLogger('Request')
+
+class BadRequestException(Exception):
+    '''Exception with code and explaination'''
+    def __init__(self,code,explain=None) -> None:
+        self.code = code
+        self.explain = explain
+        super().__init__(explain)
+
+def read_head(rfile : BufferedIOBase) -> tuple:
+    '''Reads a request head (request line,header lines and the blank line) from a buffered `rfile`
+
+    The head is located with `peek`,so usually it takes one read,and nothing past the head is consumed.
+    Reading stops early once a line exceeds `_MAXLINE`,or there are more than `_MAXHEADERS` lines,
+    so the limits can be reported by the caller
+
+    Returns:
+        tuple : The request line (with its line break),the header lines,and the count of bytes left
+                in the read buffer past the head (`None` if it isn't known)
+    '''
+    chunk = rfile.peek(_MAXLINE)
+    if chunk[:1] == b'\n' or chunk[:2] == b'\r\n':
+        return rfile.readline(_MAXLINE + 1),b'',None # Empty request line
+    match = _HEAD_END.search(chunk)
+    buffered = None
+    if match:
+        # The whole head is buffered already,`peek` returned all of the buffer
+        head = rfile.read(match.end())
+        buffered = len(chunk) - match.end()
+    else:
+        buffer,lines = bytearray(),0
+        while chunk:
+            start = max(len(buffer) - 2,0)
+            buffer += chunk
+            match = _HEAD_END.search(buffer,start)
+            if match:
+                rfile.read(match.end() - len(buffer) + len(chunk))
+                del buffer[match.end():]
+                break
+            rfile.read(len(chunk))
+            lines += chunk.count(b'\n')
+            if lines > _MAXHEADERS + 1 or len(buffer) - buffer.rfind(b'\n') > _MAXLINE + 1:
+                break # Exceeding the limits
+            chunk = rfile.peek(_MAXLINE)
+        head = bytes(buffer)
+    end = head.find(b'\n') + 1 or len(head)
+    return head[:end],head[end:],buffered
+
+def render_error(format_error_message,code:int,message:str,explain:str,request) -> bytes:
+    '''Renders an error page with `format_error_message`,HTML-escaping `message` and `explain`'''
+    # HTML encode to prevent Cross Site Scripting attacks
+    # (see bug #1100201)
+    return format_error_message(
+        code   =code,
+        message=escape(message, quote=False),
+        explain=escape(explain, quote=False),
+        request=request
+    ).encode('UTF-8', 'replace')
+
+_HEADER_NAMES = {name.lower() : name.encode() for name in (
+    'Accept-Ranges','Age','Allow','Cache-Control','Connection','Content-Disposition','Content-Encoding',
+    'Content-Language','Content-Length','Content-Location','Content-MD5','Content-Range','Content-Type',
+    'Date','ETag','Expires','Keep-Alive','Last-Modified','Location','Pragma','Retry-After','Server',
+    'Set-Cookie','Sec-WebSocket-Accept','Sec-WebSocket-Protocol','Sec-WebSocket-Version','Trailer',
+    'Transfer-Encoding','Upgrade','Vary','WWW-Authenticate','X-Content-Type-Options','X-Frame-Options',
+)}
+'''Lowercased header names -> their canonical,encoded form'''
+
+def header_name(key : str) -> bytes:
+    '''Canonical,encoded form of a header name (e.g. `content-type` -> `b'Content-Type'`)'''
+    name = _HEADER_NAMES.get(key)
+    if name is None:
+        name = '-'.join(word.capitalize() for word in key.split('-')).encode('latin-1')
+        if len(_HEADER_NAMES) < 1024:_HEADER_NAMES[key] = name
+    return name
+
 class Headers(dict):
-    '''Crude implementation of https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html - HTTP Message Headers'''
-    def encode(self):
-        return str(self).encode()
+    '''Crude implementation of https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html - HTTP Message Headers
+
+    Values parsed by `parse_block` are kept as `bytes` until they're accessed.
+    Headers sent multiple times (e.g. `Set-Cookie`) are added with `add`,and hold a `list` of values
+    '''
+    def encode(self,buffer : bytearray = None) -> bytearray:
+        '''Serializes the response line and headers
+
+        Args:
+            buffer (bytearray, optional): Buffer to serialize into (it's cleared first),so it can be reused. Defaults to None.
+
+        Returns:
+            bytearray : The serialized head,ending with a blank line
+        '''
+        if buffer is None:buffer = bytearray()
+        else:del buffer[:]
+        if self.response_line:buffer += self.response_line.encode()
+        for k,v in dict.items(self):
+            name = header_name(k)
+            for v in (v if v.__class__ is list else (v,)):
+                buffer += name
+                buffer += b': '
+                buffer += v if isinstance(v,(bytes,bytearray)) else str(v).encode()
+                buffer += b'\r\n'
+        buffer += b'\r\n'
+        return buffer
 
     def __str__(self) -> str:
-        # formatting the lines
-        buffer = []        
-        if self.response_line:buffer.append(self.response_line )
-        for k,v in self.items():buffer.append('%s: %s' % (k,v))
-        str_ = buffer[0] + '\n'.join(buffer[1:]) + '\r\n\r\n'
-        
-        return str_
+        return self.encode().decode()
 
     def __init__(self,response_line='') -> None:
         self.response_line = response_line
+
+    def clear(self):
+        '''Empties the headers and the response line,so the object can be reused'''
+        super().clear()
+        self.response_line = ''
+
+    def add(self, k : str, v):
+        '''Adds a value to a header,keeping the values it has already'''
+        k = k.lower()
+        current = dict.get(self,k)
+        if current is None:dict.__setitem__(self,k,v)
+        elif current.__class__ is list:current.append(v)
+        else:dict.__setitem__(self,k,[current,v])
+
+    def get_all(self, k : str) -> list:
+        '''Every value of a header
+
+        Returns:
+            list : The values,empty if the header isn't set
+        '''
+        v = self.get(k)
+        if v is None:return []
+        return list(v) if v.__class__ is list else [v]
     
     def add_header_line(self,header_line : bytes):
         if not isinstance(header_line,str):
@@ -52,10 +187,12 @@ class Headers(dict):
         return key,value
 
     @staticmethod
-    def parse(fp : IOBase):
+    def parse(fp : IOBase,headers=None):
         """Parses only RFC2822 headers from a file pointer.
+
+        The headers are added to `headers` if it's given,a new `Headers` otherwise
         """
-        headers = Headers()
+        if headers is None:headers = Headers()
         while True:
             line = fp.readline(_MAXLINE + 1)
             if len(line) > _MAXLINE:
@@ -66,16 +203,269 @@ class Headers(dict):
             if line in (b'\r\n', b'\n', b''):
                 break      
         return headers
+
+    @staticmethod
+    def parse_block(block : bytes,headers=None):
+        """Parses RFC2822 headers from the header lines of a request head,see `read_head`
+
+        Same as `parse`,but the header lines are already in memory.Values are decoded on access
+
+        The headers are added to `headers` if it's given,a new `Headers` otherwise
+        """
+        if headers is None:headers = Headers()
+        lines = block.split(b'\n',_MAXHEADERS + 1)
+        for count,line in enumerate(lines):
+            if len(line) > _MAXLINE:
+                raise client.LineTooLong("header line")
+            key,sep,value = line.partition(b':')
+            if not sep:
+                if line in (b'\r', b''):break
+                continue
+            if count >= _MAXHEADERS:
+                raise client.HTTPException("got more than %d headers" % _MAXHEADERS)
+            dict.__setitem__(headers,key.strip().decode('latin-1').lower(),value.strip())
+        return headers
+
+    def _decoded(self, k : str, v):
+        if v.__class__ is bytes:
+            v = v.decode('utf-8','replace')
+            super().__setitem__(k,v)
+        return v
     
     def __getitem__(self, k: str) -> str:
         '''https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html#sec4.2 - field names are case-insentive'''
-        return super().__getitem__(k.lower())
+        k = k.lower()
+        return self._decoded(k,super().__getitem__(k))
     def __setitem__(self, k: str, v: str) -> None:
         '''https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html#sec4.2 - field names are case-insentive'''
         super().__setitem__(k.lower(),v)
     def get(self, key : str, default=None):
-        return super().get(key.lower(),default)
+        key = key.lower()
+        v = super().get(key,default)
+        return self._decoded(key,v) if v is not default else v
+    def items(self):
+        return [(k,self._decoded(k,v)) for k,v in super().items()]
+    def values(self):
+        return [v for k,v in self.items()]
     
+def is_regular_file(file) -> bool:
+    '''Whether `file` is backed by a regular file on disk,so it can be sent with `sendfile`'''
+    try:
+        return stat.S_ISREG(os.fstat(file.fileno()).st_mode)
+    except (AttributeError,OSError,ValueError):
+        return False
+
+class ResponseBatch(object):
+    '''Collects the responses of pipelined requests,so they are written with one call per batch'''
+    def __init__(self,wfile : BufferedIOBase,limit : int = 65536) -> None:
+        self.wfile,self.limit = wfile,limit
+        self.buffer = bytearray()
+
+    def write(self,data) -> int:
+        self.buffer += data
+        if len(self.buffer) >= self.limit:self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(self.buffer)
+            self.buffer = bytearray()
+
+    def detach(self) -> BufferedIOBase:
+        '''Flushes the batch,returns the underlying `wfile`'''
+        self.flush()
+        return self.wfile
+
+class StreamWriter(object):
+    '''File-like object writing a response body of unknown length
+
+    Small writes are coalesced into blocks of at least `chunk_size`.With `chunked` set,every block
+    is framed as a `Transfer-Encoding: chunked` chunk,and `close` writes the last chunk
+    '''
+    def __init__(self,request,chunk_size : int = 16384,chunked : bool = True) -> None:
+        self.request,self.chunk_size,self.chunked = request,chunk_size,chunked
+        self.buffer = bytearray()
+        self.written = 0
+
+    def _send(self,data,last=b''):
+        if self.chunked:
+            if data:self.request.write_buffers(b'%x\r\n' % len(data),data,b'\r\n',last)
+            else:self.request.write_buffers(last)
+        else:
+            self.request.write_buffers(data)
+        self.written += len(data)
+
+    def write(self,data) -> int:
+        if isinstance(data,str):data = data.encode()
+        if not data:return 0
+        if not self.buffer and len(data) >= self.chunk_size:
+            self._send(data) # Big enough already,no need to copy it
+        else:
+            self.buffer += data
+            if len(self.buffer) >= self.chunk_size:self.flush()
+        return len(data)
+
+    def flush(self):
+        '''Sends what's buffered right away'''
+        if self.buffer:
+            self._send(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        '''Sends what's buffered,then ends the body'''
+        self._send(self.buffer,b'0\r\n\r\n' if self.chunked else b'')
+        self.buffer = bytearray()
+
+def iter_chunks(body,chunk_size : int = 16384):
+    '''Iterates a file-like object by `chunk_size` blocks,or any other iterable as-is'''
+    if not hasattr(body,'read'):
+        yield from body
+        return
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:return
+        yield chunk
+
+class RequestBody(BufferedIOBase):
+    '''Readable stream of a request body
+
+    The body is framed by `Content-Length`,or by `Transfer-Encoding: chunked`,which is decoded as it's read.
+    Nothing past the body is read,so the next request of the connection is left intact.
+
+    Besides `read`,`readinto` and `readline`,iterating the body yields blocks of at most `chunk_size`
+    '''
+    chunk_size = 65536
+
+    def __init__(self,rfile,length : int = None,limit : int = 0) -> None:
+        '''
+        Args:
+            rfile: Stream the body is read from
+            length (int, optional): `Content-Length` of the body,`None` if it's chunked. Defaults to None.
+            limit (int, optional): Max size of a chunked body,`0` means unlimited. Defaults to 0.
+        '''
+        self.rfile,self.length,self.limit = rfile,length,limit
+        self.chunked = length is None
+        self.remaining = 0 if self.chunked else length
+        '''Bytes left in the body,or in the current chunk if it's chunked'''
+        self.done = not self.chunked and not length
+        '''Whether the whole body has been read'''
+        self.consumed = 0
+        '''Bytes of the body read so far'''
+        self._chunk_end = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _next_chunk(self):
+        '''Reads the size line of the next chunk,and the trailers after the last one'''
+        line = self.rfile.readline(_MAXLINE + 1)
+        if self._chunk_end:
+            # The line break after the data of the previous chunk
+            if line.strip():raise BadRequestException(HTTPStatus.BAD_REQUEST,'Bad chunk')
+            line = self.rfile.readline(_MAXLINE + 1)
+        if not line:raise ConnectionAbortedError('Request body ended early')
+        size = line.split(b';',1)[0].strip() # Chunk extensions are ignored
+        try:
+            if len(line) > _MAXLINE or not size.isalnum():raise ValueError
+            self.remaining = int(size,16)
+        except ValueError:
+            raise BadRequestException(HTTPStatus.BAD_REQUEST,'Bad chunk size (%r)' % size[:32].decode('latin-1'))
+        self._chunk_end = True
+        if not self.remaining:
+            # The last chunk,skip the trailers
+            for _ in range(_MAXHEADERS + 1):
+                if self.rfile.readline(_MAXLINE + 1) in (b'\r\n',b'\n',b''):break
+            else:
+                raise BadRequestException(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,'Too many trailers')
+            self.done = True
+
+    def _available(self) -> bool:
+        '''Whether there's more to read,moving to the next chunk if needed'''
+        if self.done:return False
+        if not self.remaining:
+            self._next_chunk()
+            if self.limit and self.consumed + self.remaining > self.limit:
+                raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Request body exceeds %d bytes' % self.limit)
+        return not self.done
+
+    def _advance(self,size : int):
+        if not size:raise ConnectionAbortedError('Request body ended early')
+        self.remaining -= size
+        self.consumed += size
+        if not self.chunked and not self.remaining:self.done = True
+
+    def read1(self,size : int = -1) -> bytes:
+        '''Reads up to `size` bytes with at most one read of `rfile`'''
+        if not size or not self._available():return b''
+        data = self.rfile.read(self.remaining if size < 0 or size > self.remaining else size)
+        self._advance(len(data))
+        return data
+
+    def read(self,size : int = -1) -> bytes:
+        '''Reads `size` bytes,or the rest of the body if `size` is negative'''
+        if size is None or size < 0:return b''.join(self)
+        data = self.read1(size)
+        if len(data) == size or not data:return data
+        # Spans several chunks
+        chunks = [data]
+        size -= len(data)
+        while size:
+            data = self.read1(size)
+            if not data:break
+            chunks.append(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def readinto(self,buffer) -> int:
+        '''Reads into `buffer` until it's full or the body ends,reading into it directly if `rfile` supports it'''
+        view,filled = memoryview(buffer).cast('B'),0
+        readinto = getattr(self.rfile,'readinto',None)
+        while filled < len(view) and self._available():
+            wanted = min(len(view) - filled,self.remaining)
+            if readinto:
+                size = readinto(view[filled:filled + wanted])
+            else:
+                data = self.rfile.read(wanted)
+                size = len(data)
+                view[filled:filled + size] = data
+            self._advance(size)
+            filled += size
+        return filled
+
+    def readline(self,size : int = -1) -> bytes:
+        '''Reads a line of the body,of at most `size` bytes if it's not negative'''
+        chunks = []
+        while size and self._available():
+            data = self.rfile.readline(self.remaining if size < 0 or size > self.remaining else size)
+            self._advance(len(data))
+            chunks.append(data)
+            if data[-1:] == b'\n':break
+            if size > 0:size -= len(data)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read1(self.chunk_size)
+            if not chunk:return
+            yield chunk
+
+    def drain(self,limit : int = 65536) -> bool:
+        '''Reads and discards the rest of the body
+
+        Args:
+            limit (int, optional): Max count of bytes to discard. Defaults to 65536.
+
+        Returns:
+            bool : `False` if more than `limit` bytes were left,the body is left partially read then
+        '''
+        if not self.chunked and self.remaining > limit:return False
+        discarded = 0
+        while discarded <= limit:
+            chunk = self.read1(self.chunk_size)
+            if not chunk:return True
+            discarded += len(chunk)
+        return False
+
 class Request(StreamRequestHandler):
     '''HTTP/1.0 1.1 Request handler - based on `RequestHandler` of `site-package`'''
     wfile : BufferedIOBase
@@ -86,47 +476,209 @@ class Request(StreamRequestHandler):
     '''Contains parsed headers'''        
     headers_buffer : Headers
     '''The headers to be parsed'''
-    cookies : cookies.SimpleCookie
-    '''Contains request cookies'''
-    cookies_buffer : cookies.SimpleCookie
-    '''The cookies to be sent by us'''
     command : str
     '''The request command (GET,POST,etc)'''
     raw_requestline : str
     '''Raw `HTTP` request line of the request'''
+    raw_headers : bytes = None
+    '''Raw header lines of the request,read along with `raw_requestline` by `read_head`'''
     raw_request : socket.socket
     '''Raw TCP socket'''
     close_connection : bool
     '''Whether to preserve the connection (keep-alive one) or not'''
+    parked : bool
+    '''Whether the idle connection has been handed to the server's `keepalive` poller'''
+    idle : bool
+    '''Whether the connection is waiting for its next request'''
+    requests_handled : int
+    '''Count of requests handled on this connection'''
+    route : str = None
+    '''The `PathMaker` pattern this request was routed with'''
+    route_groups : tuple = ()
+    '''Groups captured by the route pattern'''
+    responses = _RESPONSES
+    '''Status codes -> (short message,long message)'''
+    logger = _LOGGER
+    raw_path : str
+    '''Request target,as sent by the client'''
+    _cookies : SimpleCookie = None
+    _cookies_buffer : SimpleCookie = None
+    _target : tuple = None
+    _path : str = None
+    _query : dict = None
+    _body : RequestBody = None
+    body_length : int = 0
+    '''`Content-Length` of the request body,`None` if it's chunked'''
+    head_buffered : int = None
+    '''Bytes that were left in the read buffer past the head of the request,`None` if it isn't known'''
+    compression = None
+    '''How the response is compressed,set by `CompressionWrapper`'''
+    max_body_size : int = 0
+    '''Max size of the request body,`0` means unlimited.Defaults to the server's,see `BodySizeLimitWrapper`'''
+    status : int = None
+    '''Status code of the response,set by `send_response` / `send_error`'''
+    bytes_sent : int = 0
+    '''Bytes written for this request so far (by `write_buffers` / `send_file`),response head included'''
     
     def __init__(self, request, client_address, server):
         '''The `server`,which is what instantlizes this handler,must have `handle` method
         which takes 1 argument (for the handler itself) 
+
+        Only the state every request needs is allocated here,and it's reused by every request
+        of the connection (see `reset`)
         '''
-        self.logger = logging.getLogger('Request')
         '''These values are from the server'''
         # The version of the HTTP protocol we support.
         # Set this to HTTP/1.1 to enable automatic keepalive
         self.protocol_version = server.protocol_version
         # Error page formats
         self.format_error_message = server.format_error_message
-        # hack to maintain backwards compatibility
-        self.responses = {
-            v: (v.phrase, v.description)
-            for v in HTTPStatus.__members__.values()
-        }
         self.headers = Headers()
         self.headers_buffer = Headers()
-        self.cookies = SimpleCookie()
-        self.cookies_buffer = SimpleCookie()
+        self.head_buffer = bytearray()
+        # Where the response head is serialized,reused by every response
         self.raw_request = request
         self.raw_request.settimeout(_MAXTIMEOUT)
+        # Keep-alive settings
+        self.keepalive = getattr(server,'keepalive',None)
+        self.keepalive_timeout = getattr(server,'keepalive_timeout',_MAXTIMEOUT)
+        self.keepalive_max_requests = getattr(server,'keepalive_max_requests',0)
+        self.parked = self.idle = False
+        self.requests_handled = 0
+        # Pipelining settings
+        self.pipeline_depth = getattr(server,'pipeline_depth',0)
+        self.pipeline_buffer_size = getattr(server,'pipeline_buffer_size',65536)
+        # Unread request bodies up to this size are discarded to keep the connection alive
+        self.body_drain_limit = getattr(server,'body_drain_limit',65536)
+        self.max_body_size = getattr(server,'max_body_size',0)
         super().__init__(request, client_address, server)
 
+    def split_target(self) -> tuple:
+        '''`raw_path` split like `urlparse` does,computed once per request
+
+        Returns:
+            tuple : scheme,netloc,path (still quoted),params,query string,fragment
+        '''
+        if self._target is None:
+            raw_path = self.raw_path
+            path,_,query = raw_path.partition('?')
+            if raw_path[:1] == '/' and raw_path[:2] != '//' and not ';' in path and not '#' in raw_path:
+                # Plain origin-form,which is what most requests look like
+                self._target = ('','',path,'',query,'')
+            else:
+                self._target = tuple(urlparse(raw_path))
+        return self._target
+
+    @property
+    def path(self) -> str:
+        '''Decoded path of the request,without the query string'''
+        if self._path is None:
+            path = self.split_target()[2]
+            self._path = unquote(path) if '%' in path else path
+        return self._path
+    @path.setter
+    def path(self, value : str):
+        self._path = value
+
+    @property
+    def query(self) -> dict:
+        '''Decoded query string,parsed on first access'''
+        if self._query is None:self._query = parse_qs(self.split_target()[4])
+        return self._query
+    @query.setter
+    def query(self, value : dict):
+        self._query = value
+
+    scheme   = property(lambda self:self.split_target()[0])
+    netloc   = property(lambda self:self.split_target()[1])
+    params   = property(lambda self:self.split_target()[3])
+    fragment = property(lambda self:self.split_target()[5])
+
+    @property
+    def cookies(self) -> SimpleCookie:
+        '''Contains request cookies,parsed on first access'''
+        if self._cookies is None:
+            cookies = self.headers.get('Cookie')
+            if cookies:
+                cookies = cookies.replace(' ','%20') # esacpe spaces : https://tools.ietf.org/html/rfc6265#section-4.1.1
+                self._cookies = SimpleCookie(cookies)
+            else:
+                self._cookies = SimpleCookie()
+        return self._cookies
+    @cookies.setter
+    def cookies(self, value : SimpleCookie):
+        self._cookies = value
+
+    def get_cookie(self, name : str, default : str = None) -> str:
+        '''Value of a single request cookie,without parsing every cookie into `cookies`
+
+        Returns:
+            str : The value,or `default` if the cookie isn't set
+        '''
+        if self._cookies is not None:
+            morsel = self._cookies.get(name)
+            return morsel.value if morsel else default
+        for pair in (self.headers.get('Cookie') or '').split(';'):
+            key,sep,value = pair.partition('=')
+            if sep and key.strip() == name:
+                value = value.strip()
+                return unquote_cookie(value) if value[:1] == '"' else value
+        return default
+
+    @property
+    def body(self) -> RequestBody:
+        '''The request body,read incrementally.See `RequestBody`
+
+        Raises:
+            BadRequestException: HTTP 413,when the body is larger than `max_body_size`
+        '''
+        if self._body is None:
+            if self.max_body_size and self.body_length is not None and self.body_length > self.max_body_size:
+                raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Request body exceeds %d bytes' % self.max_body_size)
+            self._body = RequestBody(self.rfile,self.body_length,self.max_body_size)
+        return self._body
+
+    def discard_body(self):
+        '''Discards what's left of the request body once it's handled,so the next request can be read
+
+        The connection is closed instead if more than `body_drain_limit` bytes are left,or the body is malformed
+        '''
+        if self.body_length == 0 or (self._body is not None and self._body.done):return
+        if self._body is None:self._body = RequestBody(self.rfile,self.body_length)
+        consumed = self._body.consumed
+        try:
+            if self._body.drain(self.body_drain_limit):return
+        except (BadRequestException,OSError):
+            pass
+        finally:
+            metrics = getattr(self.server,'metrics',None)
+            if metrics is not None:metrics.body_drained(self,self._body.consumed - consumed)
+        self.close_connection = True
+
+    @property
+    def cookies_buffer(self) -> SimpleCookie:
+        '''The cookies to be sent by us'''
+        if self._cookies_buffer is None:self._cookies_buffer = SimpleCookie()
+        return self._cookies_buffer
+    @cookies_buffer.setter
+    def cookies_buffer(self, value : SimpleCookie):
+        self._cookies_buffer = value
+
+    def reset(self):
+        '''Clears the state left by the previous request of the connection'''
+        self.headers.clear()
+        self.headers_buffer.clear()
+        self._cookies = self._cookies_buffer = None
+        self._body = self.compression = self.status = None
+        self.bytes_sent = 0
+        self.max_body_size = getattr(self.server,'max_body_size',0)
+        self.route,self.route_groups = Request.route,Request.route_groups
+
     def parse_request(self):
         """Parse a request (internal).
 
-        The request should be stored in self.raw_requestline; the results
+        The request should be stored in self.raw_requestline and
+        self.raw_headers (or be readable from self.rfile); the results
         are in self.command, self.path, self.request_version and
         self.headers.
 
@@ -134,6 +686,7 @@ class Request(StreamRequestHandler):
         error response has already been sent back.
         """
         self.command = None  # set in case of error on the first line
+        self.body_length = 0
         self.request_version = default_request_version
         self.close_connection = True
         try:
@@ -184,16 +737,15 @@ class Request(StreamRequestHandler):
                 self.send_error(HTTPStatus.BAD_REQUEST,"Bad HTTP/0.9 request type (%r)" % command)
                 return False        
         self.command, self.raw_path = command, path
-        self.scheme, self.netloc, self.path, self.params, self.query, self.fragment = urlparse(self.raw_path)
-        self.path = unquote(self.path)
-        self.query = parse_qs(self.query) # Decodes query string to a `dict`
-        # Decode the URI
+        self._target = self._path = self._query = None
+        # The URI is decoded once `path` / `query` is accessed
         # Examine the headers and look for a Connection directive.
         try:
-            self.headers = Headers.parse(self.rfile)
-            if self.headers.get('Cookie'):
-                cookies = self.headers.get('Cookie').replace(' ','%20') # esacpe spaces : https://tools.ietf.org/html/rfc6265#section-4.1.1
-                self.cookies = SimpleCookie(cookies)                
+            if self.raw_headers is None:
+                Headers.parse(self.rfile,self.headers)
+            else:
+                Headers.parse_block(self.raw_headers,self.headers)
+            # The cookies are parsed once `cookies` is accessed
         except client.LineTooLong as err:
             self.send_error(
                 HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
@@ -215,6 +767,21 @@ class Request(StreamRequestHandler):
             elif (conntype.lower() == 'keep-alive' and
                 self.protocol_version >= "HTTP/1.1"):
                 self.close_connection = False
+        # Examine the headers and look for the framing of the body
+        transfer_encoding = self.headers.get('Transfer-Encoding')
+        content_length = self.headers.get('Content-Length')
+        if transfer_encoding:
+            if transfer_encoding.rsplit(',',1)[-1].strip().lower() != 'chunked':
+                self.send_error(HTTPStatus.NOT_IMPLEMENTED,"Unsupported Transfer-Encoding (%r)" % transfer_encoding)
+                return False
+            # `Content-Length` is ignored then,see https://tools.ietf.org/html/rfc7230#section-3.3.3
+            self.body_length = None
+            if content_length:self.close_connection = True
+        elif content_length:
+            if not content_length.isdigit():
+                self.send_error(HTTPStatus.BAD_REQUEST,"Bad Content-Length (%r)" % content_length)
+                return False
+            self.body_length = int(content_length)
         # Examine the headers and look for an Expect directive
         expect = self.headers.get('Expect')
         if (expect and expect.lower() == "100-continue" and
@@ -249,7 +816,11 @@ class Request(StreamRequestHandler):
         commands such as GET and POST.
         """
         try:
-            self.raw_requestline = self.rfile.readline(65537)
+            self.raw_requestline,self.raw_headers,self.head_buffered = read_head(self.rfile)
+            if self.requests_handled:self.reset()
+            if self.idle and self.keepalive_timeout != _MAXTIMEOUT:
+                self.raw_request.settimeout(_MAXTIMEOUT)
+            self.idle = False
             if len(self.raw_requestline) > 65536:
                 self.requestline = ''
                 self.request_version = ''
@@ -262,9 +833,17 @@ class Request(StreamRequestHandler):
             if not self.parse_request():
                 # An error code has been sent, just exit
                 return
+            if isinstance(self.wfile,ResponseBatch) and self.headers.get('Upgrade'):
+                # The protocol is about to be switched,stop batching
+                self.wfile = self.wfile.detach()
             '''Now,ask the server to process the request'''
-            self.send_header('Connection','keep-alive')
+            self.requests_handled += 1
+            if self.close_connection or (self.keepalive_max_requests and self.requests_handled >= self.keepalive_max_requests):
+                self.send_header('Connection','close')
+            else:
+                self.send_header('Connection','keep-alive')
             self.server.handle(request=self)
+            if not self.close_connection:self.discard_body()
             return
         except ResponseNotReady as e:
             self.log_error("Bad Response: %s",e)
@@ -279,16 +858,82 @@ class Request(StreamRequestHandler):
             self.close_connection = True
             return            
     def handle(self):
-        """Handle multiple requests if necessary."""
-        self.log_debug('-- -- Created new HTTP connection')
+        """Handle multiple requests if necessary.
+
+        When the server has a `keepalive` poller,the connection is parked (with `parked` set)
+        once it goes idle.The server calls this again once the next request is readable.
+
+        Pipelined requests already in the read buffer are handled by `handle_pipeline`
+        """
+        if not self.requests_handled:self.log_debug('-- -- Created new HTTP connection')
+        self.parked = False
         self.close_connection = True
         self.handle_one_request()            
         try:
-            while not self.close_connection:           
+            while not self.close_connection:
+                if getattr(self.server,'draining',False):
+                    break
+                if self.pipeline_depth or self.keepalive is not None:
+                    pipelined = self.has_buffered_input()
+                    if pipelined and self.pipeline_depth:
+                        self.handle_pipeline()
+                        continue
+                    if not pipelined and self.keepalive is not None:
+                        self.parked = True
+                        return
+                self.idle = True
+                if self.keepalive_timeout != _MAXTIMEOUT:
+                    self.raw_request.settimeout(self.keepalive_timeout)
                 self.handle_one_request()          
         except Exception as e:
             return self.log_debug('Connection closed %s' % e)
         self.log_debug('Connection closed')
+
+    def handle_pipeline(self):
+        """Handles the pipelined requests already in the read buffer,in order
+
+        Their responses are collected in a `ResponseBatch`,which is written once no more
+        requests are buffered,or `pipeline_depth` requests were handled
+        """
+        wfile = self.wfile
+        self.wfile = batch = ResponseBatch(wfile,self.pipeline_buffer_size)
+        try:
+            for _ in range(self.pipeline_depth):
+                self.handle_one_request()
+                if self.close_connection or self.wfile is not batch:break
+                if not self.has_buffered_input():break
+        finally:
+            batch.flush()
+            self.wfile = wfile
+
+    def has_buffered_input(self):
+        """Checks if the next request is readable already,without blocking
+
+        Usually that's known from what was buffered along with the head,and no system call is made.
+        The socket is only polled if the body was larger than that,or the head took several reads
+        """
+        buffered,length = self.head_buffered,self.body_length
+        if buffered is not None and length is not None and length <= buffered:
+            # The body was read from the buffer,and nothing was read from the socket since
+            return buffered > length
+        self.raw_request.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return True # Let `handle_one_request` deal with it
+        finally:
+            self.raw_request.settimeout(_MAXTIMEOUT)
+
+    def setup(self):
+        super().setup()
+        connections = getattr(self.server,'connections',None)
+        if connections is not None:connections.add(self)
+
+    def finish(self):
+        """Closes the I/O,unless the connection is parked"""
+        connections = getattr(self.server,'connections',None)
+        if connections is not None:connections.discard(self)
+        if not self.parked:super().finish()
     def send_error(self, code, message=None, explain=None):
         """Send and log an error reply.
 
@@ -315,6 +960,9 @@ class Request(StreamRequestHandler):
         if explain is None:
             explain = longmsg
         self.log_error("HTTP %d -- %s", code, explain)
+        self.status = code
+        metrics = getattr(self.server,'metrics',None)
+        if metrics is not None:metrics.error_sent(self,code)
         self.clear_header()
         self.send_response_only(code, message)
         self.send_header('Connection', 'close')
@@ -327,21 +975,14 @@ class Request(StreamRequestHandler):
             code not in (HTTPStatus.NO_CONTENT,
                          HTTPStatus.RESET_CONTENT,
                          HTTPStatus.NOT_MODIFIED)):
-            # HTML encode to prevent Cross Site Scripting attacks
-            # (see bug #1100201)
-            content = self.format_error_message(
-                code   =code,
-                message=escape(message, quote=False),
-                explain=escape(explain, quote=False),
-                request=self
-            )
-            body = content.encode('UTF-8', 'replace')
+            render_error_message = getattr(self.server,'render_error_message',None)
+            if render_error_message:
+                body = render_error_message(code,message,explain,self)
+            else:
+                body = render_error(self.format_error_message,code,message,explain,self)
             self.send_header("Content-Type", 'text/html;charset=utf-8')
             self.send_header('Content-Length', str(len(body)))
-        self.end_headers()
-
-        if self.command != 'HEAD' and body:
-            self.wfile.write(body)
+        self.end_headers(body if self.command != 'HEAD' else None)
     
     def response_line(self,code,message=''):
         return "%s %d %s\r\n" % (self.protocol_version, code, message)
@@ -351,6 +992,7 @@ class Request(StreamRequestHandler):
         response code.
         """
         self.log_request(code)
+        self.status = code
         self.send_header('Content-Length',0)
         self.send_response_only(code, message)
 
@@ -366,7 +1008,7 @@ class Request(StreamRequestHandler):
             # Always send this at the begining
     
     def clear_header(self):
-        self.headers_buffer = Headers()
+        self.headers_buffer.clear()
 
     def send_header(self, keyword, value):
         """Send a MIME header to the headers buffer."""
@@ -388,18 +1030,190 @@ class Request(StreamRequestHandler):
         self.cookies_buffer[key]=value
         for k in kwargs:self.cookies_buffer[key][k] = kwargs[k]
 
-    def end_headers(self):
+    def add_header(self, keyword, value):
+        """Adds a MIME header to the headers buffer,keeping the values it has already
+        (e.g. several `Set-Cookie` headers)"""
+        if self.request_version != 'HTTP/0.9':
+            self.headers_buffer.add(keyword,value)
+
+    def end_headers(self, *body):
         """Adds the cookies and blank line ending of the MIME headers to the buffer,
-        then flushes the buffer"""
+        then flushes the buffer
+
+        `body` buffers,if given,are written along with the headers (see `flush_headers`)"""
         if self.request_version != 'HTTP/0.9':         
-            if self.cookies_buffer:self.headers_buffer.add_header_line(self.cookies_buffer.output())
-            self.flush_headers()
+            if self._cookies_buffer:
+                for morsel in self._cookies_buffer.values():
+                    self.headers_buffer.add('Set-Cookie',morsel.OutputString())
+            self.flush_headers(*body)
+        elif body:
+            self.write_buffers(*body)
+
+    def flush_headers(self, *body):
+        """Writes the headers buffer,followed by the bytes-like `body` buffers if given
 
-    def flush_headers(self):
+        The headers are serialized into `head_buffer`,then sent with the body in one `write_buffers` call
+        """
         if not self.headers_buffer.response_line:
             raise ResponseNotReady('No response line is present')
-        self.wfile.write(self.headers_buffer.encode())
-        self.headers_buffer = Headers()
+        head = self.headers_buffer.encode(self.head_buffer)
+        self.headers_buffer.clear()
+        self.write_buffers(head,*body)
+
+    def send_body(self, body, buffer_size : int = 65536, chunk_size : int = 16384) -> int:
+        """Ends the headers,then sends a body whose length isn't known ahead
+
+        The body is buffered up to `buffer_size` first.If it ends by then,it's sent with a `Content-Length`.
+        Otherwise it's streamed as it's produced,with `Transfer-Encoding: chunked` on HTTP/1.1 (the connection
+        is kept alive),or delimited by closing the connection on HTTP/1.0.
+        With `compression` set,a buffered body is compressed at once (see `Compression.apply`),
+        a streamed one block by block as it's sent
+
+        Args:
+            body: An iterable (e.g. a generator) of bytes-like / `str` chunks,or a file-like object
+            buffer_size (int, optional): Bodies up to this size are sent with a `Content-Length`. Defaults to 65536.
+            chunk_size (int, optional): Min size of the blocks written while streaming. Defaults to 16384.
+
+        Returns:
+            int : Bytes of body sent
+        """
+        iterator = source = iter_chunks(body,chunk_size)
+        buffered,size = [],0
+        try:
+            for chunk in iterator:
+                if isinstance(chunk,str):chunk = chunk.encode()
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:break
+            else:
+                buffered = [b''.join(buffered)] if len(buffered) > 1 else buffered
+                # Ended within the buffer
+                if self.compression is not None:
+                    buffered = [self.compression.apply(self,buffered[0] if buffered else b'')]
+                    size = len(buffered[0])
+                self.send_header('Content-Length',str(size))
+                if self.command == 'HEAD':self.end_headers()
+                else:self.end_headers(*buffered)
+                return size
+            if self.compression is not None:
+                chunks = itertools.chain(buffered,source)
+                iterator = self.compression.stream(self,chunks,chunk_size)
+                if iterator is chunks:iterator = source # Sent as-is
+                elif self.command != 'HEAD':
+                    buffered = [next(iterator,b'')] # The first compressed block goes along with the headers
+                    size = len(buffered[0])
+            buffered = [b''.join(buffered)] if len(buffered) > 1 else buffered
+            self.headers_buffer.pop('content-length',None)
+            if self.command == 'HEAD':
+                self.end_headers()
+                return 0
+            chunked = self.request_version >= 'HTTP/1.1' and self.protocol_version >= 'HTTP/1.1'
+            if chunked:
+                self.send_header('Transfer-Encoding','chunked')
+                self.end_headers(b'%x\r\n' % size,*buffered,b'\r\n')
+            else:
+                self.send_header('Connection','close')
+                self.end_headers(*buffered)
+            writer = StreamWriter(self,chunk_size,chunked)
+            try:
+                for chunk in iterator:writer.write(chunk)
+            except (ConnectionError,socket.timeout):
+                raise
+            except Exception as e:
+                # The response has begun already,so it can only be cut short
+                self.close_connection = True
+                raise ConnectionAbortedError('Response body failed: %s' % e) from e
+            writer.close()
+            return size + writer.written
+        finally:
+            if iterator is not source:iterator.close()
+            source.close()
+
+    def send_file(self, file, offset : int = 0, count : int = None, chunk_size : int = 163840) -> int:
+        '''Ends the headers,then sends `count` bytes of `file` from `offset` as the body
+
+        Regular files are sent with `socket.sendfile`,which lets the kernel copy them to the socket (`os.sendfile`)
+        where it's supported.Files smaller than `_SENDFILE_MIN` are sent along with the headers in one write instead,
+        and so is everything that can't be sent that way (e.g. `BytesIO`,or TLS sockets),block by block.
+        Regular files are never read from their current position,so they can be shared by concurrent requests.
+        `Content-Length` should be set by the caller
+
+        Args:
+            file: Seekable file-like object
+            offset (int, optional): Where the body starts. Defaults to 0.
+            count (int, optional): Length of the body. Defaults to the rest of the file.
+            chunk_size (int, optional): Size of the blocks,when the file is copied. Defaults to 163840.
+
+        Returns:
+            int : Bytes of the body sent
+        '''
+        if count is None:count = os.fstat(file.fileno()).st_size - offset if is_regular_file(file) else -1
+        if self.command == 'HEAD':
+            self.end_headers()
+            return 0
+        return self.write_file(file,offset,count,end_headers=True,chunk_size=chunk_size)
+
+    def write_file(self, file, offset : int, count : int, *buffers, end_headers : bool = False, chunk_size : int = 163840) -> int:
+        '''Writes bytes-like `buffers`,then `count` bytes (or the rest,if negative) of `file` from `offset`
+
+        See `send_file`,which this is the body of.Small ranges are written along with `buffers`
+
+        Args:
+            end_headers (bool, optional): Send the headers before `buffers`. Defaults to False.
+
+        Returns:
+            int : Bytes of `file` sent
+        '''
+        write = self.end_headers if end_headers else self.write_buffers
+        wfile = self.wfile.wfile if isinstance(self.wfile,ResponseBatch) else self.wfile
+        regular = is_regular_file(file)
+        if 0 <= count < _SENDFILE_MIN or wfile.__class__ is not _SocketWriter or not regular:
+            if regular and _PREAD:
+                # Positioned reads,so the file can be shared by several requests
+                read = lambda size:os.pread(file.fileno(),size,offset + sent)
+            else:
+                file.seek(offset)
+                read = file.read
+            sent = 0
+            chunk = read(count if 0 <= count < chunk_size else chunk_size)
+            write(*buffers,chunk)
+            sent = len(chunk)
+            while chunk and sent != count:
+                chunk = read(count - sent if 0 <= count - sent < chunk_size else chunk_size)
+                self.write_buffers(chunk)
+                sent += len(chunk)
+            return sent
+        write(*buffers)
+        if wfile is not self.wfile:self.wfile.flush() # The batched responses go first
+        sent = self.connection.sendfile(file,offset,count if count >= 0 else None)
+        self.bytes_sent += sent
+        return sent
+
+    def write_buffers(self, *buffers):
+        """Writes bytes-like `buffers` in order
+
+        When `wfile` is the socket itself,they're sent with a single scatter-gather `sendmsg` call.
+        Otherwise,small buffers are joined so they're still written at once
+        """
+        buffers = [buffer for buffer in buffers if buffer]
+        self.bytes_sent += sum(map(len,buffers))
+        if len(buffers) > _MAXBUFFERS:buffers = [b''.join(buffers)]
+        wfile = self.wfile
+        if wfile.__class__ is _SocketWriter and _SENDMSG:
+            sock = self.connection
+            sent = sock.sendmsg(buffers)
+            for buffer in buffers:
+                if sent >= len(buffer):
+                    sent -= len(buffer)
+                    continue
+                sock.sendall(memoryview(buffer)[sent:]) # Partially sent
+                sent = 0
+        elif isinstance(wfile,ResponseBatch):
+            for buffer in buffers:wfile.write(buffer)
+        elif len(buffers) > 1 and sum(map(len,buffers)) <= _JOIN_LIMIT:
+            wfile.write(b''.join(buffers))
+        else:
+            for buffer in buffers:wfile.write(bytes(buffer) if buffer.__class__ is bytearray else buffer)
 
     def log_request(self, code='-'):
         """Log an accepted request.
@@ -0,0 +1,94 @@
+'''Parking of idle keep-alive connections
+
+Between two requests,a HTTP/1.1 keep-alive connection would otherwise hold a thread blocked in
+`rfile.readline`.With `PyWebHost.park_idle_connections` set,the connection is handed to a single
+`selectors`-based poller instead,and goes back to a worker only once its next request is readable.
+'''
+import logging,selectors,socket,threading,time
+from collections import OrderedDict,deque
+
+class KeepAlivePoller(object):
+    '''Watches idle connections in one thread
+
+    - `on_ready(handler)`  : called (in the poller thread) once the next request is readable,
+                             it must not block since every other parked connection waits meanwhile
+    - `on_expire(handler)` : called once the connection has been idle for `timeout` seconds,
+                             or when the poller is closed
+    '''
+    def __init__(self,timeout : float,on_ready,on_expire,name : str = 'PyWebHostKeepAlive') -> None:
+        self.timeout,self.on_ready,self.on_expire = timeout,on_ready,on_expire
+        self.logger = logging.getLogger('KeepAlivePoller')
+        self.selector = selectors.DefaultSelector()
+        self._pending = deque()
+        self._deadlines = OrderedDict()
+        '''socket -> (handler,deadline),in the order they were parked'''
+        self._wakeup_r,self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self.selector.register(self._wakeup_r,selectors.EVENT_READ)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,name=name,daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._deadlines) + len(self._pending)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass # Buffer full,the poller is going to wake up anyway
+
+    def park(self,handler):
+        '''Hands an idle connection over to the poller,thread-safe'''
+        if self._closed:return self.on_expire(handler)
+        self._pending.append(handler)
+        self._wakeup()
+
+    def _register(self):
+        deadline = time.monotonic() + self.timeout
+        while self._pending:
+            handler = self._pending.popleft()
+            try:
+                self.selector.register(handler.connection,selectors.EVENT_READ,handler)
+                self._deadlines[handler.connection] = (handler,deadline)
+            except (ValueError,OSError):
+                # Closed already
+                self.on_expire(handler)
+
+    def _release(self,connection):
+        self.selector.unregister(connection)
+        return self._deadlines.pop(connection)[0]
+
+    def _run(self):
+        while not self._closed:
+            try:
+                events = self.selector.select(timeout=1)
+            except OSError as e:
+                self.logger.warning('Poll failed: %s' % e)
+                continue
+            for key,_ in events:
+                if key.fileobj is self._wakeup_r:
+                    try:
+                        while self._wakeup_r.recv(4096):pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self.on_ready(self._release(key.fileobj))
+            self._register()
+            now = time.monotonic()
+            # Connections are parked in order,so the expired ones are always at the front
+            while self._deadlines:
+                connection,(handler,deadline) = next(iter(self._deadlines.items()))
+                if deadline > now:break
+                self.on_expire(self._release(connection))
+        for connection in list(self._deadlines):self.on_expire(self._release(connection))
+        while self._pending:self.on_expire(self._pending.popleft())
+        self.selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def close(self):
+        '''Stops the poller,every parked connection is expired'''
+        self._closed = True
+        self._wakeup()
+        self._thread.join()
@@ -0,0 +1,319 @@
+'''Metrics of the server,exposed in the Prometheus text format
+
+    server = PyWebHost(('',1234))
+    server.metrics = ServerMetrics(server)
+    server.route('/metrics')(metrics_handler)
+
+Counters and histograms are sharded per thread: every thread updates its own `dict`,so recording
+takes no lock.The shards are only summed (and those of finished threads merged) when they're collected.
+
+Requests are counted by route pattern,method and status,with their latency and bytes in / out.
+Gauges report the connections,threads and worker pool of the server,and `WebsocketSession` counts
+its sessions and frames.Custom metrics can be added to the same registry with `register`.
+'''
+import bisect,threading
+from http import HTTPStatus
+from .modules import BadRequestException,writestream
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+'''`Content-Type` of the Prometheus text format'''
+LATENCY_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+'''Default upper bounds of the latency histograms,in seconds'''
+
+def escape_label(value) -> str:
+    return str(value).replace('\\','\\\\').replace('\n','\\n').replace('"','\\"')
+
+def format_value(value) -> str:
+    if isinstance(value,float):
+        if value != value:return 'NaN'
+        if value in (float('inf'),float('-inf')):return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+def format_labels(names : tuple,values : tuple,extra : str = '') -> str:
+    pairs = ['%s="%s"' % (name,escape_label(value)) for name,value in zip(names,values)]
+    if extra:pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+class Metric(object):
+    '''Base of the metrics,values are kept per label values (a `tuple`) in per-thread shards'''
+    type = 'untyped'
+
+    def __init__(self,name : str,help : str = '',labels : tuple = ()) -> None:
+        '''
+        Args:
+            name (str): Name of the metric
+            help (str, optional): Description of the metric. Defaults to ''.
+            labels (tuple, optional): Names of its labels. Defaults to ().
+        '''
+        self.name,self.help,self.labels = name,help,tuple(labels)
+        self._local = threading.local()
+        self._shards = list()
+        '''`(thread,shard)` of every thread that recorded a value'''
+        self._retired = dict()
+        '''Values merged from the shards of finished threads'''
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        '''The shard of the current thread'''
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = dict()
+            with self._lock:
+                if len(self._shards) >= 64:self._retire()
+                self._shards.append((threading.current_thread(),shard))
+            return shard
+
+    def _merge(self,into : dict,shard : dict):
+        raise NotImplementedError
+
+    def _retire(self):
+        '''Merges the shards of finished threads,with `_lock` held'''
+        alive = list()
+        for thread,shard in self._shards:
+            if thread.is_alive():alive.append((thread,shard))
+            else:self._merge(self._retired,shard)
+        self._shards = alive
+
+    def values(self) -> dict:
+        '''Sums the shards
+
+        Returns:
+            dict : Label values -> value
+        '''
+        with self._lock:
+            self._retire()
+            total = dict()
+            self._merge(total,self._retired)
+            for _,shard in self._shards:self._merge(total,dict(shard)) # Copied at once,while it may be updated
+        return total
+
+    def collect(self) -> list:
+        '''Samples of the metric
+
+        Returns:
+            list : `(name suffix,labels string,value)` of every sample
+        '''
+        return [('',format_labels(self.labels,labels),value) for labels,value in sorted(self.values().items(),key=str)]
+
+class Counter(Metric):
+    '''A value that only goes up'''
+    type = 'counter'
+
+    def inc(self,labels : tuple = (),value : float = 1):
+        '''Adds `value` to the counter of `labels`'''
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[labels] = shard.get(labels,0) + value
+
+    def _merge(self,into : dict,shard : dict):
+        for labels,value in shard.items():into[labels] = into.get(labels,0) + value
+
+class Gauge(Counter):
+    '''A value that goes up and down
+
+    Either updated with `inc` / `dec` (from any thread),or read from `function` when it's collected
+    '''
+    type = 'gauge'
+
+    def __init__(self,name : str,help : str = '',labels : tuple = (),function=None) -> None:
+        '''
+        Args:
+            function (optional): Called when the gauge is collected,returns its value,
+                                 or a dict of label values -> value if it has labels. Defaults to None.
+        '''
+        super().__init__(name,help,labels)
+        self.function = function
+
+    def dec(self,labels : tuple = (),value : float = 1):
+        self.inc(labels,-value)
+
+    def values(self) -> dict:
+        if self.function is None:return super().values()
+        value = self.function()
+        if value is None:return dict()
+        return value if isinstance(value,dict) else {() : value}
+
+class Histogram(Metric):
+    '''Distribution of observed values,counted by buckets'''
+    type = 'histogram'
+
+    def __init__(self,name : str,help : str = '',labels : tuple = (),buckets : tuple = LATENCY_BUCKETS) -> None:
+        '''
+        Args:
+            buckets (tuple, optional): Upper bounds of the buckets,`+Inf` is added. Defaults to LATENCY_BUCKETS.
+        '''
+        super().__init__(name,help,labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self,value : float,labels : tuple = ()):
+        '''Counts `value` in its bucket'''
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # Count of every bucket (not cumulative),then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets,value)] += 1
+        counts[-1] += value
+
+    def _merge(self,into : dict,shard : dict):
+        for labels,counts in shard.items():
+            total = into.get(labels)
+            if total is None:into[labels] = list(counts)
+            else:into[labels] = [a + b for a,b in zip(total,counts)]
+
+    def collect(self) -> list:
+        samples = list()
+        for labels,counts in sorted(self.values().items(),key=str):
+            cumulative = 0
+            for bound,count in zip(self.buckets + (float('inf'),),counts):
+                cumulative += count
+                samples.append(('_bucket',format_labels(self.labels,labels,'le="%s"' % format_value(float(bound))),cumulative))
+            samples.append(('_sum',format_labels(self.labels,labels),counts[-1]))
+            samples.append(('_count',format_labels(self.labels,labels),cumulative))
+        return samples
+
+class Registry(object):
+    '''A set of metrics,exposed together'''
+    def __init__(self) -> None:
+        self.metrics = dict()
+
+    def register(self,metric : Metric) -> Metric:
+        '''Adds `metric`,or returns the one registered with its name already'''
+        return self.metrics.setdefault(metric.name,metric)
+
+    def counter(self,name : str,help : str = '',labels : tuple = ()) -> Counter:
+        return self.register(Counter(name,help,labels))
+
+    def gauge(self,name : str,help : str = '',labels : tuple = (),function=None) -> Gauge:
+        return self.register(Gauge(name,help,labels,function))
+
+    def histogram(self,name : str,help : str = '',labels : tuple = (),buckets : tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name,help,labels,buckets))
+
+    def collect(self) -> list:
+        '''Metrics to be exposed,`Metric` objects or anything with the same `name`,`help`,`type` and `collect`'''
+        return list(self.metrics.values())
+
+    def exposition(self) -> str:
+        '''Every metric,in the Prometheus text format'''
+        lines = list()
+        for metric in self.collect():
+            if metric.help:lines.append('# HELP %s %s' % (metric.name,metric.help.replace('\\','\\\\').replace('\n','\\n')))
+            lines.append('# TYPE %s %s' % (metric.name,metric.type))
+            for suffix,labels,value in metric.collect():
+                lines.append('%s%s%s %s' % (metric.name,suffix,labels,format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+class _StageTimings(object):
+    '''Exposes `stage_timings` of the server (see `compile_pipeline`) as metrics'''
+    def __init__(self,server,name : str,help : str,index : int) -> None:
+        self.server,self.name,self.help,self.index = server,name,help,index
+        self.type = 'counter'
+
+    def collect(self) -> list:
+        stage_timings = getattr(self.server,'stage_timings',None)
+        if stage_timings is None:return []
+        return [
+            ('',format_labels(('route','stage'),(route,stage)),timing[self.index])
+            for route,stages in stage_timings().items() for stage,timing in stages.items()
+        ]
+
+class ServerMetrics(Registry):
+    '''Metrics of a `PyWebHost` (or `AsyncPyWebHost`),set it as the `metrics` of the server to record them'''
+    def __init__(self,server = None,prefix : str = 'pywebhost_',buckets : tuple = LATENCY_BUCKETS) -> None:
+        '''
+        Args:
+            server (optional): The server,whose connections,threads and worker pool are reported. Defaults to None.
+            prefix (str, optional): Prefix of the names of the metrics. Defaults to 'pywebhost_'.
+            buckets (tuple, optional): Upper bounds of the latency buckets. Defaults to LATENCY_BUCKETS.
+        '''
+        super().__init__()
+        self.server = server
+        self.requests = self.counter(prefix + 'requests_total','Requests handled,by route pattern,method and status',('route','method','status'))
+        self.latency = self.histogram(prefix + 'request_duration_seconds','Time spent handling requests,by route pattern',('route',),buckets)
+        self.bytes_in = self.counter(prefix + 'request_bytes_total','Bytes received (request heads and bodies),by route pattern',('route',))
+        self.bytes_out = self.counter(prefix + 'response_bytes_total','Bytes sent (response heads and bodies),by route pattern',('route',))
+        self.errors = self.counter(prefix + 'errors_total','Error responses sent with send_error,by status',('status',))
+        self.content = self.counter(prefix + 'content_responses_total','Responses of WriteContentToRequest,by kind (full,range,multirange,unsatisfiable)',('kind',))
+        self.content_bytes = self.counter(prefix + 'content_bytes_total','Bytes sent by WriteContentToRequest,response heads included')
+        self.websockets = self.gauge(prefix + 'websocket_sessions','Open websocket sessions')
+        self.websockets_opened = self.counter(prefix + 'websocket_sessions_total','Websocket sessions opened')
+        self.frames = self.counter(prefix + 'websocket_frames_total','Websocket frames,by direction and opcode',('direction','opcode'))
+        self.frame_bytes = self.counter(prefix + 'websocket_frame_bytes_total','Websocket frame bytes,by direction',('direction',))
+        if server is not None:
+            self.gauge(prefix + 'connections','Connections being handled (active) or parked idle in the keep-alive poller',('state',),self._connections)
+            self.gauge(prefix + 'threads','Live threads of the process',function=threading.active_count)
+            self.gauge(prefix + 'pool_workers','Worker pool threads,by state',('state',),self._pool_workers)
+            self.gauge(prefix + 'pool_queued','Connections waiting for a pool worker',function=self._pool_queued)
+            self.register(_StageTimings(server,prefix + 'stage_seconds_total','Time spent in the stages of timed routes',1))
+            self.register(_StageTimings(server,prefix + 'stage_calls_total','Calls of the stages of timed routes',0))
+
+    def _connections(self):
+        stats = getattr(self.server,'stats',None)
+        if stats is None:return None
+        stats = stats()
+        return {('active',) : stats['active'],('parked',) : stats['parked']}
+
+    def _pool_workers(self):
+        pool = getattr(self.server,'pool',None)
+        if pool is None:return None
+        stats = pool.stats()
+        return {('busy',) : stats['busy'],('idle',) : stats['idle']}
+
+    def _pool_queued(self):
+        pool = getattr(self.server,'pool',None)
+        return pool.queue.qsize() if pool is not None else None
+
+    def request_handled(self,request,elapsed : float):
+        '''Records a request,once `handle` returns'''
+        route = request.route or ''
+        status = request.status
+        self.requests.inc((route,request.command,status.value if isinstance(status,HTTPStatus) else status or 0))
+        self.latency.observe(elapsed,(route,))
+        # What was read of the body,rather than its `Content-Length`: rejected / shed bodies are never received
+        body = request._body
+        received = max(body.consumed if body is not None else 0,getattr(request,'prefetched',0))
+        self.bytes_in.inc((route,),len(request.raw_requestline or b'') + len(request.raw_headers or b'') + received)
+        self.bytes_out.inc((route,),request.bytes_sent)
+
+    def body_drained(self,request,size : int):
+        '''Records the rest of a body discarded by `Request.discard_body`,after `request_handled`'''
+        if size > 0:self.bytes_in.inc((request.route or '',),size)
+
+    def error_sent(self,request,code : int):
+        self.errors.inc((int(code),))
+
+    def content_sent(self,kind : str,size : int):
+        self.content.inc((kind,))
+        if size > 0:self.content_bytes.inc((),size)
+
+    def websocket_opened(self):
+        self.websockets.inc()
+        self.websockets_opened.inc()
+
+    def websocket_closed(self):
+        self.websockets.dec()
+
+    def websocket_frame(self,direction : str,opcode : int,size : int):
+        self.frames.inc((direction,opcode))
+        self.frame_bytes.inc((direction,),size)
+
+def metrics_handler(initator,request,content):
+    '''Route handler exposing the `metrics` of the server
+
+        server.route('/metrics')(metrics_handler)
+    '''
+    metrics = getattr(initator,'metrics',None)
+    if metrics is None:raise BadRequestException(HTTPStatus.NOT_FOUND,'Metrics are disabled')
+    request.send_response(HTTPStatus.OK)
+    request.send_header('Content-Type',CONTENT_TYPE)
+    request.send_header('Cache-Control','no-store')
+    return writestream(request,metrics.exposition().encode())
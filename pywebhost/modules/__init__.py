@@ -3,17 +3,12 @@ from http.client import CONTINUE, OK
 from io import BufferedIOBase, BufferedReader, IOBase,BytesIO
 from os import system
 import time
-from ..handler import Request
+from ..handler import Request,BadRequestException,is_regular_file
 from http import HTTPStatus
-import os,mimetypes,json,base64,select
+import os,mimetypes,json,base64,select,asyncio,inspect,threading
 from typing import Any, NamedTuple, Type, Union
-
-class BadRequestException(Exception):
-    '''Exception with code and explaination'''
-    def __init__(self,code,explain=None) -> None:
-        self.code = code
-        self.explain = explain
-        super().__init__(explain)
+from tempfile import SpooledTemporaryFile
+from .serializers import get_codec,negotiate_codec,request_codec
 
 def ModuleWrapper(provider):    
     '''Base circlular wrapper support func
@@ -36,7 +31,7 @@ def ModuleWrapper(provider):
         ...
 
     # provider
-     A function,that when called with arguments,always returns tuple (prefix,suffix) of functions:
+     A function,that when called with arguments,always returns tuple (prefix,suffix) or (prefix,suffix,final) of functions:
     - prefix : what to execute when called by server
         - takes two arguments : `request` (Request) , `previous_prefix_result`
             - `request` is what it is,represented by the `pywebhost.Request` object
@@ -47,21 +42,211 @@ def ModuleWrapper(provider):
             - `request` is what it is,represented by the `pywebhost.Request` object
             - `function_result` is the result of the function wrapped
         - returns a value , which , if chained with another wrapper , will be its `function_result`
+    - final (optional third item) : what to do once the request is finished,even if it failed
+        - takes one argument : `request` (Request)
+        - only called if `prefix` returned successfully,so resources acquired there can be released
+
+    If any of `prefix`,`suffix` or the wrapped function is a coroutine function (`async def`),the
+    wrapped request becomes a coroutine function as well,which awaits every awaitable result.
+    `AsyncPyWebHost` runs those directly on its event loop
+
+    The wrapped requests keep their `Stage` and the function they wrap,so the stack of wrappers of a
+    route can be flattened by `compile_pipeline` once it's registered.
+    Once a wrapper with a `suffix` wraps another one,the inner `suffix` gets its `chained` attribute set,
+    so it can tell whether its result is used by an outer wrapper
     '''
     def UserWrapper(*a,**k):
-        prefix,suffix = provider(*a,**k)
+        prefix,suffix,final = (tuple(provider(*a,**k)) + (None,))[:3]
         def RequestFunctionWrapper(function):
+            inner = getattr(function,'stage',None)
+            if suffix and inner is not None and inner.suffix is not None:
+                try:
+                    inner.suffix.chained = True
+                except AttributeError:
+                    pass # e.g. builtins
+            if any(asyncio.iscoroutinefunction(f) for f in (prefix,suffix,final,function) if f):
+                async def AsyncRequestWrapper(initator : object,request : Request,previous_prefix_result=None):
+                    prefix_result   = await awaitable(prefix  (request,previous_prefix_result)) if prefix else previous_prefix_result
+                    try:
+                        function_result = await awaitable(function(initator,request,prefix_result))
+                        suffix_result   = await awaitable(suffix  (request,function_result)) if suffix else function_result
+                    finally:
+                        if final:await awaitable(final(request))
+                    return suffix_result
+                AsyncRequestWrapper.stage,AsyncRequestWrapper.wrapped = Stage(provider.__name__,prefix,suffix,final),function
+                return AsyncRequestWrapper
             def RequestWrapper(initator : object,request : Request,previous_prefix_result=None):                
                 prefix_result   = prefix  (request,previous_prefix_result) if prefix else previous_prefix_result
-                function_result = function(initator,request,prefix_result)
-                suffix_result   = suffix  (request,function_result) if suffix else function_result
+                try:
+                    function_result = function(initator,request,prefix_result)
+                    suffix_result   = suffix  (request,function_result) if suffix else function_result
+                finally:
+                    if final:final(request)
                 return suffix_result
+            RequestWrapper.stage,RequestWrapper.wrapped = Stage(provider.__name__,prefix,suffix,final),function
             return RequestWrapper
         return RequestFunctionWrapper
     return UserWrapper
 
+class Stage(NamedTuple):
+    '''A layer of wrappers made by `ModuleWrapper`'''
+    name : str
+    '''Name of the wrapper,e.g. `JSONMessageWrapper`'''
+    prefix : Any
+    suffix : Any
+    final : Any
+
+class StageTiming(object):
+    '''Time spent in a stage of a pipeline,see `compile_pipeline`'''
+    __slots__ = ('calls','seconds','lock')
+    def __init__(self) -> None:
+        self.calls,self.seconds,self.lock = 0,0.0,threading.Lock()
+
+    def add(self,seconds : float):
+        with self.lock:
+            self.calls += 1
+            self.seconds += seconds
+
+    def __repr__(self) -> str:
+        return '<StageTiming %d calls,%.6fs>' % (self.calls,self.seconds)
+
+def _timed(function,timing : StageTiming,is_async : bool):
+    '''Wraps a stage so the time spent in it is added to `timing`'''
+    if function is None:return None
+    if is_async:
+        async def timed(*args):
+            start = time.perf_counter()
+            try:
+                return await awaitable(function(*args))
+            finally:
+                timing.add(time.perf_counter() - start)
+        return timed
+    def timed(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            timing.add(time.perf_counter() - start)
+    return timed
+
+def _run_finals(request : Request,finals : tuple,entered : int):
+    '''Calls the `final` of the first `entered` stages,innermost first,like nested `try...finally` would'''
+    error = None
+    while entered:
+        entered -= 1
+        if finals[entered]:
+            try:
+                finals[entered](request)
+            except BaseException as e:
+                error = e
+    if error is not None:raise error
+
+async def _run_finals_async(request : Request,finals : tuple,entered : int):
+    error = None
+    while entered:
+        entered -= 1
+        if finals[entered]:
+            try:
+                await awaitable(finals[entered](request))
+            except BaseException as e:
+                error = e
+    if error is not None:raise error
+
+def compile_pipeline(function,timing : bool = False):
+    '''Flattens a stack of wrappers made by `ModuleWrapper` into one function
+
+    Calling the wrappers nests a Python frame per layer.The pipeline runs every `prefix`,the handler,
+    then every `suffix` (and `final`) in one loop instead,with the same semantics:
+
+    - A `prefix` gets the result of the previous one,the handler gets the last one
+    - The `suffix` of a layer gets the result of the layer it wraps,innermost first
+    - The `final` of a layer runs right after its `suffix`,or if anything within it failed,
+      as long as its `prefix` succeeded
+
+    Args:
+        function: A request handler,wrapped or not
+        timing (bool, optional): Count the calls of every stage and the time spent in them,
+                                 kept in `timings` of the pipeline. Defaults to False.
+
+    Returns:
+        The pipeline,with `stages` and `timings` attributes.`function` itself if there's nothing to flatten or time
+    '''
+    stages,handler = [],function
+    while getattr(handler,'stage',None) is not None and hasattr(handler,'wrapped'):
+        stages.append(handler.stage)
+        handler = handler.wrapped
+    if not stages and not timing:return function
+    is_async = asyncio.iscoroutinefunction(function) or asyncio.iscoroutinefunction(handler)
+    prefixes,suffixes,finals = [s.prefix for s in stages],[s.suffix for s in stages],[s.final for s in stages]
+    timings = dict()
+    if timing:
+        names,seen = list(),dict()
+        for stage in stages:
+            seen[stage.name] = seen.get(stage.name,0) + 1
+            names.append(stage.name if seen[stage.name] == 1 else '%s#%d' % (stage.name,seen[stage.name]))
+        # Keys are in the order the stages run
+        for index,name in enumerate(names):
+            if prefixes[index]:prefixes[index] = _timed(prefixes[index],timings.setdefault('%s.prefix' % name,StageTiming()),is_async)
+        handler = _timed(handler,timings.setdefault('handler',StageTiming()),is_async)
+        for index,name in reversed(list(enumerate(names))):
+            if suffixes[index]:suffixes[index] = _timed(suffixes[index],timings.setdefault('%s.suffix' % name,StageTiming()),is_async)
+            if finals[index]:finals[index] = _timed(finals[index],timings.setdefault('%s.final' % name,StageTiming()),is_async)
+    prefixes,suffixes,finals = tuple(prefixes),tuple(suffixes),tuple(finals)
+    if is_async:
+        async def AsyncPipeline(initator : object,request : Request,previous_prefix_result=None):
+            result,entered = previous_prefix_result,0
+            try:
+                for prefix in prefixes:
+                    if prefix:result = await awaitable(prefix(request,result))
+                    entered += 1
+                result = await awaitable(handler(initator,request,result))
+                while entered:
+                    suffix = suffixes[entered - 1]
+                    if suffix:result = await awaitable(suffix(request,result))
+                    entered -= 1
+                    if finals[entered]:await awaitable(finals[entered](request))
+                return result
+            finally:
+                if entered:await _run_finals_async(request,finals,entered)
+        pipeline = AsyncPipeline
+    elif not any(finals):
+        # Nothing to clean up,so there's no need to track how far the request went
+        prefixes,suffixes = tuple(filter(None,prefixes)),tuple(filter(None,reversed(suffixes)))
+        def Pipeline(initator : object,request : Request,previous_prefix_result=None):
+            result = previous_prefix_result
+            for prefix in prefixes:result = prefix(request,result)
+            result = handler(initator,request,result)
+            for suffix in suffixes:result = suffix(request,result)
+            return result
+        pipeline = Pipeline
+    else:
+        def Pipeline(initator : object,request : Request,previous_prefix_result=None):
+            result,entered = previous_prefix_result,0
+            try:
+                for prefix in prefixes:
+                    if prefix:result = prefix(request,result)
+                    entered += 1
+                result = handler(initator,request,result)
+                while entered:
+                    suffix = suffixes[entered - 1]
+                    if suffix:result = suffix(request,result)
+                    entered -= 1
+                    if finals[entered]:finals[entered](request)
+                return result
+            finally:
+                if entered:_run_finals(request,finals,entered)
+        pipeline = Pipeline
+    pipeline.stages,pipeline.timings = tuple(stages),timings
+    return pipeline
+
+async def awaitable(result):
+    '''Awaits `result` if it's awaitable,returns it as-is otherwise'''
+    if inspect.isawaitable(result):return await result
+    return result
+
 def any2bytes(any):
     if isinstance(any,str):return any.encode()
+    if isinstance(any,(bytes,bytearray,memoryview)):return any
     return bytearray(any)
 
 def any2str(any):
@@ -71,6 +256,21 @@ def any2str(any):
 def filesize(path):
     return os.path.getsize(path)
 
+_mime_types = dict()
+
+def guess_mime_type(path : str,default : str = 'application/octet-stream') -> str:
+    '''MIME type of a file by its extension,memoized per extension
+
+    Returns:
+        str : The MIME type,or `default` if it's unknown
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    mime_type = _mime_types.get(extension)
+    if mime_type is None:
+        mime_type = mimetypes.guess_type('file' + extension)[0] or ''
+        if len(_mime_types) < 1024:_mime_types[extension] = mime_type
+    return mime_type or default
+
 def streamcopy(from_:IOBase,to_:IOBase,size=-1,chunk_size=163840):
     '''Copies content from one buffer to the other,chunk by chunk
 
@@ -115,33 +315,64 @@ def readstream(request:Request):
         request (Request): Request
 
     Raises:
-        BadRequestException: When `Content-Length` is not defined
+        BadRequestException: When the chunked body is malformed
 
     Returns:
-        bytes : Read content
+        bytes : Read content,empty if the request has no body
     '''
-    buffer = BytesIO()
-    length = request.headers.get('Content-Length')
-    if not length:return b'' # this header musn't be empty : https://tools.ietf.org/html/rfc2616#page-33
-    streamcopy(request.rfile,buffer,length)
-    buffer.seek(0)
-    return buffer.read()
+    return request.body.read()
+
+def spoolstream(request:Request,spool_size : int = None,directory : str = None):
+    '''Reads all the content from client into a file object
+
+    Bodies up to `spool_size` are kept in memory,larger ones are spooled to a temporary file,
+    which is deleted once it's closed (or garbage collected)
+
+    Args:
+        request (Request): Request
+        spool_size (int, optional): Max size of the bodies kept in memory. Defaults to the server's `spool_size`.
+        directory (str, optional): Where the temporary file is created. Defaults to the server's `spool_directory`.
+
+    Raises:
+        BadRequestException: HTTP 413,when the body is larger than `request.max_body_size`
+
+    Returns:
+        SpooledTemporaryFile : The content,positioned at its start
+    '''
+    if spool_size is None:spool_size = getattr(request.server,'spool_size',1 << 20)
+    if directory is None:directory = getattr(request.server,'spool_directory',None)
+    body = request.body
+    spool = SpooledTemporaryFile(max_size=spool_size,dir=directory)
+    if body.length is not None and body.length > spool_size:spool.rollover() # Straight to disk
+    _copy_body(body,spool,1 << 20 if body.length is None or body.length > spool_size else max(body.length,1))
+    spool.seek(0)
+    return spool
 
 def writestream(request:Request,data):
     '''Writes content to client
 
+    Bodies that aren't in memory are streamed,see `Request.send_body`.
+    Both are compressed if the request has `compression` set (see `CompressionWrapper`)
+
     Args:
         request (Request): Request
-        data (Any): bytes / str like objects
+        data (Any): bytes / str like objects,iterators / generators of them,or file-like objects.
+                    Anything else (e.g. a list of ints) is converted with `any2bytes`
 
     Returns:
         int : Bytes written
     '''
+    if hasattr(data,'read') or (hasattr(data,'__next__') and not isinstance(data,(str,bytes,bytearray,memoryview))):
+        return request.send_body(data)
     buffer  = any2bytes(data)
+    if request.compression is not None:buffer = request.compression.apply(request,buffer)
     request.send_header('Content-Length',str(len(buffer)))
-    request.end_headers()    
-    sent    = streamcopy(BytesIO(buffer),request.wfile)
-    return sent
+    if request.command == 'HEAD':
+        request.end_headers()
+    else:
+        request.end_headers(buffer)
+        # Sent along with the headers
+    return len(buffer)
 
 def Redirect(request:Request,redirect_to:str,code:int = HTTPStatus.FOUND) -> None:
     '''Redirects request to another URL
@@ -157,6 +388,8 @@ def Redirect(request:Request,redirect_to:str,code:int = HTTPStatus.FOUND) -> Non
 def ReadContentToBuffer(request:Request,stream_to:IOBase,chunk_size : int=163840):
     '''Reads content of request to buffer
 
+    Every chunk written is a `bytes` object of its own,so `stream_to` may keep it
+
     Args:
         request (Request): Request
         stream_to (IOBase): Where to write to
@@ -165,9 +398,80 @@ def ReadContentToBuffer(request:Request,stream_to:IOBase,chunk_size : int=163840
     Returns:
         int : Read bytes
     '''
-    length = request.headers.get('Content-Length')
-    assert length # this header musn't be empty : https://tools.ietf.org/html/rfc2616#page-33
-    return streamcopy(request.rfile,stream_to,length,chunk_size)
+    body,read = request.body,0
+    while True:
+        chunk = body.read1(chunk_size)
+        if not chunk:return read
+        stream_to.write(chunk)
+        read += len(chunk)
+
+def _copy_body(body,stream_to,chunk_size : int) -> int:
+    '''Copies a `RequestBody` with `readinto` calls,into one buffer of `chunk_size` reused for the whole body
+
+    The chunks written are views of that buffer,overwritten by the next read,so `stream_to` must copy them (files do)
+    '''
+    buffer,read = memoryview(bytearray(chunk_size)),0
+    while True:
+        size = body.readinto(buffer)
+        if not size:return read
+        stream_to.write(buffer[:size])
+        read += size
+
+MAX_RANGES = 16
+'''Requests with more ranges than this are answered with the whole content'''
+
+def parse_ranges(value : str,length : int,max_ranges : int = MAX_RANGES) -> list:
+    '''Parses a `Range` header,see https://tools.ietf.org/html/rfc7233#section-2.1
+
+    Single (`0-499`),open-ended (`500-`) and suffix (`-500`) ranges are supported.Overlapping and
+    adjacent ranges are coalesced,so the result is ordered
+
+    Args:
+        value (str): Value of the header
+        length (int): Length of the content
+        max_ranges (int, optional): Max count of ranges. Defaults to MAX_RANGES.
+
+    Returns:
+        list : `(start,end)` tuples (`end` exclusive),empty if none of them is satisfiable,
+               or `None` if the header should be ignored (not `bytes`,malformed,or too many ranges)
+    '''
+    unit,_,specs = value.partition('=')
+    if unit.strip().lower() != 'bytes':return None
+    specs = specs.split(',')
+    if len(specs) > max_ranges:return None
+    ranges = []
+    for spec in specs:
+        first,dash,last = spec.strip().partition('-')
+        if not dash or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+            return None
+        if not first:
+            # Suffix range,the last `last` bytes
+            if int(last) and length:ranges.append((max(length - int(last),0),length))
+            continue
+        start,end = int(first),min(int(last) + 1,length) if last else length
+        if last and int(last) < start:return None # e.g. `500-499`
+        if start < length:ranges.append((start,end))
+    ranges.sort()
+    coalesced = ranges[:1]
+    for start,end in ranges[1:]:
+        if start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0],max(end,coalesced[-1][1]))
+        else:
+            coalesced.append((start,end))
+    return coalesced
+
+def if_range_matches(request : Request) -> bool:
+    '''Whether `Range` should be honored according to `If-Range`,see https://tools.ietf.org/html/rfc7233#section-3.2
+
+    The request's validator is compared with the `ETag` / `Last-Modified` response headers set already
+    '''
+    if_range = request.headers.get('If-Range')
+    if not if_range:return True
+    if_range = if_range.strip()
+    if if_range[:1] == '"':
+        # Strong comparison of entity tags
+        return if_range == request.headers_buffer.get('ETag')
+    return if_range == request.headers_buffer.get('Last-Modified')
 
 def WriteContentToRequest(
     request : Request,
@@ -175,16 +479,24 @@ def WriteContentToRequest(
     partial_acknowledge : bool=False,
     length : int=-1,
     chunk_size : int=163840,
-    mime_type : str='text/plain') -> None:
+    mime_type : str='text/plain',
+    offset : int=None,
+    max_ranges : int=MAX_RANGES) -> None:
     '''Writes buffer / file as static content to stream
 
+    Regular files are sent with `Request.send_file`,without copying them through Python where possible.
+    With `partial_acknowledge`,`Range` requests are answered with the range,or a `multipart/byteranges`
+    body if several were requested.`If-Range` is checked against the `ETag` / `Last-Modified` headers,if they're set
+
     Args:
         request (Request): Request
         object (Union[str,bytes,bytearray]): Content to be sent
-        partial_acknowledge (bool, optional): React to HTTP 206s or not. Defaults to False.
+        partial_acknowledge (bool, optional): React to `Range` requests (with HTTP 206s) or not. Defaults to False.
         length (int, optional): The length to be sent. Defaults to -1.
         chunk_size (int, optional): Size of chunk. Defaults to 163840.
         mime_type (str, optional): Content mime type. Defaults to 'text/plain'.
+        offset (int, optional): Where the content starts,if `object` is a stream. Defaults to its current position.
+        max_ranges (int, optional): Max count of ranges of a request,see `parse_ranges`. Defaults to MAX_RANGES.
 
     Returns:
         int : Bytes sent
@@ -193,48 +505,82 @@ def WriteContentToRequest(
     if isinstance(object,str):
         # str - file path
         length = filesize(object) if length < 0 else length
-        stream = open(object,'rb')
+        stream,base = open(object,'rb'),0
     elif isinstance(object,(bytes,bytearray)):
         length = len(object)
-        stream = BytesIO(object)
+        stream,base = BytesIO(object),0
     elif hasattr(object,'read'):
         # readable - IO-like objects
-        stream = object
-        
+        stream,base = object,offset
+    if base is None and is_regular_file(stream):base = stream.tell()
+
     def send_once(request):                        
         request.send_response(HTTPStatus.OK)   
-        if length > 0:request.send_header('Content-Length',length)
         request.send_header('Content-Type',mime_type)
-        request.end_headers()     
-        streamcopy(stream,request.wfile,chunk_size=chunk_size)
-        return True
+        if length < 0:
+            # Unknown length,stream it
+            request.send_body(stream,chunk_size=chunk_size)
+            return 'full'
+        request.send_header('Content-Length',length)
+        if base is not None:
+            request.send_file(stream,base,length,chunk_size)
+        elif request.command == 'HEAD':
+            request.end_headers()
+        else:
+            # From where the stream is
+            request.end_headers()
+            request.bytes_sent += streamcopy(stream,request.wfile,length,chunk_size=chunk_size)
+        return 'full'
+
+    def send_multipart(request,ranges):
+        boundary = os.urandom(16).hex()
+        heads = [(
+            '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (boundary,mime_type,start,end - 1,length)
+        ).encode() for start,end in ranges]
+        tail = ('\r\n--%s--\r\n' % boundary).encode()
+        request.send_response(HTTPStatus.PARTIAL_CONTENT)
+        request.send_header('Content-Length',str(sum(map(len,heads)) + sum(end - start for start,end in ranges) + len(tail)))
+        request.send_header('Content-Type','multipart/byteranges; boundary=%s' % boundary)
+        if request.command == 'HEAD':return request.end_headers() or 'multirange'
+        for index,(head,(start,end)) in enumerate(zip(heads,ranges)):
+            # Every part head is written along with the part
+            request.write_file(stream,(base or 0) + start,end - start,head,end_headers=not index,chunk_size=chunk_size)
+        request.write_buffers(tail)
+        return 'multirange'
 
     def send_range(request):
         Range = request.headers.get('Range')
         if not Range:return False # no range header
-        if not Range[:6] == 'bytes=' : return request.send_error(HTTPStatus.BAD_REQUEST,'Only ranges of `bytes` are supported')
-        start,end = Range[6:].split('-')
-        start,end = int(start if start else 0),int(end if end else length)
-        if not (start >= 0 and start < length and end > 0 and end > start and end <= length):
+        if request.command not in ('GET','HEAD') or not if_range_matches(request):return False
+        ranges = parse_ranges(Range,length,max_ranges)
+        if ranges is None:return False # ignored
+        if not ranges:
             # Range not satisfiable
-            return request.send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
-
+            request.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            request.send_header('Content-Range','bytes */%d' % length)
+            request.end_headers()
+            return 'unsatisfiable'
+        if len(ranges) > 1:return send_multipart(request,ranges)
+        start,end = ranges[0]
         request.send_response(HTTPStatus.PARTIAL_CONTENT)
         request.send_header('Content-Length',str(end - start))
         request.send_header('Content-Type',mime_type)
         request.send_header('Content-Range','bytes %s-%s/%s' % (start,end - 1,length))
-        request.end_headers()          
-
-        stream.seek(start)
-        streamcopy(stream,request.wfile,end - start,chunk_size=chunk_size)
-        return True
+        request.send_file(stream,(base or 0) + start,end - start,chunk_size)
+        return 'range'
     
-    if partial_acknowledge:
-        if length > 0:
-            request.send_header('Accept-Ranges','bytes')
-            if send_range(request):                
-                return True
-    return send_once(request)
+    metrics,sent = getattr(request.server,'metrics',None),request.bytes_sent
+    try:
+        kind = None
+        if partial_acknowledge:
+            if length > 0:
+                request.send_header('Accept-Ranges','bytes')
+                kind = send_range(request)
+        if not kind:kind = send_once(request)
+        if metrics is not None:metrics.content_sent(kind,request.bytes_sent - sent)
+        return True
+    finally:
+        if isinstance(object,str):stream.close()
 
 @ModuleWrapper
 def VerbRestrictionWrapper(verbs : list = ['GET','POST']) -> None:
@@ -260,7 +606,7 @@ def VerbRestrictionWrapper(verbs : list = ['GET','POST']) -> None:
     return prefix , None
 
 @ModuleWrapper
-def BinaryMessageWrapper(read=True,write=True):
+def BinaryMessageWrapper(read=True,write=True,spool=False):
     '''Wrapper to receive,send binary content before,after the request
     
     Usage:
@@ -273,23 +619,27 @@ def BinaryMessageWrapper(read=True,write=True):
     Args:
         read (bool, optional): Read the content. Defaults to True.
         write (bool, optional): Write the content. Defaults to True.
+        spool (bool, optional): Pass the content as a file object instead of `bytes`,see `spoolstream`. Defaults to False.
     '''
     def prefix(request,previous_prefix_result):
         if not read:return previous_prefix_result
-        binary = readstream(request) if previous_prefix_result is None else previous_prefix_result    
-        return binary
+        if previous_prefix_result is not None:return previous_prefix_result
+        return spoolstream(request) if spool else readstream(request)
     def suffix(request,function_result):        
-        binary = any2bytes(function_result)
         if write:
-            writestream(request,binary)
+            writestream(request,function_result)
         return function_result
-        return bytearray()
     return prefix , suffix
 
 @ModuleWrapper
-def JSONMessageWrapper(decode=True,encode=True,read=True,write=True):
+def JSONMessageWrapper(decode=True,encode=True,read=True,write=True,codec=None):
     '''Wrapper to receive,send JSON content before,after the request
 
+    Request bodies are decoded with the codec registered for their `Content-Type` (see `serializers`),with JSON otherwise.
+    Streaming codecs (e.g. NDJSON) pass a generator of the decoded items,which reads the body as it's iterated.
+    Responses are streamed as they're encoded,with `Transfer-Encoding: chunked` if they're large (see `Request.send_body`).
+    The encoded text is returned for the wrappers outside of this one,it's only kept in memory if there are any
+
     Usage:
     
         @server.route('.*')        
@@ -304,18 +654,35 @@ def JSONMessageWrapper(decode=True,encode=True,read=True,write=True):
         encode (bool, optional): To encode the response. Defaults to True.
         read (bool, optional): Read the content. Defaults to True.
         write (bool, optional): Write the content. Defaults to True.
+        codec (optional): Codec / MIME type of the responses,or a tuple of them to choose from with `Accept`.
+                          Requests and responses are only negotiated with a tuple,a single codec is always used.
+                          Defaults to None,which is JSON.
     '''
+    candidates = tuple(codec) if isinstance(codec,(tuple,list)) else None
+    fixed = None if candidates else get_codec(codec if codec is not None else 'application/json')
     def prefix(request,previous_prefix_result):
         if not read:return previous_prefix_result
-        string = any2str(readstream(request)) if previous_prefix_result is None else previous_prefix_result
-        return string if not decode else json.loads(string)
+        if not decode:return any2str(readstream(request)) if previous_prefix_result is None else previous_prefix_result
+        decoder = fixed or request_codec(request,candidates)
+        if previous_prefix_result is not None:return decoder.loads(previous_prefix_result)
+        if decoder.streaming:return decoder.iterdecode(request.body)
+        return decoder.loads(readstream(request))
     def suffix(request,function_result):
-        string = function_result
-        if encode:
-            string = json.dumps(function_result)
-        if write:
-            writestream(request,string)
-        return string
+        if not encode:
+            if write:writestream(request,function_result)
+            return function_result
+        encoder = fixed or negotiate_codec(request,candidates)
+        if not write:return encoder.dumps(function_result)
+        if not fixed:request.headers_buffer.add('Vary','Accept')
+        if not 'content-type' in request.headers_buffer:request.send_header('Content-Type',encoder.mime_type)
+        blocks = encoder.iterencode(function_result)
+        if not suffix.chained:
+            writestream(request,blocks)
+            return function_result
+        text = []
+        writestream(request,(text.append(block) or block for block in blocks))
+        return ''.join(text)
+    suffix.chained = False
     return prefix , suffix
 
 @ModuleWrapper
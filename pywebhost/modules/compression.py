@@ -0,0 +1,174 @@
+'''Response compression,negotiated with `Accept-Encoding`
+
+    @server.route('/api/.*')
+    @CompressionWrapper(min_size=1024)
+    @JSONMessageWrapper(read=False)
+    def api(initator,request,content):
+        return query_database()
+
+With the wrapper,bodies written by `writestream` (which the message wrappers use) are compressed at once,
+and so are bodies of `Request.send_body` that end within its buffer.Larger ones are compressed block by block
+as they're streamed.
+Static files are compressed by `StaticFileCache`,see its `compression` option.
+'''
+import zlib
+from ..handler import Request
+from . import ModuleWrapper
+
+ENCODINGS = ('gzip','deflate')
+'''Supported content codings,in order of preference'''
+_WBITS = {'gzip' : 31,'deflate' : 15}
+'''`zlib` window bits of every content coding (`deflate` is the zlib format,see https://tools.ietf.org/html/rfc7230#section-4.2.2)'''
+
+COMPRESSIBLE_TYPES = (
+    'text/','application/json','application/javascript','application/x-javascript','application/xml',
+    'application/xhtml+xml','application/rss+xml','application/atom+xml','application/ld+json',
+    'application/manifest+json','application/x-ndjson','application/wasm','image/svg+xml','image/x-icon',
+    'font/ttf','font/otf','application/vnd.ms-fontobject'
+)
+'''MIME types worth compressing,entries ending with `/` match every subtype'''
+
+_accepted = dict()
+
+def accepted_encodings(accept_encoding : str) -> dict:
+    '''Parses an `Accept-Encoding` header,results are cached
+
+    Returns:
+        dict : Content codings (lowercased) -> their quality values
+    '''
+    qualities = _accepted.get(accept_encoding)
+    if qualities is None:
+        qualities = dict()
+        for item in accept_encoding.split(','):
+            coding,_,params = item.partition(';')
+            coding,quality = coding.strip().lower(),1.0
+            for param in params.split(';'):
+                key,_,value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if coding:qualities[coding] = quality
+        if len(_accepted) >= 256:_accepted.clear()
+        _accepted[accept_encoding] = qualities
+    return qualities
+
+def negotiate_encoding(request : Request,encodings : tuple = ENCODINGS) -> str:
+    '''Picks the content coding of the response among `encodings`
+
+    Returns:
+        str : The content coding,or `None` if the response should not be compressed
+    '''
+    accept_encoding = request.headers.get('Accept-Encoding')
+    if not accept_encoding:return None
+    qualities = accepted_encodings(accept_encoding)
+    best,best_quality = None,0
+    for coding in encodings:
+        quality = qualities.get(coding,qualities.get('*',0))
+        if quality > best_quality:best,best_quality = coding,quality
+    return best
+
+def compress(data,encoding : str,level : int = 6) -> bytes:
+    '''Compresses `data` at once with the content coding `encoding`'''
+    compressor = zlib.compressobj(level,zlib.DEFLATED,_WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+def compress_chunks(chunks,encoding : str,level : int = 6,block_size : int = 16384):
+    '''Compresses an iterable of chunks as it's iterated,yielding blocks of at least `block_size`
+
+    A block is yielded (and flushed with `Z_SYNC_FLUSH`,so what's streamed so far can be decompressed by the client
+    right away) once `block_size` bytes of compressed data are pending,which is when `StreamWriter` would send it.
+    Flushing every chunk instead would hurt the ratio of bodies made of small chunks
+    '''
+    compressor = zlib.compressobj(level,zlib.DEFLATED,_WBITS[encoding])
+    block = bytearray()
+    try:
+        for chunk in chunks:
+            if isinstance(chunk,str):chunk = chunk.encode()
+            if not chunk:continue
+            block += compressor.compress(chunk)
+            if len(block) >= block_size:
+                block += compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield bytes(block)
+                block = bytearray()
+        block += compressor.flush()
+        yield bytes(block)
+    finally:
+        close = getattr(chunks,'close',None)
+        if close:close()
+
+class Compression(object):
+    '''Decides which responses are compressed,and how'''
+    def __init__(self,min_size : int = 1024,mime_types : tuple = COMPRESSIBLE_TYPES,level : int = 6,encodings : tuple = ENCODINGS) -> None:
+        '''
+        Args:
+            min_size (int, optional): Bodies smaller than this are sent as-is. Defaults to 1024.
+            mime_types (tuple, optional): MIME types to compress,see `COMPRESSIBLE_TYPES`. Defaults to COMPRESSIBLE_TYPES.
+            level (int, optional): `zlib` compression level. Defaults to 6.
+            encodings (tuple, optional): Content codings to use,in order of preference. Defaults to ENCODINGS.
+        '''
+        self.min_size,self.level,self.encodings = min_size,level,encodings
+        self.mime_types = tuple(mime_types)
+
+    def is_compressible(self,mime_type : str) -> bool:
+        '''Whether `mime_type` is in the allow-list,responses without one are compressed as well'''
+        if not mime_type:return True
+        return mime_type.split(';',1)[0].strip().lower().startswith(self.mime_types)
+
+    def select(self,request : Request) -> str:
+        '''Picks the content coding of the response being sent,and sets `Vary` if it's compressible
+
+        Returns:
+            str : The content coding,or `None` if the response should be sent as-is
+        '''
+        headers = request.headers_buffer
+        if 'content-encoding' in headers or not self.is_compressible(headers.get('Content-Type')):return None
+        headers.add('Vary','Accept-Encoding')
+        return negotiate_encoding(request,self.encodings)
+
+    def apply(self,request : Request,buffer) -> bytes:
+        '''Compresses a whole body,setting `Content-Encoding` if it is'''
+        if len(buffer) < self.min_size:return buffer
+        encoding = self.select(request)
+        if not encoding:return buffer
+        request.send_header('Content-Encoding',encoding)
+        return compress(buffer,encoding,self.level)
+
+    def stream(self,request : Request,chunks,block_size : int = 16384):
+        '''Wraps the iterable of chunks of a streamed body,so it's compressed as it's sent
+
+        `Request.send_body` only streams bodies larger than its buffer,smaller ones are compressed with `apply`,
+        so that `min_size` holds
+
+        Returns:
+            The compressed blocks (see `compress_chunks`),or `chunks` itself if the response is sent as-is
+        '''
+        encoding = self.select(request)
+        if not encoding:return chunks
+        request.send_header('Content-Encoding',encoding)
+        return compress_chunks(chunks,encoding,self.level,block_size)
+
+@ModuleWrapper
+def CompressionWrapper(min_size : int = 1024,mime_types : tuple = COMPRESSIBLE_TYPES,level : int = 6,encodings : tuple = ENCODINGS):
+    '''Wrapper to compress the responses of a route,if the client accepts it
+
+    Usage:
+
+        @server.route('/api/.*')
+        @CompressionWrapper(min_size=1024)
+        @JSONMessageWrapper(read=False)
+        def api(initator,request,content):
+            ...
+
+    Args:
+        min_size (int, optional): Bodies smaller than this are sent as-is. Defaults to 1024.
+        mime_types (tuple, optional): MIME types to compress. Defaults to COMPRESSIBLE_TYPES.
+        level (int, optional): `zlib` compression level. Defaults to 6.
+        encodings (tuple, optional): Content codings to use,in order of preference. Defaults to ENCODINGS.
+    '''
+    compression = Compression(min_size,mime_types,level,encodings)
+    def prefix(request,previous_prefix_result):
+        request.compression = compression
+        return previous_prefix_result
+    return prefix , None
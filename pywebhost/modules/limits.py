@@ -0,0 +1,252 @@
+'''Per-route concurrency limits,rate limits and request body size limits
+
+    @server.route('/download/.*')
+    @ConcurrencyLimitWrapper(8,queue_size=16,name='download')
+    def download(initator,request,content):
+        return WriteContentToRequest(request,'large.bin')
+
+    @server.route('/api/.*')
+    @RateLimitWrapper(10,burst=20,key='client')
+    @JSONMessageWrapper(read=False)
+    def api(initator,request,content):
+        return query_database()
+
+    @server.route('/upload')
+    @BodySizeLimitWrapper(1 << 30)
+    @BinaryMessageWrapper(spool=True)
+    def upload(initator,request,content):
+        shutil.copyfileobj(content,open('upload.bin','wb'))
+
+Limited requests are answered through `BadRequestException`,with 503 (concurrency),429 (rate) or 413 (body size).
+`usage()` reports the current state of every limit by its name,to help tuning them.
+'''
+import itertools,threading,time
+from http import HTTPStatus
+from typing import Callable, Union
+from ..handler import Request
+from . import ModuleWrapper,BadRequestException
+
+_limits = dict()
+_counter = itertools.count(1)
+
+def usage() -> dict:
+    '''Current usage of every limit
+
+    Returns:
+        dict : Names of the limits -> their `usage()`
+    '''
+    return {name : limit.usage() for name,limit in list(_limits.items())}
+
+class ConcurrencyLimit(object):
+    '''Caps the count of requests being handled at once
+
+    Requests over the cap wait in a queue of `queue_size` for up to `timeout` seconds,
+    those that don't fit or time out are rejected
+
+    NOTE: Waiting blocks the calling thread,keep `queue_size` at 0 for `async def` handlers
+    '''
+    def __init__(self,limit : int,queue_size : int = 0,timeout : float = 1,name : str = None):
+        '''
+        Args:
+            limit (int): Max count of requests being handled
+            queue_size (int, optional): Max count of requests waiting for a slot. Defaults to 0.
+            timeout (float, optional): Seconds a request may wait for a slot. Defaults to 1.
+            name (str, optional): Name in `usage()`. Defaults to `concurrency-<n>`.
+        '''
+        self.limit,self.queue_size,self.timeout = limit,queue_size,timeout
+        self.name = name or 'concurrency-%d' % next(_counter)
+        self.inflight = self.waiting = self.admitted = self.rejected = 0
+        self._available = threading.Condition()
+        _limits[self.name] = self
+
+    def acquire(self) -> bool:
+        '''Takes a slot,waiting in the queue if needed
+
+        Returns:
+            bool : `False` if the request is rejected,`release` must not be called then
+        '''
+        with self._available:
+            if self.inflight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                try:
+                    acquired = self._available.wait_for(lambda:self.inflight < self.limit,self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not acquired:
+                    self.rejected += 1
+                    return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._available:
+            self.inflight -= 1
+            self._available.notify()
+
+    def usage(self) -> dict:
+        return {
+            'limit' : self.limit,
+            'inflight' : self.inflight,
+            'waiting' : self.waiting,
+            'admitted' : self.admitted,
+            'rejected' : self.rejected
+        }
+
+class RateLimit(object):
+    '''Token bucket rate limit
+
+    Every key gets a bucket of `burst` tokens,refilled by `rate` tokens per second.A request takes a token,
+    or is limited if the bucket is empty.`key` picks the bucket of a request,and is one of
+
+    - `'route'`  : The matched route pattern
+    - `'client'` : The client's address
+    - `'global'` : One bucket for every request
+    - A callable,which takes the `Request` and returns a hashable key
+    '''
+    KEYS = {
+        'route' : lambda request:request.route,
+        'client' : lambda request:request.client_address[0],
+        'global' : lambda request:None
+    }
+
+    def __init__(self,rate : float,burst : int = None,key : Union[str,Callable] = 'route',name : str = None,max_keys : int = 65536):
+        '''
+        Args:
+            rate (float): Tokens refilled per second
+            burst (int, optional): Size of the buckets. Defaults to `max(rate,1)`.
+            key (Union[str,Callable], optional): How requests are keyed,see above. Defaults to 'route'.
+            name (str, optional): Name in `usage()`. Defaults to `rate-<n>`.
+            max_keys (int, optional): Full buckets are forgotten once there are more buckets than this. Defaults to 65536.
+        '''
+        self.rate,self.burst = rate,burst or max(rate,1)
+        self.key = RateLimit.KEYS[key] if isinstance(key,str) else key
+        self.name = name or 'rate-%d' % next(_counter)
+        self.max_keys = max_keys
+        self.buckets = dict()
+        '''key -> [tokens,last refill]'''
+        self.allowed = self.limited = 0
+        self._lock = threading.Lock()
+        _limits[self.name] = self
+
+    def _refill(self,bucket : list,now : float) -> float:
+        bucket[0] = min(self.burst,bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket[0]
+
+    def _prune(self,now : float):
+        for key,bucket in list(self.buckets.items()):
+            if self._refill(bucket,now) >= self.burst:del self.buckets[key]
+
+    def take(self,request : Request) -> float:
+        '''Takes a token from the bucket of `request`
+
+        Returns:
+            float : 0 if a token was taken,otherwise seconds until one is available
+        '''
+        key,now = self.key(request),time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:self._prune(now)
+                bucket = self.buckets[key] = [self.burst,now]
+            if self._refill(bucket,now) >= 1:
+                bucket[0] -= 1
+                self.allowed += 1
+                return 0
+            self.limited += 1
+            return (1 - bucket[0]) / self.rate
+
+    def usage(self) -> dict:
+        return {
+            'rate' : self.rate,
+            'burst' : self.burst,
+            'keys' : len(self.buckets),
+            'allowed' : self.allowed,
+            'limited' : self.limited
+        }
+
+@ModuleWrapper
+def ConcurrencyLimitWrapper(limit : Union[int,ConcurrencyLimit],queue_size : int = 0,timeout : float = 1,name : str = None):
+    '''Wrapper to cap the count of in-flight calls of a route
+
+    Rejected requests are answered with a HTTP 503
+
+    Usage:
+
+        @server.route('/download/.*')
+        @ConcurrencyLimitWrapper(8,queue_size=16)
+        def download(initator,request,content):
+            ...
+
+    Args:
+        limit (Union[int,ConcurrencyLimit]): Max count of in-flight calls,or a `ConcurrencyLimit` shared by several routes
+        queue_size (int, optional): Max count of calls waiting for a slot. Defaults to 0.
+        timeout (float, optional): Seconds a call may wait for a slot. Defaults to 1.
+        name (str, optional): Name in `usage()`. Defaults to None.
+    '''
+    if not isinstance(limit,ConcurrencyLimit):
+        limit = ConcurrencyLimit(limit,queue_size,timeout,name)
+    def prefix(request,previous_prefix_result):
+        if not limit.acquire():
+            raise BadRequestException(HTTPStatus.SERVICE_UNAVAILABLE,'Too many concurrent requests,try again later')
+        return previous_prefix_result
+    def final(request):
+        limit.release()
+    return prefix , None , final
+
+@ModuleWrapper
+def RateLimitWrapper(rate : Union[float,RateLimit],burst : int = None,key : Union[str,Callable] = 'route',name : str = None):
+    '''Wrapper to rate limit a route with token buckets
+
+    Limited requests are answered with a HTTP 429
+
+    Usage:
+
+        @server.route('/api/.*')
+        @RateLimitWrapper(10,burst=20,key='client')
+        def api(initator,request,content):
+            ...
+
+    Args:
+        rate (Union[float,RateLimit]): Requests allowed per second,or a `RateLimit` shared by several routes
+        burst (int, optional): Requests allowed at once. Defaults to `max(rate,1)`.
+        key (Union[str,Callable], optional): How requests are keyed,see `RateLimit`. Defaults to 'route'.
+        name (str, optional): Name in `usage()`. Defaults to None.
+    '''
+    if not isinstance(rate,RateLimit):
+        rate = RateLimit(rate,burst,key,name)
+    def prefix(request,previous_prefix_result):
+        wait = rate.take(request)
+        if wait:
+            raise BadRequestException(HTTPStatus.TOO_MANY_REQUESTS,'Rate limit exceeded,try again in %.1fs' % wait)
+        return previous_prefix_result
+    return prefix , None
+
+@ModuleWrapper
+def BodySizeLimitWrapper(max_size : int):
+    '''Wrapper to set the max request body size of a route,in place of the server's `max_body_size`
+
+    Bodies declared larger are answered with a HTTP 413 before any of it is read,chunked bodies once they exceed it.
+    Must be applied before the wrappers reading the body
+
+    Usage:
+
+        @server.route('/upload')
+        @BodySizeLimitWrapper(1 << 30)
+        @BinaryMessageWrapper(spool=True)
+        def upload(initator,request,content):
+            ...
+
+    Args:
+        max_size (int): Max size of the request body in bytes,`0` means unlimited
+    '''
+    def prefix(request,previous_prefix_result):
+        request.max_body_size = max_size
+        if max_size and request.body_length is not None and request.body_length > max_size:
+            raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Request body exceeds %d bytes' % max_size)
+        return previous_prefix_result
+    return prefix , None
@@ -0,0 +1,292 @@
+'''Streaming `multipart/form-data` parsing
+
+    @server.route('/upload')
+    @MultipartFormWrapper(max_file_size=1 << 30)
+    def upload(initator,request,form):
+        shutil.copyfileobj(form['file'].file,open(form['name'],'wb'))
+
+The body is parsed as it's received,a block at a time: fields are delivered as `str`,files are written
+to temporary files (or to what a `sink` supplies) as they arrive.Memory use only depends on `chunk_size`
+and `max_field_size`,whatever the size of the upload.
+'''
+import re,tempfile
+from http import HTTPStatus,client
+from urllib.parse import unquote
+from ..handler import Request,Headers
+from . import ModuleWrapper,BadRequestException
+
+_OPTION = re.compile(r';\s*([^\s=;]+)\s*(?:=\s*("(?:[^"\\]|\\.)*"|[^;]*))?')
+_ESCAPED = re.compile(r'\\(["\\])')
+
+def parse_header_options(value : str) -> tuple:
+    '''Parses a header value with options,like `Content-Type` or `Content-Disposition`
+
+    Returns:
+        tuple : The value (lowercased),dict of its options (names lowercased)
+    '''
+    if not value:return '',dict()
+    main,_,rest = value.partition(';')
+    options = dict()
+    for key,option in _OPTION.findall(';' + rest):
+        option = option.strip()
+        if option[:1] == '"':option = _ESCAPED.sub(r'\1',option[1:-1])
+        options[key.lower()] = option
+    return main.strip().lower(),options
+
+class MultipartParser(object):
+    '''Splits a `multipart` body into its parts,as it's read from `stream`
+
+    Usage:
+
+        for headers,content in MultipartParser(request.body,boundary):
+            for block in content:
+                ...
+
+    Every part's content must be consumed before the next part is read
+    '''
+    def __init__(self,stream,boundary : bytes,chunk_size : int = 65536,max_header_size : int = 16384) -> None:
+        '''
+        Args:
+            stream : Where the body is read from,with `read1`
+            boundary (bytes): The boundary,from the `Content-Type` of the body
+            chunk_size (int, optional): Size of the reads from `stream`. Defaults to 65536.
+            max_header_size (int, optional): Max size of the headers of a part. Defaults to 16384.
+        '''
+        self.stream,self.chunk_size,self.max_header_size = stream,chunk_size,max_header_size
+        self.delimiter = b'\r\n--' + boundary
+        self.buffer = bytearray(b'\r\n') # The first delimiter usually has no leading line break
+        self.read = 0
+        '''Bytes read from `stream` so far'''
+
+    def _fill(self) -> bool:
+        data = self.stream.read1(self.chunk_size)
+        if not data:return False
+        self.read += len(data)
+        self.buffer += data
+        return True
+
+    def _need(self,size : int):
+        '''Reads until the buffer has at least `size` bytes'''
+        while len(self.buffer) < size:
+            if not self._fill():raise BadRequestException(HTTPStatus.BAD_REQUEST,'Multipart body ended early')
+
+    def _find(self,sub : bytes,limit : int,explain : str) -> int:
+        '''Reads until `sub` is in the buffer,returns where it is'''
+        start = 0
+        while True:
+            index = self.buffer.find(sub,start)
+            if index >= 0:return index
+            if len(self.buffer) > limit:
+                raise BadRequestException(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,explain)
+            start = max(len(self.buffer) - len(sub) + 1,0)
+            if not self._fill():
+                raise BadRequestException(HTTPStatus.BAD_REQUEST,'Multipart body ended early')
+
+    def content(self):
+        '''Yields the content of the current part by blocks,until the next delimiter
+
+        The buffer is searched with `bytearray.find`,only the last `len(delimiter) - 1` bytes are scanned twice
+        '''
+        delimiter = self.delimiter
+        keep = len(delimiter) - 1
+        while True:
+            index = self.buffer.find(delimiter)
+            if index >= 0:
+                if index:yield self.buffer[:index]
+                del self.buffer[:index + len(delimiter)]
+                return
+            if len(self.buffer) > keep:
+                # The tail may be the start of the delimiter
+                yield self.buffer[:len(self.buffer) - keep]
+                del self.buffer[:len(self.buffer) - keep]
+            if not self._fill():
+                raise BadRequestException(HTTPStatus.BAD_REQUEST,'Multipart body ended early')
+
+    def __iter__(self):
+        '''Yields `(headers,content)` of every part,`content` being a generator of blocks'''
+        for _ in self.content():pass # The preamble
+        while True:
+            self._need(2)
+            if self.buffer[:2] == b'--':return # Closing delimiter,the epilogue is left unread
+            index = self._find(b'\r\n',1024,'Multipart boundary line too long')
+            if self.buffer[:index].strip(b' \t'):
+                raise BadRequestException(HTTPStatus.BAD_REQUEST,'Malformed multipart boundary line')
+            del self.buffer[:index + 2]
+            self._need(2)
+            if self.buffer[:2] == b'\r\n':
+                headers,size = Headers(),2 # No headers
+            else:
+                index = self._find(b'\r\n\r\n',self.max_header_size,'Multipart headers too large')
+                try:
+                    headers = Headers.parse_block(bytes(self.buffer[:index]))
+                except client.HTTPException as e:
+                    raise BadRequestException(HTTPStatus.BAD_REQUEST,'Malformed multipart headers (%s)' % e)
+                size = index + 4
+            del self.buffer[:size]
+            content = self.content()
+            yield headers,content
+            for _ in content:pass # Skips what the consumer left
+
+class FormPart(object):
+    '''A part of a `multipart/form-data` body'''
+    def __init__(self,headers : Headers) -> None:
+        self.headers = headers
+        disposition,options = parse_header_options(headers.get('Content-Disposition'))
+        self.name : str = options.get('name','')
+        '''Name of the field'''
+        filename = options.get('filename')
+        if 'filename*' in options:
+            # https://tools.ietf.org/html/rfc5987#section-3.2
+            charset,_,encoded = options['filename*'].partition("'")
+            filename = unquote(encoded.partition("'")[2],charset or 'utf-8','replace')
+        if filename is not None:filename = filename.replace('\\','/').rsplit('/',1)[-1]
+        self.filename : str = filename
+        '''Name of the file as sent by the client (without directories),`None` for fields'''
+        self.content_type,self.options = parse_header_options(headers.get('Content-Type'))
+        self.size = 0
+        '''Size of the content in bytes'''
+        self.value : str = None
+        '''Value of the field,`None` for files'''
+        self.file = None
+        '''Where the content of the file is written to,positioned at its start if it's a temporary file'''
+        self.temporary = False
+        '''Whether `file` is a temporary file,rather than what a `sink` supplied'''
+
+    @property
+    def is_file(self) -> bool:
+        return self.filename is not None
+
+    def __repr__(self) -> str:
+        if self.is_file:return '<FormPart %r file %r (%s,%d bytes)>' % (self.name,self.filename,self.content_type,self.size)
+        return '<FormPart %r = %.32r>' % (self.name,self.value)
+
+class Form(dict):
+    '''Parsed `multipart/form-data` body
+
+    Names of the fields -> their values (`str`) or,for files,their `FormPart`.If a name is repeated,the last part wins,
+    see `get_all` for every one of them
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.parts = list()
+        '''Every part,in order'''
+
+    def add(self,part : FormPart):
+        self.parts.append(part)
+        self[part.name] = part if part.is_file else part.value
+
+    def get_all(self,name : str) -> list:
+        '''Values or `FormPart` of every part named `name`'''
+        return [part if part.is_file else part.value for part in self.parts if part.name == name]
+
+    @property
+    def files(self) -> dict:
+        '''Names of the file fields -> their `FormPart`'''
+        return {part.name : part for part in self.parts if part.is_file}
+
+    def close(self):
+        '''Closes the temporary files of the parts,which deletes them'''
+        for part in self.parts:
+            if part.temporary:part.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+def parse_form(
+    request : Request,sink=None,max_field_size : int = 65536,max_file_size : int = 0,max_size : int = 0,
+    max_parts : int = 256,encoding : str = 'utf-8',directory : str = None,chunk_size : int = 65536
+) -> Form:
+    '''Parses the `multipart/form-data` body of a request,as it's read from `request.body`
+
+    Args:
+        request (Request): Request
+        sink (optional): Called with `(request,part)` when a file part starts,returns where its content is written to.
+                         A temporary file is used if it's `None`,or if it returns `None`. Defaults to None.
+        max_field_size (int, optional): Max size of the fields (parts without a filename),which are kept in memory. Defaults to 65536.
+        max_file_size (int, optional): Max size of every file,`0` means unlimited. Defaults to 0.
+        max_size (int, optional): Max size of the whole body,`0` means unlimited. Defaults to 0.
+        max_parts (int, optional): Max number of parts. Defaults to 256.
+        encoding (str, optional): Encoding of the fields,unless their part sets `charset`. Defaults to 'utf-8'.
+        directory (str, optional): Where the temporary files are created. Defaults to the server's `spool_directory`.
+        chunk_size (int, optional): Size of the reads from the body. Defaults to 65536.
+
+    Raises:
+        BadRequestException: HTTP 415 if the body isn't `multipart/form-data`,400 if it's malformed,413 if it exceeds a limit
+
+    Returns:
+        Form : The fields and files
+    '''
+    content_type,options = parse_header_options(request.headers.get('Content-Type'))
+    if content_type != 'multipart/form-data':
+        raise BadRequestException(HTTPStatus.UNSUPPORTED_MEDIA_TYPE,'Expected multipart/form-data,got %r' % content_type)
+    boundary = options.get('boundary','')
+    if not 0 < len(boundary) <= 70:
+        # https://tools.ietf.org/html/rfc2046#section-5.1.1
+        raise BadRequestException(HTTPStatus.BAD_REQUEST,'Bad multipart boundary (%r)' % boundary)
+    if max_size and request.body_length is not None and request.body_length > max_size:
+        raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Form exceeds %d bytes' % max_size)
+    if directory is None:directory = getattr(request.server,'spool_directory',None)
+    parser,form = MultipartParser(request.body,boundary.encode('latin-1'),chunk_size),Form()
+    try:
+        for headers,content in parser:
+            if len(form.parts) >= max_parts:
+                raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Form has more than %d parts' % max_parts)
+            part = FormPart(headers)
+            if part.is_file:
+                part.file = sink(request,part) if sink else None
+                if part.file is None:part.file,part.temporary = tempfile.TemporaryFile(dir=directory),True
+                limit,explain = max_file_size,'File %r exceeds %d bytes'
+            else:
+                value = bytearray()
+                limit,explain = max_field_size,'Field %r exceeds %d bytes'
+            form.add(part)
+            for block in content:
+                part.size += len(block)
+                if limit and part.size > limit:
+                    raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,explain % (part.name,limit))
+                if max_size and parser.read > max_size:
+                    raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'Form exceeds %d bytes' % max_size)
+                if part.is_file:part.file.write(block)
+                else:value += block
+            if part.temporary:part.file.seek(0)
+            if not part.is_file:
+                part.value = value.decode(part.options.get('charset',encoding),'replace')
+                form[part.name] = part.value
+    except BaseException:
+        form.close()
+        raise
+    return form
+
+@ModuleWrapper
+def MultipartFormWrapper(
+    sink=None,max_field_size : int = 65536,max_file_size : int = 0,max_size : int = 0,
+    max_parts : int = 256,encoding : str = 'utf-8',directory : str = None
+):
+    '''Wrapper to parse `multipart/form-data` bodies as they're received,the `Form` is passed as `content`
+
+    The temporary files of the parts are deleted once the request is finished
+
+    Usage:
+
+        @server.route('/upload')
+        @MultipartFormWrapper(max_file_size=1 << 30)
+        def upload(initator,request,form):
+            for part in form.files.values():
+                shutil.copyfileobj(part.file,open(safe_name(part.filename),'wb'))
+
+    Args:
+        sink (optional): Called with `(request,part)` when a file part starts,returns where its content is written to
+                         instead of a temporary file (e.g. an open file in its final location). Defaults to None.
+
+    The other arguments are the limits of `parse_form`
+    '''
+    forms = dict()
+    def prefix(request,previous_prefix_result):
+        forms[id(request)] = form = parse_form(request,sink,max_field_size,max_file_size,max_size,max_parts,encoding,directory)
+        return form
+    def final(request):
+        forms.pop(id(request)).close()
+    return prefix , None , final
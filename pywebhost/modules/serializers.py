@@ -0,0 +1,237 @@
+'''Serialization codecs of `JSONMessageWrapper`,chosen per route or negotiated with `Accept` / `Content-Type`
+
+    @server.route('/api/rows')
+    @JSONMessageWrapper(read=False,codec=('application/json','application/x-ndjson'))
+    def rows(initator,request,content):
+        return (row._asdict() for row in query_database())
+
+Routes only negotiate when they list the codecs to choose from,like above.Otherwise they use
+the codec they're given,JSON by default.Codecs are registered by their MIME type,see `register_codec`.Large results are streamed as they're encoded,
+so lists (and generators) of rows are never encoded as a whole in memory.
+'''
+import json,itertools
+from http import HTTPStatus
+from ..handler import Request,BadRequestException
+
+class Codec(object):
+    '''Base of the codecs,which encode the results of handlers and decode request bodies'''
+    mime_type = 'application/octet-stream'
+    '''`Content-Type` of what the codec encodes'''
+    streaming = False
+    '''Whether request bodies are decoded incrementally,i.e. `iterdecode` is used instead of `loads`'''
+
+    def dumps(self,obj) -> str:
+        '''Encodes `obj` at once'''
+        return ''.join(self.iterencode(obj))
+
+    def iterencode(self,obj):
+        '''Encodes `obj` by blocks of `str`,as they're iterated'''
+        raise NotImplementedError
+
+    def loads(self,data):
+        '''Decodes a whole body (`bytes` or `str`)'''
+        raise NotImplementedError
+
+    def iterdecode(self,stream):
+        '''Decodes a body as it's read from `stream`,yielding its items'''
+        yield self.loads(stream.read())
+
+    def __repr__(self) -> str:
+        return '<%s %s>' % (self.__class__.__name__,self.mime_type)
+
+def _is_sequence(obj) -> bool:
+    '''Whether `obj` is encoded as a JSON array,generators and other iterators included'''
+    return isinstance(obj,(list,tuple)) or (hasattr(obj,'__next__') and hasattr(obj,'__iter__'))
+
+def _batches(obj,batch_size : int):
+    iterator = iter(obj)
+    while True:
+        batch = list(itertools.islice(iterator,batch_size))
+        if not batch:return
+        yield batch
+
+class JSONCodec(Codec):
+    '''JSON,with `json`'''
+    mime_type = 'application/json'
+
+    def __init__(self,separators : tuple = None,ensure_ascii : bool = True,default=None,batch_size : int = 256) -> None:
+        '''
+        Args:
+            separators (tuple, optional): `(item_separator,key_separator)`,e.g. `(',',':')` for compact output. Defaults to None.
+            ensure_ascii (bool, optional): Escape non-ASCII characters. Defaults to True.
+            default (optional): Called with objects that can't be serialized otherwise,see `json.JSONEncoder`. Defaults to None.
+            batch_size (int, optional): Items of arrays encoded at once when streaming. Defaults to 256.
+        '''
+        self.encoder = json.JSONEncoder(separators=separators,ensure_ascii=ensure_ascii,default=default)
+        self.batch_size = batch_size
+
+    def dumps(self,obj) -> str:
+        if _is_sequence(obj) and not isinstance(obj,(list,tuple)):obj = list(obj)
+        return self.encoder.encode(obj)
+
+    def iterencode(self,obj):
+        '''Encodes `obj` by blocks
+
+        Arrays (including generators) and objects at the top level are encoded `batch_size` items at a time
+        with the C encoder,which is several times faster than `JSONEncoder.iterencode`.Other values are encoded at once
+        '''
+        if isinstance(obj,dict):
+            items,(start,end) = obj.items(),'{}'
+            encode = lambda batch:self.encoder.encode(dict(batch))
+        elif _is_sequence(obj):
+            items,(start,end) = obj,'[]'
+            encode = self.encoder.encode
+        else:
+            yield self.encoder.encode(obj)
+            return
+        separator = ''
+        yield start
+        for batch in _batches(items,self.batch_size):
+            yield separator + encode(batch)[1:-1]
+            separator = self.encoder.item_separator
+        yield end
+
+    def loads(self,data):
+        return json.loads(data)
+
+class NDJSONCodec(JSONCodec):
+    '''Newline delimited JSON (http://ndjson.org),one value per line
+
+    Results are encoded row by row (a value that isn't an array becomes one row),
+    request bodies are decoded line by line as they're received
+    '''
+    mime_type = 'application/x-ndjson'
+    streaming = True
+
+    def __init__(self,ensure_ascii : bool = True,default=None,batch_size : int = 256,max_line : int = 1 << 20) -> None:
+        '''
+        Args:
+            ensure_ascii (bool, optional): Escape non-ASCII characters. Defaults to True.
+            default (optional): Called with objects that can't be serialized otherwise. Defaults to None.
+            batch_size (int, optional): Rows encoded at once. Defaults to 256.
+            max_line (int, optional): Max size of a line of the request body. Defaults to 1 MiB.
+        '''
+        super().__init__((',',':'),ensure_ascii,default,batch_size)
+        self.max_line = max_line
+
+    def iterencode(self,obj):
+        if not _is_sequence(obj):obj = (obj,)
+        encode = self.encoder.encode
+        for batch in _batches(obj,self.batch_size):
+            yield '\n'.join(map(encode,batch)) + '\n'
+
+    def dumps(self,obj) -> str:
+        return ''.join(self.iterencode(obj))
+
+    def loads(self,data):
+        if isinstance(data,(bytes,bytearray)):data = data.decode('utf-8')
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    def iterdecode(self,stream):
+        number = 0
+        while True:
+            line = stream.readline(self.max_line + 1)
+            if not line:return
+            number += 1
+            if len(line) > self.max_line:
+                raise BadRequestException(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,'NDJSON line %d exceeds %d bytes' % (number,self.max_line))
+            if not line.strip():continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise BadRequestException(HTTPStatus.BAD_REQUEST,'Bad NDJSON line %d (%s)' % (number,e))
+
+codecs = dict()
+'''Registered codecs,MIME types -> `Codec`,in order of preference'''
+
+def register_codec(codec : Codec,*mime_types : str):
+    '''Registers `codec` for its `mime_type`,and for `mime_types` if given'''
+    for mime_type in mime_types or (codec.mime_type,):codecs[mime_type.lower()] = codec
+    return codec
+
+def get_codec(codec) -> Codec:
+    '''The codec registered for a MIME type,or `codec` itself if it's a `Codec` already
+
+    Raises:
+        KeyError: If nothing is registered for the MIME type
+    '''
+    if isinstance(codec,Codec):return codec
+    return codecs[codec.lower()]
+
+register_codec(JSONCodec())
+register_codec(NDJSONCodec(),'application/x-ndjson','application/jsonl')
+
+_accepted = dict()
+
+def accepted_types(accept : str) -> list:
+    '''Parses an `Accept` header,results are cached
+
+    Returns:
+        list : `(media range (lowercased),quality)` of every media range
+    '''
+    ranges = _accepted.get(accept)
+    if ranges is None:
+        ranges = list()
+        for item in accept.split(','):
+            media_range,_,params = item.partition(';')
+            media_range,quality = media_range.strip().lower(),1.0
+            for param in params.split(';'):
+                key,_,value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if media_range:ranges.append((media_range,quality))
+        if len(_accepted) >= 256:_accepted.clear()
+        _accepted[accept] = ranges
+    return ranges
+
+def _quality(ranges : list,mime_type : str) -> float:
+    '''Quality of `mime_type` by its most specific media range'''
+    best,quality = -1,0.0
+    for media_range,q in ranges:
+        if media_range == mime_type:specificity = 2
+        elif media_range.endswith('/*') and mime_type.startswith(media_range[:-1]):specificity = 1
+        elif media_range == '*/*':specificity = 0
+        else:continue
+        if specificity > best:best,quality = specificity,q
+    return quality
+
+def negotiate_codec(request : Request,candidates : tuple = None) -> Codec:
+    '''Picks the codec of the response with `Accept`
+
+    Args:
+        request (Request): Request
+        candidates (tuple, optional): Codecs / MIME types to choose from,in order of preference. Defaults to every registered one.
+
+    Returns:
+        Codec : The most acceptable codec,or the first candidate if none is
+    '''
+    candidates = [get_codec(codec) for codec in (candidates or codecs.values())]
+    accept = request.headers.get('Accept')
+    if not accept:return candidates[0]
+    ranges = accepted_types(accept)
+    best,best_quality = candidates[0],0
+    for codec in candidates:
+        quality = _quality(ranges,codec.mime_type)
+        if quality > best_quality:best,best_quality = codec,quality
+    return best
+
+def request_codec(request : Request,candidates : tuple = None) -> Codec:
+    '''Picks the codec of the request body with its `Content-Type`
+
+    Args:
+        request (Request): Request
+        candidates (tuple, optional): Codecs / MIME types to choose from. Defaults to every registered one.
+
+    Returns:
+        Codec : The codec of the `Content-Type`,or the first candidate (JSON by default) if it isn't one of them
+    '''
+    content_type = (request.headers.get('Content-Type') or '').split(';',1)[0].strip().lower()
+    if not candidates:return codecs.get(content_type) or codecs['application/json']
+    registered = codecs.get(content_type)
+    candidates = [get_codec(codec) for codec in candidates]
+    for codec in candidates:
+        if codec is registered or codec.mime_type == content_type:return codec
+    return candidates[0]
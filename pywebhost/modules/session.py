@@ -13,8 +13,9 @@ class Session(dict):
     
     def mapUri(self,url):
         '''From the request path to local method'''
-        if self.paths.hasitem(url):
-            return (self.paths[url],True)
+        route = self.paths.match(url)
+        if route:
+            return (route.handler,True)
         classpath = url.replace('/','_')
         if hasattr(self,classpath):
             return (getattr(self,classpath),False)
@@ -38,7 +39,9 @@ class Session(dict):
             str : UID
         '''
         if not self.use_session_id:return None
-        session_id = self.request.cookies.get(SESSION_KEY) or self.request.cookies_buffer.get(SESSION_KEY)
+        session_id = self.request.get_cookie(SESSION_KEY)
+        if session_id:return session_id
+        session_id = self.request.cookies_buffer.get(SESSION_KEY)
         if not session_id:
             return None    
         return session_id.value
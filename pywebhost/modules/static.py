@@ -0,0 +1,401 @@
+'''Static file delivery with caching and conditional requests
+
+    server.route('/assets/(.*)')(StaticDirectory('./assets'))
+
+Or,for single files:
+
+    @server.route('/favicon.ico')
+    def favicon(initator,request,content):
+        SendStaticFile(request,'favicon.ico')
+
+`StaticFileCache` keeps the files it serves open,and their `stat` results for `ttl` seconds.Files up to
+`max_memory_file` are kept in memory instead,within `memory_size` bytes.Every response carries an `ETag` and
+a `Last-Modified` header,and requests whose `If-None-Match` / `If-Modified-Since` match are answered with a 304,
+without touching the file.
+
+With `compression` set,compressible files are sent compressed to the clients accepting it:from their `.gz`
+sidecar if there's one (e.g. `app.js.gz` next to `app.js`),or compressed once per file version otherwise.
+
+NOTE: Paths are served as given,they must be made safe by the caller
+'''
+import os,stat,time,threading,html
+from collections import OrderedDict
+from email.utils import formatdate,parsedate_to_datetime
+from http import HTTPStatus
+from ..handler import Request,BadRequestException
+from urllib.parse import quote
+from . import WriteContentToRequest,Redirect,guess_mime_type
+from .compression import Compression,negotiate_encoding,compress
+
+class StaticFile(object):
+    '''A cached file,with either its content (`data`) or an open `file`'''
+    __slots__ = ('path','size','mtime','etag','last_modified','mime_type','data','file','identity','checked')
+
+    def __init__(self,path : str,st : os.stat_result,data : bytes = None,file = None) -> None:
+        self.path,self.data,self.file = path,data,file
+        self.size,self.mtime = st.st_size,st.st_mtime
+        self.identity = (st.st_ino,st.st_size,st.st_mtime_ns)
+        '''What tells the file was changed'''
+        self.etag = '"%x-%x"' % (st.st_mtime_ns // 1000,st.st_size)
+        self.last_modified = formatdate(st.st_mtime,usegmt=True)
+        self.mime_type = guess_mime_type(path)
+        self.checked = time.monotonic()
+        '''When the `stat` result was last validated'''
+
+class StaticFileCache(object):
+    '''Cache of open files,`stat` results and the content of small files
+
+    - Up to `max_files` files are kept open,the least recently used are closed first
+    - Files up to `max_memory_file` bytes are read into memory,up to `memory_size` bytes in total
+    - A cached file is `stat`-ed again once it's been cached for `ttl` seconds,and reloaded if it was changed
+    - Compressed content is kept up to `compressed_size` bytes,keyed by the path,version and content coding of the file
+    '''
+    def __init__(self,max_files : int = 256,ttl : float = 1,memory_size : int = 32 << 20,max_memory_file : int = 256 << 10,
+                 compression : Compression = None,compressed_size : int = 16 << 20,max_compress_file : int = 8 << 20) -> None:
+        '''
+        Args:
+            max_files (int, optional): Max count of open files. Defaults to 256.
+            ttl (float, optional): Seconds before a cached file is validated again. Defaults to 1.
+            memory_size (int, optional): Max bytes of file content kept in memory. Defaults to 32MiB.
+            max_memory_file (int, optional): Max size of the files kept in memory. Defaults to 256KiB.
+            compression (Compression, optional): Which files are compressed,`None` disables compression. Defaults to None.
+            compressed_size (int, optional): Max bytes of compressed content kept in memory. Defaults to 16MiB.
+            max_compress_file (int, optional): Larger files are only sent compressed from their sidecars. Defaults to 8MiB.
+        '''
+        self.max_files,self.ttl = max_files,ttl
+        self.memory_size,self.max_memory_file = memory_size,max_memory_file
+        self.compression,self.compressed_size,self.max_compress_file = compression,compressed_size,max_compress_file
+        self.compressed = OrderedDict()
+        '''(path,version,content coding) -> compressed content,least recently used first'''
+        self.compressed_used = 0
+        self.missing = dict()
+        '''Paths of sidecars found missing -> when they were looked up'''
+        self.files = OrderedDict()
+        '''Paths -> `StaticFile` of the open files,least recently used first'''
+        self.memory = OrderedDict()
+        '''Paths -> `StaticFile` of the files in memory,least recently used first'''
+        self.memory_used = 0
+        self.hits = self.misses = self.evictions = self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def _get(self,path : str) -> StaticFile:
+        with self._lock:
+            for entries in (self.memory,self.files):
+                entry = entries.get(path)
+                if entry is not None:
+                    entries.move_to_end(path)
+                    return entry
+        return None
+
+    def _drop(self,path : str):
+        with self._lock:
+            entry = self.memory.pop(path,None)
+            if entry is not None:self.memory_used -= entry.size
+            self.files.pop(path,None)
+        # Open files are closed once the requests still sending them are done
+
+    def _load(self,path : str) -> StaticFile:
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):raise FileNotFoundError(path)
+        if st.st_size <= self.max_memory_file:
+            with open(path,'rb') as file:
+                st = os.fstat(file.fileno())
+                entry = StaticFile(path,st,data=file.read(st.st_size))
+        else:
+            file = open(path,'rb',buffering=0)
+            entry = StaticFile(path,os.fstat(file.fileno()),file=file)
+        with self._lock:
+            if entry.data is not None:
+                previous = self.memory.pop(path,None)
+                if previous is not None:self.memory_used -= previous.size
+                self.memory[path] = entry
+                self.memory_used += entry.size
+                while self.memory_used > self.memory_size and len(self.memory) > 1:
+                    self.memory_used -= self.memory.popitem(last=False)[1].size
+                    self.evictions += 1
+            else:
+                self.files[path] = entry
+                while len(self.files) > self.max_files:
+                    self.files.popitem(last=False)
+                    self.evictions += 1
+        return entry
+
+    def get(self,path : str) -> StaticFile:
+        '''Looks up `path`,loading it on a miss
+
+        Raises:
+            FileNotFoundError: When `path` isn't a regular file
+            OSError: When `path` can't be opened
+
+        Returns:
+            StaticFile : The cached file
+        '''
+        entry = self._get(path)
+        if entry is not None:
+            now = time.monotonic()
+            if now - entry.checked < self.ttl:
+                self.hits += 1
+                return entry
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is not None and (st.st_ino,st.st_size,st.st_mtime_ns) == entry.identity:
+                entry.checked = now
+                self.hits += 1
+                return entry
+            self._drop(path)
+        self.misses += 1
+        return self._load(path)
+
+    def sidecar(self,entry : StaticFile) -> StaticFile:
+        '''The `.gz` sidecar of `entry`,if there's one at least as new as it'''
+        path,now = entry.path + '.gz',time.monotonic()
+        missing = self.missing.get(path)
+        if missing is not None and now - missing < self.ttl:return None
+        try:
+            sidecar = self.get(path)
+        except OSError:
+            if len(self.missing) >= self.max_files:self.missing.clear()
+            self.missing[path] = now
+            return None
+        return sidecar if sidecar.mtime >= entry.mtime else None
+
+    def compressed_content(self,entry : StaticFile,encoding : str) -> bytes:
+        '''The content of `entry` compressed with `encoding`,compressed once per version of the file'''
+        key = (entry.path,entry.identity,encoding)
+        with self._lock:
+            data = self.compressed.get(key)
+            if data is not None:
+                self.compressed.move_to_end(key)
+                self.hits += 1
+                return data
+        self.misses += 1
+        if entry.data is not None:
+            content = entry.data
+        else:
+            with open(entry.path,'rb') as file:content = file.read(entry.size)
+        data = compress(content,encoding,self.compression.level)
+        with self._lock:
+            if not key in self.compressed:
+                self.compressed[key] = data
+                self.compressed_used += len(data)
+            while self.compressed_used > self.compressed_size and len(self.compressed) > 1:
+                self.compressed_used -= len(self.compressed.popitem(last=False)[1])
+                self.evictions += 1
+        return data
+
+    def is_not_modified(self,request : Request,entry : StaticFile,etag : str = None) -> bool:
+        '''Whether the client's copy of `entry` is current,according to `If-None-Match` / `If-Modified-Since`
+
+        Args:
+            etag (str, optional): `ETag` of the representation being sent. Defaults to the one of `entry`.
+        '''
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Weak comparison,see https://tools.ietf.org/html/rfc7232#section-3.2
+            if if_none_match.strip() == '*':return True
+            tags = (tag.strip() for tag in if_none_match.split(','))
+            return (etag or entry.etag) in (tag[2:] if tag[:2] == 'W/' else tag for tag in tags)
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(entry.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError,ValueError,IndexError,OverflowError):
+                return False
+        return False
+
+    def send(self,request : Request,path : str,mime_type : str = None,cache_control : str = None,partial_acknowledge : bool = True) -> bool:
+        '''Answers `request` with the file at `path`,or with a 304 if the client has it already
+
+        Args:
+            request (Request): Request
+            path (str): Path of the file
+            mime_type (str, optional): Content mime type. Defaults to the one guessed from `path`.
+            cache_control (str, optional): `Cache-Control` header to send. Defaults to None.
+            partial_acknowledge (bool, optional): React to `Range` requests or not. Defaults to True.
+
+        Raises:
+            BadRequestException: HTTP 404 when `path` isn't a regular file,HTTP 403 when it can't be opened
+
+        Returns:
+            bool : True
+        '''
+        try:
+            entry = self.get(path)
+        except (FileNotFoundError,NotADirectoryError):
+            raise BadRequestException(HTTPStatus.NOT_FOUND,'File not found')
+        except PermissionError:
+            raise BadRequestException(HTTPStatus.FORBIDDEN,'Access denied')
+        mime_type = mime_type or entry.mime_type
+        content,etag = entry,entry.etag
+        compression = self.compression
+        if compression is not None and entry.size >= compression.min_size and compression.is_compressible(mime_type):
+            request.send_header('Vary','Accept-Encoding')
+            encoding = negotiate_encoding(request,compression.encodings)
+            if encoding:
+                content = self.sidecar(entry) if encoding == 'gzip' else None
+                if content is None:
+                    content = self.compressed_content(entry,encoding) if entry.size <= self.max_compress_file else entry
+                if content is not entry:
+                    # Every representation has its own entity tag
+                    etag = '%s-%s"' % (entry.etag[:-1],encoding)
+                    request.send_header('Content-Encoding',encoding)
+        request.send_header('ETag',etag)
+        request.send_header('Last-Modified',entry.last_modified)
+        if cache_control:request.send_header('Cache-Control',cache_control)
+        if request.command in ('GET','HEAD') and self.is_not_modified(request,entry,etag):
+            self.not_modified += 1
+            request.send_response(HTTPStatus.NOT_MODIFIED)
+            request.headers_buffer.pop('content-length',None)
+            request.end_headers()
+            return True
+        if isinstance(content,bytes):
+            return WriteContentToRequest(request,content,partial_acknowledge,mime_type=mime_type)
+        if content.data is not None:
+            return WriteContentToRequest(request,content.data,partial_acknowledge,mime_type=mime_type)
+        return WriteContentToRequest(request,content.file,partial_acknowledge,content.size,mime_type=mime_type,offset=0)
+
+    def stats(self) -> dict:
+        '''
+        Returns:
+            dict : `hits`,`misses`,`evictions`,`not_modified` (count of 304s),`files` (open files),`memory` (bytes in memory)
+                   and `compressed` (bytes of compressed content)
+        '''
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'not_modified' : self.not_modified,
+            'files' : len(self.files),
+            'memory' : self.memory_used,
+            'compressed' : self.compressed_used
+        }
+
+default_cache = StaticFileCache()
+'''The cache used by `SendStaticFile` by default'''
+
+def SendStaticFile(request : Request,path : str,mime_type : str = None,cache_control : str = None,partial_acknowledge : bool = True,cache : StaticFileCache = None) -> bool:
+    '''Sends a file through a `StaticFileCache`,see `StaticFileCache.send`
+
+    Args:
+        request (Request): Request
+        path (str): Path of the file
+        mime_type (str, optional): Content mime type. Defaults to the one guessed from `path`.
+        cache_control (str, optional): `Cache-Control` header to send. Defaults to None.
+        partial_acknowledge (bool, optional): React to `Range` requests or not. Defaults to True.
+        cache (StaticFileCache, optional): Cache to use. Defaults to `default_cache`.
+
+    Returns:
+        bool : True
+    '''
+    return (cache or default_cache).send(request,path,mime_type,cache_control,partial_acknowledge)
+
+class StaticDirectory(object):
+    '''Handler serving a directory tree,to be routed with `server.route`
+
+        server.route('/assets/(.*)')(StaticDirectory('./assets',listing=True))
+
+    The last group of the route is the path of the file relative to `root`,or the whole request path
+    if the route has none.Files are sent through a `StaticFileCache`,with `Range` support.
+
+    - Paths can't escape `root`:`..` segments are rejected,and so are hidden files (`.git`,`.env`...)
+      unless `show_hidden` is set.Symbolic links leading outside of `root` are rejected too,unless `follow_symlinks` is set
+      (which lets anyone able to create a link inside `root` serve any file the server can read)
+    - Directories are redirected to their path with a trailing `/`,then answered with their `index` file,
+      or a listing if `listing` is set.Listings are cached until the modification time of the directory changes
+    '''
+    def __init__(self,root : str,index : tuple = ('index.html',),listing : bool = False,show_hidden : bool = False,
+                 follow_symlinks : bool = False,cache_control : str = None,cache : StaticFileCache = None,max_listings : int = 256) -> None:
+        '''
+        Args:
+            root (str): Directory to serve
+            index (tuple, optional): Names of the files answering for their directory. Defaults to ('index.html',).
+            listing (bool, optional): List the directories without an index file. Defaults to False.
+            show_hidden (bool, optional): Serve and list the files whose names start with `.`. Defaults to False.
+            follow_symlinks (bool, optional): Follow symbolic links leading outside of `root`. Defaults to False.
+            cache_control (str, optional): `Cache-Control` header to send. Defaults to None.
+            cache (StaticFileCache, optional): Cache to send the files with. Defaults to `default_cache`.
+            max_listings (int, optional): Max count of cached listings. Defaults to 256.
+        '''
+        self.root = os.path.realpath(root)
+        self.index,self.listing,self.show_hidden = tuple(index),listing,show_hidden
+        self.follow_symlinks,self.cache_control = follow_symlinks,cache_control
+        self.cache = cache or default_cache
+        self.max_listings = max_listings
+        self.listings = OrderedDict()
+        '''Paths of directories -> (modification time,rendered listing)'''
+        self._lock = threading.Lock()
+
+    def resolve(self,relative : str) -> str:
+        '''Maps a path relative to `root` to the local path
+
+        Returns:
+            str : The local path,or `None` if it's not allowed
+        '''
+        segments = []
+        for segment in relative.replace('\\','/').split('/'):
+            if not segment or segment == '.':continue
+            if segment == '..' or '\0' in segment or (segment[0] == '.' and not self.show_hidden):return None
+            segments.append(segment)
+        path = os.path.join(self.root,*segments)
+        if not self.follow_symlinks and os.path.commonpath((self.root,os.path.realpath(path))) != self.root:
+            return None
+        return path
+
+    def render_listing(self,request : Request,path : str) -> bytes:
+        '''Renders the HTML listing of a directory'''
+        directories,files = [],[]
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name[0] == '.' and not self.show_hidden:continue
+                try:
+                    if entry.is_dir():directories.append((entry.name + '/',''))
+                    else:files.append((entry.name,str(entry.stat().st_size)))
+                except OSError:
+                    continue
+        title = html.escape(request.path)
+        rows = ''.join('<tr><td><a href="%s">%s</a></td><td>%s</td></tr>' % (
+            quote(name,errors='surrogateescape'),html.escape(name),size
+        ) for name,size in sorted(directories) + sorted(files))
+        return (
+            '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Index of %s</title></head><body>'
+            '<h1>Index of %s</h1><table><tr><td><a href="../">../</a></td><td></td></tr>%s</table></body></html>' % (title,title,rows)
+        ).encode('utf-8','surrogateescape')
+
+    def send_listing(self,request : Request,path : str) -> bool:
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self.listings.get(path)
+            if cached is not None:self.listings.move_to_end(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime,self.render_listing(request,path))
+            with self._lock:
+                self.listings[path] = cached
+                while len(self.listings) > self.max_listings:self.listings.popitem(last=False)
+        request.send_header('Cache-Control','no-cache')
+        return WriteContentToRequest(request,cached[1],mime_type='text/html; charset=utf-8')
+
+    def send_directory(self,request : Request,path : str) -> bool:
+        for name in self.index:
+            try:
+                return self.cache.send(request,os.path.join(path,name),cache_control=self.cache_control)
+            except BadRequestException as e:
+                if e.code != HTTPStatus.NOT_FOUND:raise
+        if self.listing and os.path.isdir(path):
+            return self.send_listing(request,path)
+        raise BadRequestException(HTTPStatus.NOT_FOUND,'File not found')
+
+    def __call__(self,initator,request : Request,content):
+        relative = (request.route_groups[-1] if request.route_groups else request.path) or ''
+        path = self.resolve(relative)
+        if path is None:raise BadRequestException(HTTPStatus.NOT_FOUND,'File not found')
+        if not relative or relative[-1] == '/':
+            return self.send_directory(request,path)
+        try:
+            return self.cache.send(request,path,cache_control=self.cache_control)
+        except BadRequestException as e:
+            if e.code != HTTPStatus.NOT_FOUND or not os.path.isdir(path):raise
+        # A directory,so relative links in it resolve against it
+        target = request.split_target()
+        return Redirect(request,target[2] + '/' + ('?' + target[4] if target[4] else ''),HTTPStatus.MOVED_PERMANENTLY)
@@ -1,7 +1,8 @@
-import struct,random,base64,hashlib,typing,select,json
+import struct,random,base64,hashlib,typing,select,json,asyncio
+from io import BytesIO
 from typing import Union
 from .session import Session
-from . import ModuleWrapper
+from . import ModuleWrapper, awaitable
 from http import HTTPStatus
 from datetime import timedelta
 
@@ -200,6 +201,8 @@ class WebsocketSession(Session):
         '''        
         self.raw_frames = raw_frames
         self.keep_alive, self.did_handshake = True, False
+        self.metrics = None
+        # Set once the handshake is done,if the server has `metrics`
         self.__buffer = bytearray()
         super().__init__(request, *a,**k)
         
@@ -232,6 +235,8 @@ class WebsocketSession(Session):
         self.request.send_header('Upgrade', 'websocket')
         self.request.end_headers()
         self.did_handshake = True
+        self.metrics = getattr(self.request.server,'metrics',None)
+        if self.metrics is not None:self.metrics.websocket_opened()
         self.request.log_request('New Websocket session from %s:%s' % self.request.client_address)
         self.onOpen()
 
@@ -278,13 +283,29 @@ class WebsocketSession(Session):
         '''
             Appends message to the buffer,Every message will be constructed as a Websocket Frame
         '''
-        return self.request.wfile.write(self.__websocket_constructframe(frame))
+        data = self.__websocket_constructframe(frame)
+        if self.metrics is not None:self.metrics.websocket_frame('out',data[0] & 0x0F,len(data))
+        return self.request.wfile.write(data)
 
     def receive(self) -> WebsocketFrame:
         '''
             Receives a single frame,will block thread
         '''
-        return self.__websocket_recieveframe(self.request.rfile)
+        frame = self.__websocket_recieveframe(self.request.rfile)
+        if frame and self.metrics is not None:self.metrics.websocket_frame('in',frame.OPCODE,frame.PAYLOAD_LENGTH)
+        return frame
+
+    def construct_frame(self, frame: WebsocketFrame) -> bytearray:
+        '''
+            Serializes a frame into bytes to be sent
+        '''
+        return self.__websocket_constructframe(frame)
+
+    def parse_frame(self, rfile: typing.BinaryIO) -> WebsocketFrame:
+        '''
+            Reads a single frame from `rfile`,PAYLOAD is unmasked
+        '''
+        return self.__websocket_recieveframe(rfile)
 
     def serve(self):
         '''
@@ -323,6 +344,7 @@ class WebsocketSession(Session):
         self.request.log_debug('Websocket Connection closed')
         self.request.server.websockets.remove(self)
         # kicks ourself out
+        if self.metrics is not None:self.metrics.websocket_closed()
         self.onClose()
 
     def onClose(self,request=None,content=None):        
@@ -510,6 +532,82 @@ class WebsocketSession(Session):
         return rkey.decode()
 
 
+class AsyncWebsocketSession(WebsocketSession):
+    '''
+        # Async websocket session
+
+        `WebsocketSession` for `pywebhost.aio.AsyncPyWebHost`.Serving happens on the event loop,
+        so an idle session doesn't hold a thread
+
+        - asend             :       Sends a frame,and waits for it to be drained
+        - areceive          :       Receives a single frame
+        - aserve            :       Starts serving the client until the connection is closed
+
+        `onReceive` may be a coroutine function,in which case it's awaited on the loop
+    '''
+    def onCreate(self,request=None,content=None):
+        if not hasattr(self.request.server, 'websockets'):
+            setattr(self.request.server, 'websockets', [])
+        # Transport sockets have no timeouts to be removed
+        self.request.server.websockets.append(self)
+        self.__buffer = bytearray()
+
+    async def asend(self, frame: WebsocketFrame):
+        '''
+            Sends a frame,and waits for it to be drained
+        '''
+        data = self.construct_frame(frame)
+        if self.metrics is not None:self.metrics.websocket_frame('out',data[0] & 0x0F,len(data))
+        return await self.request.awrite(data)
+
+    async def areceive(self) -> WebsocketFrame:
+        '''
+            Receives a single frame,returns `None` if the connection was closed
+        '''
+        reader = self.request.reader
+        try:
+            b12 = await reader.readexactly(2)
+            PAYLOAD_LENGTH = b12[1] & 0x7F
+            extended = {126 : 2,127 : 8}.get(PAYLOAD_LENGTH,0)
+            header = await reader.readexactly(extended + 4) # Extended payload length,MASKEY
+            if extended:PAYLOAD_LENGTH = int.from_bytes(header[:extended],'big')
+            PAYLOAD = await reader.readexactly(PAYLOAD_LENGTH)
+        except asyncio.IncompleteReadError:
+            return None
+        frame = self.parse_frame(BytesIO(b12 + header + PAYLOAD))
+        if self.metrics is not None:self.metrics.websocket_frame('in',frame.OPCODE,PAYLOAD_LENGTH)
+        return frame
+
+    async def _aonReceive(self, frame: WebsocketFrame):
+        '''Async counterpart of `_onReceive`,awaits `onReceive` if needed'''
+        if self.raw_frames or frame.OPCODE in (WebsocketSession.PING,WebsocketSession.PONG,WebsocketSession.CLOSE_CONN):
+            return await awaitable(self._onReceive(frame))
+        self.__buffer.extend(frame.PAYLOAD)
+        if frame.FIN:
+            payload,self.__buffer = self.__buffer,bytearray()
+            await awaitable(self.onReceive(payload))
+
+    async def aserve(self):
+        '''
+            Starts processing I/O on the loop,returns once the connection is closed
+        '''
+        if not self.did_handshake:
+            raise Exception("Handshake was not performed!")
+        while self.keep_alive:
+            try:
+                frame = await self.areceive()
+                if not frame:
+                    raise WebsocketConnectionClosedException(False)
+                result = await self._aonReceive(frame)
+                if isinstance(result,WebsocketConnectionClosedException):
+                    if result.is_requested:
+                        self.keep_alive = False
+                    else:raise result
+            except Exception as e:
+                self.request.log_error(str(e))
+                self.keep_alive = False
+        self._onClose()
+
 @ModuleWrapper
 def WebsocketSessionWrapper(raw_frames=False,**kwargs):
     '''Wrapper for websocket requests
@@ -542,4 +640,32 @@ def WebsocketSessionWrapper(raw_frames=False,**kwargs):
         session = function_result(request,raw_frames=raw_frames,**kwargs)
         session.handshake()
         session.serve()
+    return None , suffix
+
+@ModuleWrapper
+def AsyncWebsocketSessionWrapper(raw_frames=False,**kwargs):
+    '''Wrapper for websocket requests served by `pywebhost.aio.AsyncPyWebHost`
+
+    Usage:
+
+        ...
+        class WSApp(AsyncWebsocketSession):
+            async def onReceive(self,frame):
+                await self.asend(frame)
+        @server.route('/ws')
+        @AsyncWebsocketSessionWrapper()
+        def wsapp(request : Request,content):
+            return WSApp
+    Args:
+
+        raw_frames (bool, optional): To receive concatnated content as bytearrary or raw websocket frames. Defaults to False.
+    '''
+    async def suffix(request,function_result : AsyncWebsocketSession):
+        if not function_result:
+            return # Dropping connection
+        if not issubclass(function_result,AsyncWebsocketSession):
+            raise TypeError('A `pywebhost.AsyncWebsocketSession` (sub) class is required')
+        session = function_result(request,raw_frames=raw_frames,**kwargs)
+        session.handshake()
+        await session.aserve()
     return None , suffix
\ No newline at end of file
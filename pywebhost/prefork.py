@@ -0,0 +1,242 @@
+'''Pre-fork multi-process serving
+
+One `PyWebHost` process is bound to about one core of Python work because of the GIL.
+`PreforkSupervisor` forks the configured server into several worker processes:
+
+    server = PyWebHost(('',1234))
+
+    @server.route('/')
+    def index(initator,request,content):
+        ...
+
+    PreforkSupervisor(server,workers=4).serve_forever()
+
+Routes registered before `serve_forever` are inherited by the workers through `fork`,the app
+is not imported again.
+
+- With `SO_REUSEPORT` (Linux,BSD),every worker gets its own listener on the same address and the
+  kernel balances the connections.Otherwise the workers share the inherited listener
+- Workers that crash are restarted
+- `SIGHUP` restarts the workers one by one,each old worker finishes its in-flight requests first
+- `SIGTERM` / `SIGINT` stop every worker gracefully
+'''
+import json,logging,os,selectors,signal,socket,sys,time
+
+def aggregate_stats(stats : list) -> dict:
+    '''Combines `PyWebHost.stats()` of several workers
+
+    Counts are summed,`*_max` values take the max,`*_avg` values,`occupancy` and `delay` are averaged
+    '''
+    stats = [s for s in stats if s is not None]
+    if not stats:return None
+    if not isinstance(stats[0],dict):
+        return sum(stats)
+    combined = dict()
+    for key in stats[0]:
+        values = [s.get(key) for s in stats]
+        if isinstance(stats[0][key],dict) or stats[0][key] is None:
+            combined[key] = aggregate_stats(values)
+        elif key.endswith('_max'):
+            combined[key] = max(values)
+        elif key.endswith('_avg') or key in ('occupancy','delay'):
+            combined[key] = sum(values) / len(values)
+        else:
+            combined[key] = sum(values)
+    return combined
+
+class PreforkSupervisor(object):
+    '''Forks `workers` processes serving `server`,and keeps them alive'''
+    def __init__(self,server,workers : int = None,reuse_port : bool = None,graceful_timeout : float = 30,stats_interval : float = 1):
+        '''
+        Args:
+            server (PyWebHost): The server,with routes registered.It must be bound already
+            workers (int, optional): Count of worker processes. Defaults to `os.cpu_count()`.
+            reuse_port (bool, optional): Give every worker its own `SO_REUSEPORT` listener.Defaults to
+                                         `True` when the platform supports it.
+            graceful_timeout (float, optional): Seconds a stopping worker may spend on in-flight requests. Defaults to 30.
+            stats_interval (float, optional): Seconds between two stats reports of a worker. Defaults to 1.
+        '''
+        if not hasattr(os,'fork'):
+            raise OSError('Pre-forking requires `os.fork`')
+        self.server = server
+        self.workers = workers or os.cpu_count() or 1
+        self.reuse_port = hasattr(socket,'SO_REUSEPORT') if reuse_port is None else reuse_port
+        self.graceful_timeout,self.stats_interval = graceful_timeout,stats_interval
+        self.logger = logging.getLogger('PreforkSupervisor')
+        self.children = dict()
+        '''pid -> (pipe,last reported stats)'''
+        self.selector = selectors.DefaultSelector()
+        self._stopping = self._restarting = False
+
+    def stats(self) -> dict:
+        '''Stats reported by the workers
+
+        Returns:
+            dict : `workers` maps pids to their `PyWebHost.stats()`,`total` holds the combined stats
+        '''
+        workers = {pid : stats for pid,(_,stats) in self.children.items()}
+        return {'workers' : workers,'total' : aggregate_stats(list(workers.values()))}
+
+    # Worker side
+    def _listen(self):
+        '''Replaces the inherited listener with a new `SO_REUSEPORT` one'''
+        server = self.server
+        listener = socket.socket(server.address_family,server.socket_type)
+        listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEPORT,1)
+        listener.bind(server.server_address)
+        listener.listen(server.request_queue_size)
+        server.socket = listener
+
+    def _report(self,pipe : int):
+        while True:
+            try:
+                os.write(pipe,(json.dumps(self.server.stats()) + '\n').encode())
+            except OSError:
+                return # Supervisor is gone
+            time.sleep(self.stats_interval)
+
+    def _run_worker(self,pipe : int):
+        '''Entry point of forked workers,never returns'''
+        import threading
+        code = 0
+        try:
+            signal.signal(signal.SIGHUP,signal.SIG_IGN)
+            for signum in (signal.SIGTERM,signal.SIGINT):
+                signal.signal(signum,lambda *a:self.server.stop_serving(shared=not self.reuse_port))
+            if self.reuse_port:self._listen()
+            threading.Thread(target=self._report,args=(pipe,),daemon=True).start()
+            self.server.serve_forever()
+            # Graceful stop,let the in-flight requests finish
+            self.server.drain(self.graceful_timeout)
+            self.server.server_close()
+        except BaseException:
+            self.logger.exception('Worker %s failed' % os.getpid())
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    # Supervisor side
+    def spawn(self) -> int:
+        '''Forks a new worker
+
+        Returns:
+            int : pid of the worker
+        '''
+        read,write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            for pipe,_ in self.children.values():pipe.close()
+            self._run_worker(write)
+        os.close(write)
+        pipe = os.fdopen(read,'rb',buffering=0)
+        self.children[pid] = (pipe,None)
+        self.selector.register(pipe,selectors.EVENT_READ,pid)
+        self.logger.debug('Worker %s started' % pid)
+        return pid
+
+    def _collect(self,timeout : float):
+        '''Reads the stats reported by the workers'''
+        for key,_ in self.selector.select(timeout):
+            pid = key.data
+            try:
+                data = key.fileobj.read(65536)
+            except OSError:
+                data = b''
+            if not data or not pid in self.children:
+                continue # Exited,reaped by `_reap`
+            line = data.strip().rsplit(b'\n',1)[-1]
+            try:
+                self.children[pid] = (key.fileobj,json.loads(line))
+            except ValueError:
+                pass # Partial line
+
+    def _forget(self,pid : int):
+        pipe,_ = self.children.pop(pid)
+        self.selector.unregister(pipe)
+        pipe.close()
+
+    def _reap(self) -> list:
+        '''Collects exited workers
+
+        Returns:
+            list : pids of the workers that exited
+        '''
+        exited = list()
+        while self.children:
+            try:
+                pid,status = os.waitpid(-1,os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:break
+            if pid in self.children:
+                self._forget(pid)
+                exited.append(pid)
+                if not self._stopping:
+                    self.logger.warning('Worker %s exited unexpectedly (status %s)' % (pid,status))
+        return exited
+
+    def stop_workers(self,pids : list):
+        '''Stops workers gracefully,killing those still alive once `graceful_timeout` is reached'''
+        for pid in pids:
+            try:
+                os.kill(pid,signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline,pids = time.monotonic() + self.graceful_timeout,set(pids)
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                try:
+                    if not os.waitpid(pid,os.WNOHANG)[0]:continue
+                except ChildProcessError:
+                    pass
+                pids.discard(pid)
+                if pid in self.children:self._forget(pid)
+            self._collect(0.1)
+        for pid in pids:
+            self.logger.warning('Worker %s killed after %ss' % (pid,self.graceful_timeout))
+            os.kill(pid,signal.SIGKILL)
+            os.waitpid(pid,0)
+            if pid in self.children:self._forget(pid)
+
+    def rolling_restart(self):
+        '''Replaces the workers one by one,a new one is started before an old one is stopped'''
+        for pid in list(self.children):
+            new = self.spawn()
+            deadline = time.monotonic() + max(self.stats_interval * 2,1)
+            while self.children.get(new,(None,None))[1] is None and time.monotonic() < deadline:
+                self._collect(0.1) # Wait for the new worker to be up
+            self.stop_workers([pid])
+        self.logger.info('Rolling restart finished')
+
+    def serve_forever(self):
+        '''Starts the workers,and supervises them until `SIGTERM` / `SIGINT` is received'''
+        if self.reuse_port:
+            # Every worker binds its own listener,ours would steal a share of the connections
+            self.server.server_address = self.server.socket.getsockname()[:2]
+            self.server.socket.close()
+        def stop(*a):self._stopping = True
+        def restart(*a):self._restarting = True
+        signal.signal(signal.SIGTERM,stop)
+        signal.signal(signal.SIGINT,stop)
+        signal.signal(signal.SIGHUP,restart)
+        for _ in range(self.workers):self.spawn()
+        last_spawn = time.monotonic()
+        try:
+            while not self._stopping:
+                self._collect(0.5)
+                for _ in self._reap():
+                    # Crashed,but don't restart in a tight loop
+                    time.sleep(max(0,1 - (time.monotonic() - last_spawn)))
+                    self.spawn()
+                    last_spawn = time.monotonic()
+                if self._restarting:
+                    self._restarting = False
+                    self.rolling_restart()
+        finally:
+            self._stopping = True
+            self.stop_workers(list(self.children))
+            self.server.server_close()
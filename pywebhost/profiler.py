@@ -0,0 +1,209 @@
+'''On-demand profiling of a live server
+
+    server = PyWebHost(('',1234))
+    server.profiler = Profiler(every=100,routes=('/api/.*',))
+    server.route('/-/profile')(profiler_handler)
+    server.profiler.install_signal() # `kill -USR2` toggles it as well
+
+Once `enable`d,one in `every` requests that match `routes` is profiled with `cProfile` while a sampler thread
+takes snapshots of its stack.The results of every profiled request are merged into one profile,downloadable in
+`pstats` format (for `pstats`,snakeviz...) and as collapsed stacks (for flamegraph.pl,speedscope...).
+
+Requests that aren't picked run as usual,and while the profiler is disabled it costs a request one attribute check.
+Only `PyWebHost` (the threaded server) is profiled: coroutines of `AsyncPyWebHost` share one thread,where
+a profile can't be told apart from the others.
+'''
+import cProfile,pstats,marshal,io,itertools,re,signal,sys,threading
+from collections import Counter
+from http import HTTPStatus
+from .modules import BadRequestException,writestream
+
+class Profiler(object):
+    '''Profiles the requests of a server,see the module's documentation'''
+    def __init__(self,every : int = 100,routes : tuple = (),sample_interval : float = 0.005,deterministic : bool = True,max_depth : int = 128) -> None:
+        '''
+        Args:
+            every (int, optional): Profile one in `every` of the matching requests,`1` profiles all of them. Defaults to 100.
+            routes (tuple, optional): Only profile requests whose route is one of these patterns,or whose path matches
+                                      one of them (as regexes).Empty means every request. Defaults to ().
+            sample_interval (float, optional): Seconds between the stack samples,`0` disables sampling. Defaults to 0.005.
+            deterministic (bool, optional): Profile the requests with `cProfile`,which counts every call but slows them down.
+                                            Only one request is profiled that way at a time (since Python 3.12,
+                                            `cProfile` is process-wide),the others are only sampled.
+                                            With `False` only the stacks are sampled. Defaults to True.
+            max_depth (int, optional): Max count of frames of a sampled stack. Defaults to 128.
+        '''
+        self.every,self.sample_interval,self.deterministic,self.max_depth = max(every,1),sample_interval,deterministic,max_depth
+        self.routes = frozenset(routes)
+        self.patterns = [re.compile(pattern) for pattern in routes]
+        self.enabled = False
+        '''Whether requests are being profiled,see `enable` and `disable`'''
+        self.profiled = 0
+        '''Count of requests profiled so far'''
+        self.samples = 0
+        '''Count of stack samples taken so far'''
+        self.stats : pstats.Stats = None
+        '''The merged `cProfile` results,`None` until a request is profiled'''
+        self.stacks = Counter()
+        '''Collapsed stacks -> count of samples'''
+        self._counter = itertools.count(1)
+        self._active = dict() # Idents of the threads running a profiled request -> their route
+        self._lock = threading.Lock()
+        self._profiling = threading.Lock() # Held by the request being profiled with `cProfile`
+        self._stopped = threading.Event()
+        self._sampler : threading.Thread = None
+
+    def enable(self):
+        '''Starts profiling requests,safe to be called from signal handlers'''
+        self.enabled = True
+        self._stopped.clear()
+        if self.sample_interval and (self._sampler is None or not self._sampler.is_alive()):
+            self._sampler = threading.Thread(target=self._sample_forever,name='Profiler sampler',daemon=True)
+            self._sampler.start()
+
+    def disable(self):
+        '''Stops profiling requests,the results are kept until `reset`'''
+        self.enabled = False
+        self._stopped.set()
+
+    def toggle(self) -> bool:
+        '''Enables the profiler if it's disabled and vice versa,returns whether it's enabled now'''
+        if self.enabled:self.disable()
+        else:self.enable()
+        return self.enabled
+
+    def reset(self):
+        '''Discards the results'''
+        with self._lock:
+            self.stats,self.stacks,self.profiled,self.samples = None,Counter(),0,0
+
+    def install_signal(self,signum : int = signal.SIGUSR2):
+        '''Toggles the profiler when the process receives `signum`,must be called from the main thread'''
+        signal.signal(signum,lambda *a:self.toggle())
+
+    def selects(self,request) -> bool:
+        '''Whether `request` (routed already) should be profiled'''
+        if not self.enabled:return False
+        if self.routes and request.route not in self.routes and not any(pattern.fullmatch(request.path) for pattern in self.patterns):
+            return False
+        return next(self._counter) % self.every == 0
+
+    def run(self,request,function,*args):
+        '''Calls `function(*args)`,profiling it as `request`'''
+        ident,profile = threading.get_ident(),None
+        try:
+            self._active[ident] = request.route or request.path
+            if self.deterministic and self._profiling.acquire(blocking=False):
+                try:
+                    profile = cProfile.Profile()
+                    profile.enable()
+                except Exception as e:
+                    # e.g. another profiler is active
+                    request.log_debug('cProfile unavailable: %s',e)
+                    profile = None
+                    self._profiling.release()
+            return function(*args)
+        finally:
+            if profile:
+                profile.disable()
+                self._profiling.release()
+            self._active.pop(ident,None)
+            with self._lock:
+                self.profiled += 1
+                if profile:
+                    if self.stats is None:self.stats = pstats.Stats(profile)
+                    else:self.stats.add(profile)
+
+    def _sample_forever(self):
+        while not self._stopped.wait(self.sample_interval):
+            if self._active:self.sample()
+
+    def sample(self):
+        '''Takes a snapshot of the stacks of the requests being profiled'''
+        frames = sys._current_frames()
+        stop = Profiler.run.__code__
+        for ident,route in list(self._active.items()):
+            frame = frames.get(ident)
+            stack = list()
+            while frame is not None and frame.f_code is not stop and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name,code.co_filename,code.co_firstlineno))
+                frame = frame.f_back
+            if not stack:continue
+            stack.append(route)
+            key = ';'.join(reversed(stack))
+            with self._lock:
+                self.stacks[key] += 1
+                self.samples += 1
+
+    def dump_stats(self) -> bytes:
+        '''The merged profile in `pstats` format,what `pstats.Stats.dump_stats` writes
+
+        Raises:
+            ValueError: If no request was profiled with `cProfile` yet
+        '''
+        with self._lock:
+            if self.stats is None:raise ValueError('No request was profiled')
+            return marshal.dumps(self.stats.stats)
+
+    def collapsed(self) -> str:
+        '''The sampled stacks in the collapsed format of flamegraph.pl,`route;caller;callee count` on every line'''
+        with self._lock:
+            return ''.join('%s %d\n' % item for item in sorted(self.stacks.items()))
+
+    def report(self,sort : str = 'cumulative',limit : int = 50) -> str:
+        '''The merged profile as text,sorted by `sort` (see `pstats.Stats.sort_stats`)'''
+        stream = io.StringIO()
+        with self._lock:
+            if self.stats is None:return 'No request was profiled\n'
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def status(self) -> dict:
+        return {'enabled' : self.enabled,'profiled' : self.profiled,'samples' : self.samples,'every' : self.every,'routes' : sorted(self.routes)}
+
+def profiler_handler(initator,request,content):
+    '''Admin route of the `profiler` of the server
+
+        server.route('/-/profile')(profiler_handler)
+
+    - `POST ?action=start|stop|toggle|reset` switches the profiler
+    - `GET ?format=text` (the default) shows the merged profile,`&sort=` sets its order (e.g. `tottime`)
+    - `GET ?format=pstats` downloads it for `pstats`
+    - `GET ?format=collapsed` downloads the sampled stacks for flamegraphs
+
+    The route should be kept away from the public,e.g. with a wrapper checking the client
+    '''
+    profiler : Profiler = getattr(initator,'profiler',None)
+    if profiler is None:raise BadRequestException(HTTPStatus.NOT_FOUND,'Profiling is disabled')
+    query = request.query
+    action,format = query.get('action',[None])[0],query.get('format',['text'])[0]
+    if action:
+        if request.command != 'POST':
+            raise BadRequestException(HTTPStatus.METHOD_NOT_ALLOWED,'Actions must be POSTed')
+        actions = {'start' : profiler.enable,'stop' : profiler.disable,'toggle' : profiler.toggle,'reset' : profiler.reset}
+        if action not in actions:raise BadRequestException(HTTPStatus.BAD_REQUEST,'Unknown action %r' % action)
+        actions[action]()
+        content_type,body = 'text/plain; charset=utf-8',''.join('%s: %s\n' % item for item in profiler.status().items())
+    else:
+        if format == 'pstats':
+            try:
+                body = profiler.dump_stats()
+            except ValueError as e:
+                raise BadRequestException(HTTPStatus.NOT_FOUND,str(e))
+            content_type = 'application/octet-stream'
+        elif format == 'collapsed':
+            content_type,body = 'text/plain; charset=utf-8',profiler.collapsed()
+        elif format == 'text':
+            try:
+                content_type,body = 'text/plain; charset=utf-8',profiler.report(query.get('sort',['cumulative'])[0])
+            except KeyError as e:
+                raise BadRequestException(HTTPStatus.BAD_REQUEST,'Unknown sort key %s' % e)
+        else:
+            raise BadRequestException(HTTPStatus.BAD_REQUEST,'Unknown format %r' % format)
+    request.send_response(HTTPStatus.OK)
+    request.send_header('Content-Type',content_type)
+    request.send_header('Cache-Control','no-store')
+    if format == 'pstats':request.send_header('Content-Disposition','attachment; filename="pywebhost.prof"')
+    return writestream(request,body.encode() if isinstance(body,str) else body)
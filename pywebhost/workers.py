@@ -0,0 +1,188 @@
+'''Bounded worker pool for serving connections
+
+Instead of spawning an OS thread per connection,`PyWebHost` can hand accepted sockets to
+a pool of long-lived workers fed by a bounded queue:
+
+    server = PyWebHost(('',1234))
+    server.max_workers = 64
+    server.worker_queue_size = 256
+    server.worker_overflow = WorkerPool.REJECT
+    server.serve_forever()
+'''
+import logging,queue,threading,time
+
+class WorkerPool(object):
+    '''Fixed or elastic pool of worker threads fed by a bounded FIFO queue
+
+    - The pool keeps `min_workers` threads alive,and spawns more (up to `max_workers`) when every
+      worker is busy.Extra workers exit after being idle for `idle_timeout` seconds
+    - When the queue is full,`overflow` decides what `submit` does:
+        - `WorkerPool.BLOCK`  : wait until there's room in the queue
+        - `WorkerPool.REJECT` : return `False`,the caller is expected to answer with a 503
+        - `WorkerPool.DROP`   : return `False`,the caller is expected to drop the job silently
+
+    Set `min_workers` to `max_workers` for a fixed size pool
+    '''
+    BLOCK = 'block'
+    REJECT = 'reject'
+    DROP = 'drop'
+
+    def __init__(self,min_workers : int = 4,max_workers : int = 32,queue_size : int = 128,overflow : str = BLOCK,idle_timeout : float = 30,name : str = 'PyWebHostWorker') -> None:
+        '''Creates the pool,the `min_workers` threads are started immediately
+
+        Args:
+            min_workers (int, optional): Threads to be kept alive. Defaults to 4.
+            max_workers (int, optional): Max count of threads. Defaults to 32.
+            queue_size (int, optional): Max count of jobs waiting for a worker. Defaults to 128.
+            overflow (str, optional): What to do when the queue is full. Defaults to `WorkerPool.BLOCK`.
+            idle_timeout (float, optional): Seconds before an extra worker exits. Defaults to 30.
+            name (str, optional): Name prefix of the threads. Defaults to 'PyWebHostWorker'.
+        '''
+        if not overflow in (WorkerPool.BLOCK,WorkerPool.REJECT,WorkerPool.DROP):
+            raise ValueError('Unknown overflow behaviour %s' % overflow)
+        self.min_workers,self.max_workers = min(min_workers,max_workers),max_workers
+        self.overflow,self.idle_timeout,self.name = overflow,idle_timeout,name
+        self.queue = queue.Queue(max(queue_size,1))
+        self.logger = logging.getLogger('WorkerPool')
+        self.on_dequeue = None
+        '''Optional callback,called with the seconds a job has waited in the queue'''
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._busy = self._spawned = 0
+        self._submitted = self._completed = self._rejected = self._dropped = 0
+        self._wait_total = self._wait_max = 0.0
+        self._shutdown = False
+        for _ in range(self.min_workers):self._spawn()
+
+    def _spawn(self):
+        '''Starts a new worker,must be called with `_lock` held'''
+        self._spawned += 1
+        thread = threading.Thread(target=self._work,name='%s-%d' % (self.name,self._spawned),daemon=True)
+        self._threads.add(thread)
+        thread.start()
+
+    def _work(self):
+        thread = threading.current_thread()
+        while True:
+            try:
+                if self._shutdown:
+                    # The sentinels may not have fit in the queue,stop once it's drained
+                    item = self.queue.get_nowait()
+                else:
+                    elastic = len(self._threads) > self.min_workers
+                    item = self.queue.get(timeout=self.idle_timeout if elastic else None)
+            except queue.Empty:
+                if self._shutdown:item = None
+                else:
+                    with self._lock:
+                        if len(self._threads) > self.min_workers:
+                            self._threads.discard(thread)
+                            return
+                    continue
+            if item is None:
+                # Stop sentinel
+                with self._lock:self._threads.discard(thread)
+                return
+            enqueued,function,args = item
+            wait = time.monotonic() - enqueued
+            with self._lock:
+                self._busy += 1
+                self._wait_total += wait
+                if wait > self._wait_max:self._wait_max = wait
+            try:
+                if self.on_dequeue:self.on_dequeue(wait)
+                function(*args)
+            except Exception as e:
+                self.logger.exception('Worker job failed: %s' % e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._completed += 1
+
+    def submit(self,function,*args) -> bool:
+        '''Queues `function(*args)` to be called by a worker
+
+        Returns:
+            bool : `False` if the job was rejected / dropped because of overflow or shutdown
+        '''
+        return self._submit(function,args,self.overflow == WorkerPool.BLOCK)
+
+    def submit_nowait(self,function,*args) -> bool:
+        '''Like `submit`,but never waits for room in the queue,even with `WorkerPool.BLOCK` overflow
+
+        Returns:
+            bool : `False` if the queue is full (counted as rejected) or the pool is shut down
+        '''
+        return self._submit(function,args,False)
+
+    def _submit(self,function,args : tuple,block : bool) -> bool:
+        if self._shutdown:return False
+        with self._lock:
+            idle = len(self._threads) - self._busy
+            if idle <= self.queue.qsize() and len(self._threads) < self.max_workers:
+                self._spawn()
+            self._submitted += 1
+        item = (time.monotonic(),function,args)
+        if block:
+            self.queue.put(item)
+            return True
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._lock:
+                if self.overflow != WorkerPool.DROP:self._rejected += 1
+                else:self._dropped += 1
+            return False
+
+    def shutdown(self,wait : bool = True,timeout : float = None):
+        '''Stops all workers once the queued jobs are done
+
+        Never blocks on a full queue: the workers stop by themselves once it's drained
+
+        Args:
+            wait (bool, optional): Wait for the workers to stop. Defaults to True.
+            timeout (float, optional): Max seconds to wait for all of them,`None` waits forever. Defaults to None.
+        '''
+        self._shutdown = True
+        with self._lock:threads = list(self._threads)
+        for _ in threads:
+            # Wakes up the idle workers
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                break
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in threads:
+                thread.join(None if deadline is None else max(deadline - time.monotonic(),0))
+
+    def stats(self) -> dict:
+        '''Occupancy and queueing statistics of the pool
+
+        Returns:
+            dict : with these keys
+                - `workers`,`busy`,`idle`            : Current thread counts
+                - `occupancy`                        : `busy` / `max_workers`
+                - `queued`,`queue_size`              : Current / max count of waiting jobs
+                - `submitted`,`completed`            : Job counts
+                - `rejected`,`dropped`               : Jobs refused because of overflow
+                - `wait_avg`,`wait_max`              : Seconds jobs waited in the queue
+        '''
+        with self._lock:
+            workers,busy = len(self._threads),self._busy
+            started = self._completed + busy
+            return {
+                'workers' : workers,
+                'busy' : busy,
+                'idle' : workers - busy,
+                'occupancy' : busy / self.max_workers if self.max_workers else 0,
+                'queued' : self.queue.qsize(),
+                'queue_size' : self.queue.maxsize,
+                'submitted' : self._submitted,
+                'completed' : self._completed,
+                'rejected' : self._rejected,
+                'dropped' : self._dropped,
+                'wait_avg' : self._wait_total / started if started else 0.0,
+                'wait_max' : self._wait_max
+            }
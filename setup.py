@@ -18,5 +18,5 @@ setuptools.setup(
         "License :: OSI Approved :: Apache Software License",
         "Operating System :: OS Independent",
     ],install_requires=[],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file